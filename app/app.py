@@ -1,12 +1,32 @@
-from flask import Flask, render_template, request, jsonify, Response
+from flask import Flask, render_template, request, jsonify, Response, g
 import os
 import base64
 import json
-import cv2
+import threading
+import time
+import uuid
+from utils.analysis_profiles import DEFAULT_PROFILE, resolve_profile
 from utils.emotion_detection import process_video
-from utils.generative_ai import train_generative_model, generate_synthetic_image_with_ip
+from utils.frame_sampling import AUTO, SAMPLING_STRATEGIES
+from utils.job_queue import COMPLETED, FAILED, JobStore, JobQueue, QueueFullError, job_eta
+from utils.face_detectors import HAAR
+from utils.live_emotion import LiveSessionManager
+from utils.metrics import metrics, request_seconds
+from utils.onnx_backend import NATIVE
+from utils.profiling import PROFILING_MODES, profile_to
+from utils.video_stream import (ANNOTATION_MODES, CACHED, LIVE, CachedAnnotations, LiveAnnotations,
+                                SharedVideoStream, StreamHub)
+from utils.result_cache import CACHED, CLAIMED, PENDING, ResultCache
+from utils.frame_ingest import (FrameAnalyzer, decode_frame, new_session_id, save_frame_bytes, save_frame_stream,
+                                session_frame_path, valid_session_id)
+from utils.generative_ai import ImageGenerationService, train_generative_model
+from utils.story_generation import StoryGenerator, build_story_prompt
+from utils.emotion_timeline import DEFAULT_MAX_POINTS, query_timeline, timeline_sample
+from utils.similarity_index import SimilarityIndex
+from utils.stats_index import FACE_SORT_COLUMNS, INDEX_FILE, VIDEO_SORT_COLUMNS, StatsIndex
+from utils.stats_storage import BINARY, STATS_FORMATS, read_face_statistics, read_thumbnails
+from utils.model_registry import models_status, set_max_diffusion_pipelines, warm_up
 from huggingface_hub import login
-from transformers import pipeline  # Import Hugging Face pipeline for text generation
 import logging
 
 logging.basicConfig(level=logging.DEBUG)
@@ -15,17 +35,154 @@ app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['STATS_FOLDER'] = 'emotion_stats'
 app.config['GENAI_FOLDER'] = 'generative_ai_data'
+app.config['JOBS_FOLDER'] = 'jobs'
+app.config['CACHE_FOLDER'] = 'cache'
+# Frames saved through /save_frame, one file per session
+app.config['FRAMES_FOLDER'] = os.path.join(app.config['GENAI_FOLDER'], 'frames')
+app.config['MAX_FRAME_BYTES'] = int(os.getenv('MAX_FRAME_BYTES', 20 * 1024 ** 2))
+app.config['CACHE_MAX_BYTES'] = int(os.getenv('CACHE_MAX_BYTES', 10 * 1024 ** 3))
+app.config['JOB_WORKERS'] = int(os.getenv('JOB_WORKERS', 2))
+app.config['JOB_MAX_PENDING'] = int(os.getenv('JOB_MAX_PENDING', 256))
+# Completed/failed job records are pruned past this age (seconds) or count
+app.config['JOB_RETENTION_SECONDS'] = int(os.getenv('JOB_RETENTION_SECONDS', 7 * 24 * 3600))
+app.config['JOB_MAX_FINISHED'] = int(os.getenv('JOB_MAX_FINISHED', 1000))
+app.config['ANALYSIS_BATCH_SIZE'] = int(os.getenv('ANALYSIS_BATCH_SIZE', 16))
+app.config['DETECT_EVERY'] = int(os.getenv('DETECT_EVERY', 3))
+app.config['STATS_FORMAT'] = os.getenv('STATS_FORMAT', BINARY)
+app.config['FRAME_SAMPLING'] = os.getenv('FRAME_SAMPLING', AUTO)
+# Default analysis profile for /upload: actions, face detector and detection resolution
+app.config['ANALYSIS_PROFILE'] = os.getenv('ANALYSIS_PROFILE', DEFAULT_PROFILE)
+# Profile every job ('cprofile' or 'stacks', see utils.profiling); empty disables it
+app.config['JOB_PROFILING'] = os.getenv('JOB_PROFILING', '')
+# Worker threads per process_video pipeline stage
+app.config['DETECT_WORKERS'] = int(os.getenv('DETECT_WORKERS', 1))
+app.config['ANALYZE_WORKERS'] = int(os.getenv('ANALYZE_WORKERS', 1))
+app.config['ENCODE_WORKERS'] = int(os.getenv('ENCODE_WORKERS', 1))
+app.config['CHECKPOINT_EVERY'] = int(os.getenv('CHECKPOINT_EVERY', 100))
+# Minimum seconds between /jobs/<job_id>/events updates (and partial per-face results)
+app.config['PROGRESS_EVENT_INTERVAL'] = float(os.getenv('PROGRESS_EVENT_INTERVAL', 1.0))
+# Seconds between live emotion updates sent to clients
+app.config['LIVE_UPDATE_INTERVAL'] = float(os.getenv('LIVE_UPDATE_INTERVAL', 0.5))
+# Seconds a finished live session's final snapshot stays available, and seconds after which
+# a running live session nobody reads (snapshot, events or pushed frames) is stopped
+app.config['LIVE_SESSION_TTL'] = float(os.getenv('LIVE_SESSION_TTL', 300))
+app.config['LIVE_IDLE_TIMEOUT'] = float(os.getenv('LIVE_IDLE_TIMEOUT', 600))
+# End-to-end latency budget (seconds) for real-time live sessions and /video_feed streams
+app.config['TARGET_LATENCY'] = float(os.getenv('TARGET_LATENCY', 0.2))
+# /video_feed output width in pixels (0 keeps the video's resolution) and JPEG quality
+app.config['VIDEO_FEED_WIDTH'] = int(os.getenv('VIDEO_FEED_WIDTH', 0))
+app.config['VIDEO_FEED_QUALITY'] = int(os.getenv('VIDEO_FEED_QUALITY', 80))
+# Concurrent /generate_synthetic_image requests with the same model and settings share one
+# diffusion call of up to GENERATION_BATCH_SIZE images, collected for GENERATION_BATCH_WINDOW seconds
+app.config['GENERATION_BATCH_SIZE'] = int(os.getenv('GENERATION_BATCH_SIZE', 4))
+app.config['GENERATION_BATCH_WINDOW'] = float(os.getenv('GENERATION_BATCH_WINDOW', 0.1))
+# /generate_ai_story: stories are cached per prompt (STORY_CACHE_SIZE entries, expiring after
+# STORY_CACHE_TTL seconds) and concurrent requests share one GPT-2 call of up to STORY_BATCH_SIZE prompts
+app.config['STORY_MAX_LENGTH'] = int(os.getenv('STORY_MAX_LENGTH', 200))
+app.config['STORY_CACHE_SIZE'] = int(os.getenv('STORY_CACHE_SIZE', 256))
+app.config['STORY_CACHE_TTL'] = float(os.getenv('STORY_CACHE_TTL', 3600))
+app.config['STORY_BATCH_SIZE'] = int(os.getenv('STORY_BATCH_SIZE', 8))
+app.config['STORY_BATCH_WINDOW'] = float(os.getenv('STORY_BATCH_WINDOW', 0.05))
+# stream=true stories are generated one model.generate call each; at most STORY_MAX_STREAMS run at once
+app.config['STORY_MAX_STREAMS'] = int(os.getenv('STORY_MAX_STREAMS', 1))
+
+# SQLite index of every processed stats folder, for queries across videos
+app.config['STATS_INDEX'] = os.getenv('STATS_INDEX', os.path.join(app.config['STATS_FOLDER'], INDEX_FILE))
+# Vector index of emotion timelines and face embeddings, for similarity search across videos
+app.config['SIMILARITY_INDEX'] = os.getenv('SIMILARITY_INDEX',
+                                           os.path.join(app.config['STATS_FOLDER'], 'similarity_index'))
+# DeepFace.represent model for per-face identity embeddings (e.g. Facenet); empty disables them
+app.config['FACE_EMBEDDING_MODEL'] = os.getenv('FACE_EMBEDDING_MODEL', '')
 
 # Ensure upload, stats, and generative AI folders exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['STATS_FOLDER'], exist_ok=True)
 os.makedirs(app.config['GENAI_FOLDER'], exist_ok=True)
 
+stats_index = StatsIndex(app.config['STATS_INDEX'])
+similarity_index = SimilarityIndex(app.config['SIMILARITY_INDEX'])
+
+def remove_from_indexes(stats_folder):
+    stats_index.remove(stats_folder)
+    similarity_index.remove(stats_folder)
+
+# Content-addressed cache of uploads and finished stats folders; evicted folders leave the indexes
+result_cache = ResultCache(app.config['CACHE_FOLDER'], app.config['UPLOAD_FOLDER'],
+                           max_bytes=app.config['CACHE_MAX_BYTES'], on_evict=remove_from_indexes)
+
+def run_video_job(progress_callback, cache_key=None, video_hash=None, profiling=None, **params):
+    """
+    Job runner: process the video, then register the stats folder in the result cache.
+    With profiling set the job's profile is written into its stats folder.
+    """
+    try:
+        with profile_to(params['output_folder'], profiling):
+            process_video(progress_callback=progress_callback, stats_index=app.config['STATS_INDEX'],
+                          similarity_index=similarity_index, **params)
+    except Exception:
+        result_cache.clear_pending(cache_key)
+        raise
+    if cache_key is not None:
+        result_cache.put(cache_key, video_hash, params['output_folder'])
+
+# Background video processing: uploads are queued and processed by a bounded worker pool.
+# Unfinished jobs are persisted in JOBS_FOLDER and picked up again on restart.
+job_queue = JobQueue(JobStore(app.config['JOBS_FOLDER'],
+                              retention_seconds=app.config['JOB_RETENTION_SECONDS'],
+                              max_finished=app.config['JOB_MAX_FINISHED']),
+                     run_video_job,
+                     max_workers=app.config['JOB_WORKERS'],
+                     max_pending=app.config['JOB_MAX_PENDING'])
+# Interrupted jobs continue from their last checkpoint
+job_queue.recover(resume_params={"resume": True})
+for recovered_job in job_queue.list():
+    if recovered_job['status'] in ('queued', 'running') and recovered_job['params'].get('cache_key'):
+        result_cache.mark_pending(recovered_job['params']['cache_key'], recovered_job['job_id'],
+                                  recovered_job['params'].get('video_hash'))
+
+# Live webcam/file emotion sessions, streamed to clients as server-sent events
+live_sessions = LiveSessionManager(app.config['LIVE_SESSION_TTL'], app.config['LIVE_IDLE_TIMEOUT'])
+# /video_feed producers, shared by the clients watching the same video with the same options
+video_streams = StreamHub()
+# Emotion analysis of single posted frames, one analyzer per detector/backend combination
+frame_analyzers = {}
+frame_analyzers_lock = threading.Lock()
+# Img2img generation on resident diffusion pipelines, micro-batched across requests
+image_generation = ImageGenerationService(app.config['GENAI_FOLDER'],
+                                          max_batch_size=app.config['GENERATION_BATCH_SIZE'],
+                                          max_wait=app.config['GENERATION_BATCH_WINDOW'])
+story_generator = StoryGenerator(max_length=app.config['STORY_MAX_LENGTH'],
+                                 max_batch_size=app.config['STORY_BATCH_SIZE'],
+                                 max_wait=app.config['STORY_BATCH_WINDOW'],
+                                 cache_size=app.config['STORY_CACHE_SIZE'],
+                                 cache_ttl=app.config['STORY_CACHE_TTL'],
+                                 max_streams=app.config['STORY_MAX_STREAMS'])
+
 # Hugging Face credentials (loaded from environment variables)
 HUGGINGFACE_TOKEN = os.getenv('HUGGINGFACE_TOKEN')
 
-# Load a text generation model from Hugging Face
-story_generator = pipeline("text-generation", model="gpt2")  # You can replace "gpt2" with any other model
+# Models are loaded once per process by utils.model_registry. WARMUP_MODELS (comma-separated,
+# e.g. "retinaface,deepface,gpt2,sd_img2img:stabilityai/stable-diffusion-2") loads them at startup.
+set_max_diffusion_pipelines(os.getenv('MAX_DIFFUSION_PIPELINES', 1))
+warm_up([name.strip() for name in os.getenv('WARMUP_MODELS', '').split(',') if name.strip()])
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    # Streaming responses are timed until their first byte, not until the stream ends
+    if 'request_start' in g:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        request_seconds.observe(time.perf_counter() - g.request_start,
+                                method=request.method, route=route, status=response.status_code)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Stage timings and per-route request latency histograms in the Prometheus text format."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/')
 def index():
@@ -54,81 +211,581 @@ def upload_video():
     if video_file.filename == '':
         return jsonify({"error": "No selected file"}), 400
 
-    video_path = os.path.join(app.config['UPLOAD_FOLDER'], video_file.filename)
-    video_file.save(video_path)
-
     frame_interval = int(request.form.get('frame_interval', 40))
+    batch_size = int(request.form.get('batch_size', app.config['ANALYSIS_BATCH_SIZE']))
+    detect_every = int(request.form.get('detect_every', app.config['DETECT_EVERY']))
+    reid = request.form.get('reid', 'false').lower() == 'true'
+    stats_format = request.form.get('stats_format', app.config['STATS_FORMAT'])
+    sampling = request.form.get('sampling', app.config['FRAME_SAMPLING'])
+    samples_per_second = request.form.get('samples_per_second', type=float)
+    resume = request.form.get('resume', 'true').lower() == 'true'
+    profiling = request.form.get('profiling', app.config['JOB_PROFILING']) or None
+    actions = request.form.get('actions')
+    face_embedding_model = request.form.get('face_embedding_model', app.config['FACE_EMBEDDING_MODEL']) or None
+    try:
+        profile = resolve_profile(request.form.get('profile', app.config['ANALYSIS_PROFILE']),
+                                  actions=actions.split(',') if actions else None,
+                                  detector=request.form.get('detector'),
+                                  detection_size=request.form.get('detection_size', type=int),
+                                  min_face_size=request.form.get('min_face_size', type=int),
+                                  backend=request.form.get('backend'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if sampling not in SAMPLING_STRATEGIES:
+        return jsonify({"error": f"sampling must be one of {list(SAMPLING_STRATEGIES)}"}), 400
+    if stats_format not in STATS_FORMATS:
+        return jsonify({"error": f"stats_format must be one of {list(STATS_FORMATS)}"}), 400
+    if profiling is not None and profiling not in PROFILING_MODES:
+        return jsonify({"error": f"profiling must be one of {list(PROFILING_MODES)}"}), 400
+
+    # Parameters that change the resulting statistics (worker counts do not)
+    analysis_params = {
+        "frame_interval": frame_interval,
+        "batched": batch_size > 1,
+        "detect_every": detect_every,
+        "reid": reid,
+        "stats_format": stats_format,
+        "sampling": sampling,
+        "samples_per_second": samples_per_second,
+        "profile": profile,
+        "face_embedding_model": face_embedding_model,
+    }
+
+    # Uploads are stored by content hash, so re-submissions of the same clip hit the cache
+    video_hash, video_path = result_cache.store_upload(video_file.stream, video_file.filename)
+    cache_key = result_cache.make_key(video_hash, analysis_params)
+
+    # Profiled uploads always run, so that they produce a profile, in a folder of their own:
+    # they neither serve nor overwrite the cached result
+    if profiling is not None:
+        status, value = None, None
+        stats_folder = os.path.join(app.config['STATS_FOLDER'],
+                                    f"{os.path.splitext(video_file.filename)[0]}_{cache_key[:12]}"
+                                    f"_profile_{uuid.uuid4().hex[:8]}")
+    else:
+        # Checked and claimed in one step, so identical concurrent uploads submit one job
+        status, value = result_cache.reserve(cache_key, video_hash)
+        stats_folder = os.path.join(app.config['STATS_FOLDER'],
+                                    f"{os.path.splitext(video_file.filename)[0]}_{cache_key[:12]}")
+    if status == CACHED:
+        return jsonify({
+            "message": "Video already processed",
+            "cached": True,
+            "status": "completed",
+            "stats_folder": value,
+        })
+    if status == PENDING:
+        job = job_queue.get(value)
+        return jsonify({
+            "message": "Video is already being processed",
+            "cached": False,
+            "job_id": value,
+            "status": job['status'],
+            "stats_folder": job['params']['output_folder'],
+        }), 202
 
-    stats_folder = os.path.join(app.config['STATS_FOLDER'], os.path.splitext(video_file.filename)[0])
     os.makedirs(stats_folder, exist_ok=True)
-    process_video(video_path, stats_folder, frame_interval)
 
-    return jsonify({"message": "Video processed successfully", "stats_folder": stats_folder})
+    try:
+        job = job_queue.submit({
+            "video_path": video_path,
+            "output_folder": stats_folder,
+            "frame_interval": frame_interval,
+            "batch_size": batch_size,
+            "detect_every": detect_every,
+            "reid": reid,
+            "stats_format": stats_format,
+            "detect_workers": app.config['DETECT_WORKERS'],
+            "analyze_workers": app.config['ANALYZE_WORKERS'],
+            "encode_workers": app.config['ENCODE_WORKERS'],
+            "sampling": sampling,
+            "samples_per_second": samples_per_second,
+            "resume": resume,
+            "checkpoint_every": app.config['CHECKPOINT_EVERY'],
+            "partial_results_interval": app.config['PROGRESS_EVENT_INTERVAL'],
+            "profile": profile,
+            "face_embedding_model": face_embedding_model,
+            "profiling": profiling,
+            "cache_key": cache_key if status == CLAIMED else None,
+            "video_hash": video_hash,
+        })
+    except Exception as e:
+        # Give the claim back, so waiting and later uploads of this video are not blocked
+        if status == CLAIMED:
+            result_cache.clear_pending(cache_key)
+        if isinstance(e, QueueFullError):
+            return jsonify({"error": str(e)}), 503
+        raise
+    if status == CLAIMED:
+        result_cache.mark_pending(cache_key, job['job_id'], video_hash)
+
+    return jsonify({
+        "message": "Video queued for processing",
+        "cached": False,
+        "job_id": job['job_id'],
+        "status": job['status'],
+        "stats_folder": stats_folder,
+    }), 202
+
+@app.route('/cache', methods=['GET'])
+def cache_stats():
+    logging.debug("Route hit: /cache")
+    return jsonify(result_cache.stats())
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    logging.debug("Route hit: /jobs")
+    return jsonify({"jobs": [_job_summary(job) for job in job_queue.list()]})
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    logging.debug(f"Route hit: /jobs/{job_id}")
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(_job_summary(job))
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """
+    Server-sent events with the job summary (progress, ETA, stage throughput and the
+    per-face aggregates so far) whenever it changes, at most every PROGRESS_EVENT_INTERVAL
+    seconds. The stream ends with the completed or failed job.
+    """
+    logging.debug(f"Route hit: /jobs/{job_id}/events")
+    if job_queue.get(job_id) is None:
+        return jsonify({"error": "Job not found"}), 404
+
+    def generate():
+        version = None
+        while True:
+            # Times out periodically so idle streams still get a keep-alive update
+            job, version = job_queue.wait_for_change(job_id, version, timeout=15)
+            if job is None:
+                return
+            yield f"data: {json.dumps(_job_summary(job))}\n\n"
+            if job['status'] in (COMPLETED, FAILED):
+                return
+            time.sleep(app.config['PROGRESS_EVENT_INTERVAL'])
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/jobs/<job_id>/resume', methods=['POST'])
+def resume_job(job_id):
+    logging.debug(f"Route hit: /jobs/{job_id}/resume")
+    job = job_queue.retry(job_id, resume=True)
+    if job is None:
+        return jsonify({"error": "Job not found or not in failed state"}), 409
+    params = job['params']
+    if params.get('cache_key'):
+        result_cache.mark_pending(params['cache_key'], job_id, params.get('video_hash'))
+    return jsonify(_job_summary(job)), 202
+
+def _job_summary(job):
+    return {
+        "job_id": job['job_id'],
+        "status": job['status'],
+        "progress": job['progress'],
+        "eta_seconds": job_eta(job),
+        "stats_folder": job['params']['output_folder'],
+        "created_at": job['created_at'],
+        "started_at": job['started_at'],
+        "finished_at": job['finished_at'],
+        "error": job['error'],
+    }
 
 @app.route('/video_feed')
 def video_feed():
+    """
+    Annotated MJPEG stream of video_path, replayed at the video's frame rate.
+
+    Query parameters: frame_interval and sampling pick the streamed frames; realtime=true
+    instead always sends the newest frame, adapting the frame interval to target_latency.
+    annotate is "cached" (boxes and emotions from stats_folder, the default when it is
+    given), "live" (run detection on the streamed frames, the default otherwise) or "none".
+    width and quality set the output size and JPEG quality. Clients asking for the same
+    video with the same options share one decode/annotate/encode producer.
+    """
     logging.debug("Route hit: /video_feed")
     video_path = request.args.get('video_path')
     frame_interval = int(request.args.get('frame_interval', 40))
+    sampling = request.args.get('sampling', app.config['FRAME_SAMPLING'])
+    realtime = request.args.get('realtime', 'false').lower() == 'true'
+    target_latency = float(request.args.get('target_latency', app.config['TARGET_LATENCY']))
+    stats_folder = request.args.get('stats_folder')
+    annotate = request.args.get('annotate', CACHED if stats_folder else LIVE)
+    width = int(request.args.get('width', app.config['VIDEO_FEED_WIDTH'])) or None
+    quality = int(request.args.get('quality', app.config['VIDEO_FEED_QUALITY']))
+    if sampling not in SAMPLING_STRATEGIES:
+        return jsonify({"error": f"sampling must be one of {list(SAMPLING_STRATEGIES)}"}), 400
+    if annotate not in ANNOTATION_MODES:
+        return jsonify({"error": f"annotate must be one of {list(ANNOTATION_MODES)}"}), 400
+    if not video_path or not os.path.exists(video_path):
+        return jsonify({"error": "Video not found"}), 404
+    if annotate == CACHED and (not stats_folder or
+                               not os.path.exists(os.path.join(stats_folder, 'overall_statistics.json'))):
+        return jsonify({"error": "Statistics folder not found"}), 404
 
-    def generate_frames():
-        cap = cv2.VideoCapture(video_path)
-        frame_count = 0
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-
-            frame_count += 1
-            if frame_count % frame_interval != 0:
-                continue
-
-            ret, buffer = cv2.imencode('.jpg', frame)
-            frame = buffer.tobytes()
-
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-
-        cap.release()
-
-    return Response(generate_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    def start_stream(on_close):
+        if annotate == CACHED:
+            annotator = CachedAnnotations(stats_folder)
+        elif annotate == LIVE:
+            annotator = LiveAnnotations()
+        else:
+            annotator = None
+        return SharedVideoStream(video_path, annotator, width=width, quality=quality,
+                                 frame_interval=frame_interval, sampling=sampling, realtime=realtime,
+                                 target_latency=target_latency, on_close=on_close)
+
+    key = (os.path.abspath(video_path), annotate, stats_folder, width, quality, frame_interval, sampling,
+           realtime, target_latency)
+    try:
+        frames = video_streams.subscribe(key, start_stream)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 404
+    return Response(frames, mimetype='multipart/x-mixed-replace; boundary=frame')
+
+@app.route('/video_feed/stats', methods=['GET'])
+def video_feed_stats():
+    """Clients, encoded/dropped frame counts and real-time latency percentiles of /video_feed streams."""
+    logging.debug("Route hit: /video_feed/stats")
+    return jsonify(video_streams.stats())
+
+@app.route('/models', methods=['GET'])
+def list_models():
+    logging.debug("Route hit: /models")
+    return jsonify({"models": models_status()})
+
+@app.route('/live/start', methods=['POST'])
+def start_live():
+    """
+    Start a live emotion session. JSON body: source ("camera:<index>", "file:<path>"
+    or "push" for frames posted to /live/<session_id>/frames), optional duration in seconds,
+    realtime (default true: analyze the newest frame, drop stale ones), target_latency,
+    detector (default "haar"), detection_size and backend ("native", "onnx" or "onnx_int8").
+    """
+    logging.debug("Route hit: /live/start")
+    data = request.get_json(silent=True) or {}
+    source = data.get('source', 'camera:0')
+    duration = data.get('duration')
+    try:
+        session_id, _ = live_sessions.start(source, update_interval=app.config['LIVE_UPDATE_INTERVAL'],
+                                            duration=float(duration) if duration is not None else None,
+                                            realtime=bool(data.get('realtime', True)),
+                                            detector=data.get('detector', HAAR),
+                                            detection_size=data.get('detection_size'),
+                                            backend=data.get('backend', NATIVE),
+                                            target_latency=float(data.get('target_latency',
+                                                                          app.config['TARGET_LATENCY'])))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"session_id": session_id, "source": source}), 201
+
+@app.route('/live/<session_id>', methods=['GET'])
+def live_snapshot(session_id):
+    logging.debug("Route hit: /live/<session_id>")
+    engine = live_sessions.get(session_id)
+    if engine is None:
+        return jsonify({"error": "Live session not found"}), 404
+    return jsonify(engine.snapshot())
+
+@app.route('/live/<session_id>/events', methods=['GET'])
+def live_events(session_id):
+    logging.debug("Route hit: /live/<session_id>/events")
+    engine = live_sessions.get(session_id)
+    if engine is None:
+        return jsonify({"error": "Live session not found"}), 404
+    return Response(engine.events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/live/<session_id>/frames', methods=['POST'])
+def push_live_frame(session_id):
+    """Push one JPEG/PNG frame (raw request body) to a session started with source "push"."""
+    logging.debug("Route hit: /live/<session_id>/frames")
+    engine = live_sessions.get(session_id)
+    if engine is None:
+        return jsonify({"error": "Live session not found"}), 404
+    if not hasattr(engine.input, 'push'):
+        return jsonify({"error": "Session does not accept pushed frames"}), 400
+    try:
+        engine.input.push(_posted_frame_bytes())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"message": "Frame queued"}), 202
+
+@app.route('/live/<session_id>/stop', methods=['POST'])
+def stop_live(session_id):
+    logging.debug("Route hit: /live/<session_id>/stop")
+    engine = live_sessions.stop(session_id)
+    if engine is None:
+        return jsonify({"error": "Live session not found"}), 404
+    return jsonify(engine.snapshot())
+
+def _posted_frame_bytes():
+    """Encoded frame of the request: a multipart 'frame' file or the raw request body."""
+    if 'frame' in request.files:
+        return request.files['frame'].read()
+    return request.get_data(cache=False)
+
+def _frame_analyzer(profile):
+    key = (profile["detector"], profile["detection_size"], profile["min_face_size"], profile["backend"])
+    with frame_analyzers_lock:
+        if key not in frame_analyzers:
+            frame_analyzers[key] = FrameAnalyzer(*key)
+        return frame_analyzers[key]
 
 @app.route('/save_frame', methods=['POST'])
 def save_frame():
+    """
+    Save a frame for generative AI processing. The frame is posted as raw JPEG/PNG bytes
+    (application/octet-stream or image/*), as a multipart 'frame' file, or as a base64 data
+    URL in a JSON body's frame_data (the old format). Frames are stored per session:
+    the session_id query parameter selects it and a new session is created without one.
+    analyze=true also returns the faces and emotions found in the frame (profile selects
+    the detector and backend).
+    """
     logging.debug("Route hit: /save_frame")
-    frame_data = request.json.get('frame_data')
-    logging.debug(f"Received frame data: {frame_data[:100]}...")
-    if not frame_data:
-        return jsonify({"error": "No frame data provided"}), 400
+    session_id = request.args.get('session_id') or new_session_id()
+    if 'session_id' in request.args and not valid_session_id(session_id):
+        return jsonify({"error": "Invalid session_id"}), 400
+    analyze = request.args.get('analyze', 'false').lower() == 'true'
+    if request.content_length is not None and request.content_length > app.config['MAX_FRAME_BYTES']:
+        return jsonify({"error": f"Frame is larger than {app.config['MAX_FRAME_BYTES']} bytes"}), 413
 
     try:
-        frame_bytes = base64.b64decode(frame_data.split(',')[1])
-        frame_path = os.path.join(app.config['GENAI_FOLDER'], 'saved_frame.jpg')
-        with open(frame_path, 'wb') as f:
-            f.write(frame_bytes)
-
-        return jsonify({"message": "Frame saved successfully", "frame_path": frame_path})
+        folder = app.config['FRAMES_FOLDER']
+        if request.is_json:
+            frame_data = request.json.get('frame_data')
+            if not frame_data:
+                return jsonify({"error": "No frame data provided"}), 400
+            data = base64.b64decode(frame_data.split(',')[-1])
+        elif analyze:
+            # The bytes are needed in memory for decoding anyway
+            data = _posted_frame_bytes()
+        else:
+            # Stream the body to the session's file without buffering it
+            stream = request.files['frame'].stream if 'frame' in request.files else request.stream
+            frame_path = save_frame_stream(stream, folder, session_id, app.config['MAX_FRAME_BYTES'])
+            return jsonify({"message": "Frame saved successfully", "frame_path": frame_path,
+                            "session_id": session_id})
+
+        if not data:
+            return jsonify({"error": "No frame data provided"}), 400
+        frame_path = save_frame_bytes(data, folder, session_id)
+        result = {"message": "Frame saved successfully", "frame_path": frame_path, "session_id": session_id}
+        if analyze:
+            profile = resolve_profile(request.args.get('profile', app.config['ANALYSIS_PROFILE']))
+            result["faces"] = _frame_analyzer(profile).analyze(decode_frame(data))
+        return jsonify(result)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/get_stats', methods=['GET'])
 def get_stats():
+    """
+    Summary statistics of every face in a stats folder. Optional query parameters:
+    thumbnails=<n> adds the first n base64 thumbnails per face, series=true adds the
+    raw per-frame emotion/race/age/gender series.
+    """
     logging.debug("Route hit: /get_stats")
     stats_folder = request.args.get('stats_folder')
     if not stats_folder or not os.path.exists(stats_folder):
         return jsonify({"error": "Statistics folder not found"}), 404
 
+    thumbnails = int(request.args.get('thumbnails', 0))
+    series = request.args.get('series', 'false').lower() == 'true'
+
     try:
         stats_files = [f for f in os.listdir(stats_folder) if f.endswith('.json')]
         stats = {}
         for stats_file in stats_files:
             with open(os.path.join(stats_folder, stats_file), 'r') as f:
-                stats[stats_file] = json.load(f)
+                file_stats = json.load(f)
+            if 'face_id' in file_stats:
+                file_stats = read_face_statistics(stats_folder, file_stats, thumbnails=thumbnails, series=series)
+            stats[stats_file] = file_stats
 
         return jsonify(stats)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def _page_args():
+    return {"sort": request.args.get('sort'), "limit": request.args.get('limit', 50, type=int),
+            "offset": request.args.get('offset', 0, type=int),
+            "emotion": request.args.get('emotion'),
+            "min_confidence": request.args.get('min_confidence', type=float)}
+
+@app.route('/index/videos', methods=['GET'])
+def index_videos():
+    """
+    Indexed videos, paginated (limit, offset). Filters: dominant_emotion, profile, min_faces,
+    max_faces, folder (stats folder prefix), emotion + min_confidence. sort is a column of
+    VIDEO_SORT_COLUMNS or confidence:<emotion> / frames:<emotion>, '-' for descending.
+    """
+    logging.debug("Route hit: /index/videos")
+    args = _page_args()
+    args["sort"] = args["sort"] or '-processed_at'
+    try:
+        return jsonify(stats_index.videos(dominant_emotion=request.args.get('dominant_emotion'),
+                                          profile=request.args.get('profile'),
+                                          min_faces=request.args.get('min_faces', type=int),
+                                          max_faces=request.args.get('max_faces', type=int),
+                                          folder_prefix=request.args.get('folder'), **args))
+    except ValueError as e:
+        return jsonify({"error": str(e), "sort_columns": list(VIDEO_SORT_COLUMNS)}), 400
+
+@app.route('/index/faces', methods=['GET'])
+def index_faces():
+    """
+    Indexed faces across videos, paginated (limit, offset). Filters: stats_folder,
+    dominant_emotion, min_frames, max_frames, gender, emotion + min_confidence. sort is a
+    column of FACE_SORT_COLUMNS or confidence:<emotion> / frames:<emotion>.
+    """
+    logging.debug("Route hit: /index/faces")
+    args = _page_args()
+    args["sort"] = args["sort"] or '-total_frames'
+    try:
+        return jsonify(stats_index.faces(stats_folder=request.args.get('stats_folder'),
+                                         dominant_emotion=request.args.get('dominant_emotion'),
+                                         min_frames=request.args.get('min_frames', type=int),
+                                         max_frames=request.args.get('max_frames', type=int),
+                                         gender=request.args.get('gender'), **args))
+    except ValueError as e:
+        return jsonify({"error": str(e), "sort_columns": list(FACE_SORT_COLUMNS)}), 400
+
+@app.route('/index/summary', methods=['GET'])
+def index_summary():
+    logging.debug("Route hit: /index/summary")
+    return jsonify(stats_index.summary())
+
+@app.route('/get_thumbnail', methods=['GET'])
+def get_thumbnail():
+    logging.debug("Route hit: /get_thumbnail")
+    stats_folder = request.args.get('stats_folder')
+    face_id = request.args.get('face_id')
+    index = int(request.args.get('index', 0))
+    if not stats_folder or not face_id:
+        return jsonify({"error": "stats_folder and face_id are required"}), 400
+
+    summary_file = os.path.join(stats_folder, f"face_{face_id}_statistics.json")
+    if not os.path.exists(summary_file):
+        return jsonify({"error": "Face statistics not found"}), 404
+
+    with open(summary_file, 'r') as f:
+        face_statistics = json.load(f)
+    thumbnails = read_thumbnails(stats_folder, face_statistics, index, 1)
+    if not thumbnails:
+        return jsonify({"error": "Thumbnail not found"}), 404
+    return Response(thumbnails[0], mimetype='image/jpeg')
+
+@app.route('/timeline', methods=['GET'])
+def get_timeline():
+    """
+    Emotion timeline of one face (stats_folder, face_id) over [start_ms, end_ms], as raw
+    samples or precomputed aggregates: at most max_points points (default 1000), or the
+    aggregates at resolution_ms.
+    """
+    logging.debug("Route hit: /timeline")
+    stats_folder = request.args.get('stats_folder')
+    face_id = request.args.get('face_id')
+    if not stats_folder or not face_id:
+        return jsonify({"error": "stats_folder and face_id are required"}), 400
+
+    try:
+        start_ms = request.args.get('start_ms', type=float)
+        end_ms = request.args.get('end_ms', type=float)
+        max_points = int(request.args.get('max_points', DEFAULT_MAX_POINTS))
+        resolution_ms = request.args.get('resolution_ms')
+        resolution_ms = float(resolution_ms) if resolution_ms is not None else None
+    except ValueError:
+        return jsonify({"error": "max_points and resolution_ms must be numbers"}), 400
+
+    summary_file = os.path.join(stats_folder, f"face_{face_id}_statistics.json")
+    if not os.path.exists(summary_file):
+        return jsonify({"error": "Face statistics not found"}), 404
+    with open(summary_file, 'r') as f:
+        face_statistics = json.load(f)
+    if "timeline" not in face_statistics:
+        return jsonify({"error": "No timeline was recorded for this face"}), 404
+
+    timeline = query_timeline(os.path.join(stats_folder, face_statistics["timeline"]["folder"]), start_ms, end_ms,
+                              max_points, resolution_ms)
+    return jsonify(dict(timeline, face_id=face_id))
+
+@app.route('/similar/moments', methods=['GET'])
+def similar_moments():
+    """
+    The k moments (timeline samples of any face in any indexed video) whose emotion
+    probabilities are closest to a query: either a moment of a processed video (stats_folder,
+    face_id, timestamp_ms; that face's own samples are excluded; faces without a timeline use
+    their embedding_example) or emotion scores given as query parameters (e.g.
+    happy=70&surprise=30). approximate=true uses the inverted file index on large collections.
+    """
+    logging.debug("Route hit: /similar/moments")
+    k = request.args.get('k', 10, type=int)
+    approximate = request.args.get('approximate', 'false').lower() == 'true'
+    stats_folder = request.args.get('stats_folder')
+    face_id = request.args.get('face_id')
+    try:
+        if stats_folder and face_id:
+            timestamp_ms = request.args.get('timestamp_ms', 0.0, type=float)
+            summary_file = os.path.join(stats_folder, f"face_{face_id}_statistics.json")
+            if not os.path.exists(summary_file):
+                return jsonify({"error": "Face statistics not found"}), 404
+            with open(summary_file, 'r') as f:
+                face_statistics = json.load(f)
+            if "timeline" in face_statistics:
+                frame_index, timestamp_ms, emotions = timeline_sample(
+                    os.path.join(stats_folder, face_statistics["timeline"]["folder"]), timestamp_ms)
+            elif face_statistics.get("embedding_example"):
+                # Stats folders written before timelines existed: the face's first analyzed frame
+                frame_index, timestamp_ms, emotions = None, None, face_statistics["embedding_example"]
+            else:
+                return jsonify({"error": "No timeline was recorded for this face"}), 404
+            query = {"stats_folder": stats_folder, "face_id": face_id, "frame_index": frame_index,
+                     "timestamp_ms": timestamp_ms, "emotion": emotions}
+            results = similarity_index.similar_moments(emotions, k, stats_folder, face_id, approximate)
+        else:
+            emotions = {key: float(value) for key, value in request.args.items()
+                        if key not in ('k', 'approximate', 'stats_folder', 'face_id', 'timestamp_ms')}
+            if not emotions:
+                return jsonify({"error": "Give stats_folder, face_id and timestamp_ms, or emotion scores"}), 400
+            query = {"emotion": emotions}
+            results = similarity_index.similar_moments(emotions, k, approximate=approximate)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"query": query, "results": results})
+
+@app.route('/similar/faces', methods=['GET'])
+def similar_faces():
+    """
+    The k faces of other videos (include_same_video=true: of any video) closest to the
+    identity embedding of stats_folder's face_id. Needs FACE_EMBEDDING_MODEL.
+    """
+    logging.debug("Route hit: /similar/faces")
+    stats_folder = request.args.get('stats_folder')
+    face_id = request.args.get('face_id')
+    if not stats_folder or not face_id:
+        return jsonify({"error": "stats_folder and face_id are required"}), 400
+    if not os.path.exists(os.path.join(stats_folder, f"face_{face_id}_statistics.json")):
+        return jsonify({"error": "Face statistics not found"}), 404
+    try:
+        results = similarity_index.similar_faces(
+            stats_folder, face_id, request.args.get('k', 10, type=int),
+            include_same_video=request.args.get('include_same_video', 'false').lower() == 'true',
+            approximate=request.args.get('approximate', 'false').lower() == 'true')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"query": {"stats_folder": stats_folder, "face_id": face_id}, "results": results})
+
+@app.route('/similar/stats', methods=['GET'])
+def similar_stats():
+    logging.debug("Route hit: /similar/stats")
+    return jsonify(similarity_index.stats())
+
 @app.route('/train_generative_model', methods=['POST'])
 def train_model():
     logging.debug("Route hit: /train_generative_model")
@@ -140,6 +797,11 @@ def train_model():
 
 @app.route('/generate_synthetic_image', methods=['POST'])
 def generate_image():
+    """
+    Img2img from the frame saved by /save_frame for session_id. Optional JSON fields:
+    num_inference_steps, strength, guidance_scale, width and height (fewer steps and smaller
+    images are faster).
+    """
     logging.debug("Route hit: /generate_synthetic_image")
     try:
         model_name = request.json.get('model_name')
@@ -151,14 +813,43 @@ def generate_image():
         if not prompt:
             return jsonify({"error": "Prompt is required"}), 400
 
-        frame_path = os.path.join(app.config['GENAI_FOLDER'], 'saved_frame.jpg')
-        output_path = generate_synthetic_image_with_ip(prompt, frame_path, model_name)
+        session_id = request.json.get('session_id')
+        if not valid_session_id(session_id):
+            return jsonify({"error": "A valid session_id from /save_frame is required"}), 400
+        frame_path = session_frame_path(app.config['FRAMES_FOLDER'], session_id)
+        if frame_path is None:
+            return jsonify({"error": "No saved frame for this session; call /save_frame first"}), 400
+        try:
+            options = {name: cast(request.json[name])
+                       for name, cast in (('num_inference_steps', int), ('strength', float),
+                                          ('guidance_scale', float), ('width', int), ('height', int))
+                       if request.json.get(name) is not None}
+            future = image_generation.submit(prompt, frame_path, model_name, **options)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        output_path = future.result()
         return jsonify({"message": "Synthetic image generated successfully", "output_path": output_path})
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        # Anything else (e.g. an unreadable saved frame, a failed generation) is a JSON 500
+        return jsonify({"error": f"Error generating synthetic image: {str(e)}"}), 500
+
+@app.route('/generate_ai_story/stats', methods=['GET'])
+def generate_ai_story_stats():
+    logging.debug("Route hit: /generate_ai_story/stats")
+    return jsonify(story_generator.stats())
+
+@app.route('/generate_synthetic_image/stats', methods=['GET'])
+def generate_image_stats():
+    logging.debug("Route hit: /generate_synthetic_image/stats")
+    return jsonify(image_generation.stats())
 
 @app.route('/generate_ai_story', methods=['POST'])
 def generate_ai_story():
+    """
+    Story for a stats folder. Optional JSON fields: fresh=true samples a new story instead of
+    returning the cached one, stream=true streams the story as plain text while it is generated.
+    """
     logging.debug("Route hit: /generate_ai_story")
     try:
         # Get the stats folder from the request
@@ -166,7 +857,8 @@ def generate_ai_story():
         if not stats_folder:
             return jsonify({"error": "Statistics folder not provided"}), 400
 
-        # Path to the overall_statistics.json file
+        # The prompt is always built from overall_statistics.json, so a video gets the same
+        # prompt (and story cache entry) whether or not it is in the stats index
         overall_stats_path = os.path.join(stats_folder, 'overall_statistics.json')
 
         # Check if the file exists
@@ -177,21 +869,17 @@ def generate_ai_story():
         with open(overall_stats_path, 'r') as f:
             overall_stats = json.load(f)
 
-        # Extract relevant data from the statistics to create a prompt
-        # Example: Use the dominant emotion or other statistics as the prompt
-        dominant_emotion = overall_stats.get('dominant_emotion', 'unknown')
-        emotion_stats = overall_stats.get('emotion_stats', {})
-
-        # Create a prompt based on the statistics
-        prompt = f"In a financial domain where the dominant emotion is {dominant_emotion}, "
-        prompt += f"with the following emotion distribution: {emotion_stats}, "
-        prompt += "a story unfolds:"
+        # Create a prompt based on the dominant emotion and emotion distribution
+        prompt = build_story_prompt(overall_stats)
+        fresh = bool(request.json.get('fresh', False))
 
-        # Generate a story using the Hugging Face model
-        generated_text = story_generator(prompt, max_length=200, num_return_sequences=1)
-        story = generated_text[0]['generated_text']
+        if request.json.get('stream', False):
+            return Response(story_generator.stream(prompt, fresh=fresh),
+                            mimetype='text/plain', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
-        return jsonify({"message": "Story generated successfully", "story": story})
+        # Generate a story using the Hugging Face model (cached per prompt, batched across requests)
+        story, cached = story_generator.generate(prompt, fresh=fresh)
+        return jsonify({"message": "Story generated successfully", "story": story, "cached": cached})
     except Exception as e:
         logging.error(f"Error in /generate_ai_story: {str(e)}")
         return jsonify({"error": str(e)}), 500
@@ -0,0 +1,69 @@
+"""
+One-time backfill of the SQLite stats index.
+
+Indexes every stats folder (a folder with overall_statistics.json) under the given roots
+from its JSON files, so videos processed before the index existed can be queried through
+/index/videos and /index/faces. Folders that are already indexed are skipped unless
+--reindex is given. With --similarity-index their timelines and face embeddings are added
+to that similarity index as well (for /similar/*); stop the app while doing so, as the
+similarity index has a single writer. Folders written before timelines existed contribute
+each face's embedding_example, and --live-embeddings adds the emotion probability rows
+saved by the live feed (emotion_embeddings.npy) as moments too.
+
+Usage (from the app folder):
+    python backfill_stats_index.py emotion_stats
+    python backfill_stats_index.py emotion_stats/batch --index emotion_stats/batch/stats_index.sqlite --reindex
+    python backfill_stats_index.py emotion_stats --similarity-index emotion_stats/similarity_index
+    python backfill_stats_index.py emotion_stats --similarity-index emotion_stats/similarity_index \
+        --live-embeddings ../emotion_embeddings.npy
+"""
+import argparse
+import logging
+import os
+
+from utils.similarity_index import SimilarityIndex
+from utils.stats_index import INDEX_FILE, StatsIndex
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('roots', nargs='+', help="Folders searched recursively for stats folders")
+    parser.add_argument('--index', default=None,
+                        help="Index file (default: STATS_INDEX or <first root>/stats_index.sqlite)")
+    parser.add_argument('--similarity-index', default=None,
+                        help="Also add every stats folder to this similarity index")
+    parser.add_argument('--live-embeddings', nargs='+', default=[],
+                        help="Live-feed embeddings files (.npy) to add to the similarity index")
+    parser.add_argument('--reindex', action='store_true', help="Re-index folders that are already indexed")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    index_path = args.index or os.getenv('STATS_INDEX') or os.path.join(args.roots[0], INDEX_FILE)
+    index = StatsIndex(index_path)
+    for root in args.roots:
+        indexed, skipped, failed = index.backfill(root, skip_indexed=not args.reindex)
+        print(f"{root}: {indexed} indexed, {skipped} already indexed, {failed} failed")
+    print(f"Index {index_path}: {index.summary()}")
+
+    if args.similarity_index:
+        similarity_index = SimilarityIndex(args.similarity_index)
+        indexed = {entry["path"] for collection in similarity_index.collections.values()
+                   for entry in collection.folders()} if not args.reindex else set()
+        for root in args.roots:
+            for folder, _, files in os.walk(root):
+                if 'overall_statistics.json' not in files or os.path.normpath(folder) in indexed:
+                    continue
+                try:
+                    similarity_index.add_folder(folder)
+                except (OSError, ValueError, KeyError) as e:
+                    logging.warning(f"Could not add {folder} to the similarity index: {e}")
+        for path in args.live_embeddings:
+            try:
+                print(f"{path}: {similarity_index.add_embeddings_file(path)} moments")
+            except (OSError, ValueError) as e:
+                logging.warning(f"Could not add {path} to the similarity index: {e}")
+        print(f"Similarity index {args.similarity_index}: {similarity_index.stats()}")
+
+
+if __name__ == '__main__':
+    main()
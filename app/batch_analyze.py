@@ -0,0 +1,267 @@
+"""
+Headless batch analysis of many videos.
+
+Runs process_video over every video in the given directories (searched recursively) and
+manifests (text files with one video path per line) on a pool of worker processes. Each
+worker loads the models once and limits its TensorFlow/PyTorch/OpenCV thread pools to
+--threads-per-worker threads, so workers x threads can match the core count without
+oversubscribing it. Every video gets a stats folder under --output, named after the input
+it came from and its path relative to that input, extension included (clips/a/b.mp4 ->
+<output>/clips/a/b_mp4); inputs that would share a stats folder are rejected before
+anything runs. batch_summary.json combines the results. Finished
+videos are added to the SQLite stats index (--index, default <output>/stats_index.sqlite)
+and, by this process, to the similarity index (--similarity-index, default
+<output>/similarity_index).
+
+Usage (from the app folder):
+    python batch_analyze.py /data/clips --output emotion_stats/nightly --workers 16 --threads-per-worker 2
+    python batch_analyze.py manifest.txt --profile fast --skip-existing
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from utils.frame_sampling import AUTO, SAMPLING_STRATEGIES
+from utils.profiling import PROFILING_MODES, profile_to
+from utils.similarity_index import SimilarityIndex
+from utils.stats_index import INDEX_FILE
+from utils.stats_storage import BINARY, STATS_FORMATS
+
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi', '.mkv', '.webm', '.m4v')
+SUMMARY_FILE = 'batch_summary.json'
+
+_worker_options = {}
+
+
+def find_videos(inputs, extensions=VIDEO_EXTENSIONS):
+    """
+    (video path, relative name) pairs from directories and manifest files, in a stable
+    order. Relative names start with the name of the input they came from, so equal paths
+    under different inputs stay apart.
+    """
+    videos = []
+    for entry in inputs:
+        namespace = os.path.basename(os.path.normpath(os.path.abspath(entry)))
+        if os.path.isdir(entry):
+            for root, _, files in os.walk(entry):
+                for name in sorted(files):
+                    if name.lower().endswith(extensions):
+                        path = os.path.join(root, name)
+                        videos.append((path, os.path.join(namespace, os.path.relpath(path, entry))))
+        elif entry.lower().endswith(extensions):
+            videos.append((entry, namespace))
+        else:
+            # Manifest: one video path per line, relative paths resolved against the manifest
+            base = os.path.dirname(os.path.abspath(entry))
+            namespace = os.path.splitext(namespace)[0]
+            with open(entry, 'r') as f:
+                for line in f:
+                    line = line.strip()
+                    if line and not line.startswith('#'):
+                        videos.append((os.path.join(base, line), os.path.join(namespace, line)))
+    return sorted(set(videos))
+
+
+def stats_folder_for(output_root, relative_name):
+    """Stats folder of a video under output_root; the extension is kept (a.mp4 -> a_mp4)."""
+    stem, extension = os.path.splitext(os.path.normpath(relative_name))
+    name = (stem + extension.replace('.', '_')).replace('..', '_')
+    return os.path.join(output_root, re.sub(r'[^A-Za-z0-9_./-]', '_', name).lstrip('./'))
+
+
+def duplicate_targets(jobs):
+    """{stats folder: video paths} of the stats folders more than one video would write."""
+    targets = {}
+    for video_path, output_folder in jobs:
+        targets.setdefault(os.path.normcase(os.path.abspath(output_folder)), []).append(video_path)
+    return {folder: paths for folder, paths in targets.items() if len(paths) > 1}
+
+
+def limit_threads(threads):
+    """Cap the intra-op thread pools of this process. Must run before TensorFlow/PyTorch are imported."""
+    for variable in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS',
+                     'ORT_INTRA_OP_THREADS'):
+        os.environ[variable] = str(threads)
+    os.environ['TF_NUM_INTEROP_THREADS'] = '1'
+    os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+
+    import cv2
+    cv2.setNumThreads(threads)
+    try:
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+    except (ImportError, RuntimeError):
+        pass
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+
+def _init_worker(threads, options):
+    """Process pool initializer: limit threads, then load the models once for this worker."""
+    limit_threads(threads)
+    _worker_options.update(options)
+
+    from utils.analysis_profiles import resolve_profile
+    from utils.batched_analysis import BatchedFaceAnalyzer
+    from utils.face_detectors import FaceDetector
+    profile = resolve_profile(**options["profile"])
+    FaceDetector(profile["detector"], profile["detection_size"])
+    BatchedFaceAnalyzer(profile["actions"], backend=profile["backend"])
+
+
+def _analyze(video_path, output_folder):
+    from utils.emotion_detection import process_video
+
+    start = time.perf_counter()
+    result = {"video_path": video_path, "stats_folder": output_folder, "pid": os.getpid()}
+    try:
+        options = dict(_worker_options)
+        with profile_to(output_folder, options.pop("profiling")):
+            process_video(video_path, output_folder, **options)
+        with open(os.path.join(output_folder, 'overall_statistics.json'), 'r') as f:
+            overall_stats = json.load(f)
+        result.update(status="completed",
+                      total_frames_processed=overall_stats["total_frames_processed"],
+                      total_faces_detected=overall_stats["total_faces_detected"],
+                      emotion_counts=_emotion_counts(output_folder, overall_stats["faces"]))
+    except Exception as e:
+        result.update(status="failed", error=str(e))
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def _emotion_counts(stats_folder, faces):
+    counts = {}
+    for face_id in faces:
+        with open(os.path.join(stats_folder, f"face_{face_id}_statistics.json"), 'r') as f:
+            for emotion, count in json.load(f)["emotion_counts"].items():
+                counts[emotion] = counts.get(emotion, 0) + count
+    return counts
+
+
+def write_summary(output_root, results, started_at, options):
+    completed = [r for r in results if r["status"] == "completed"]
+    emotion_counts = {}
+    for result in completed:
+        for emotion, count in result["emotion_counts"].items():
+            emotion_counts[emotion] = emotion_counts.get(emotion, 0) + count
+    elapsed = time.time() - started_at
+    summary = {
+        "started_at": started_at,
+        "elapsed_seconds": elapsed,
+        "options": options,
+        "videos": len(results),
+        "completed": len(completed),
+        "failed": len(results) - len(completed),
+        "total_frames_processed": sum(r["total_frames_processed"] for r in completed),
+        "total_faces_detected": sum(r["total_faces_detected"] for r in completed),
+        "videos_per_hour": 3600 * len(results) / elapsed if elapsed > 0 else 0.0,
+        "emotion_counts": emotion_counts,
+        "results": sorted(results, key=lambda r: r["video_path"]),
+    }
+    path = os.path.join(output_root, SUMMARY_FILE)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(summary, f, indent=4)
+    os.replace(tmp_path, path)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('inputs', nargs='+', help="Video directories, video files or manifest files")
+    parser.add_argument('--output', default='emotion_stats/batch')
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Worker processes (default: cores / threads-per-worker)")
+    parser.add_argument('--threads-per-worker', type=int, default=1)
+    parser.add_argument('--profile', default=None, help="Analysis profile (see utils.analysis_profiles)")
+    parser.add_argument('--frame-interval', type=int, default=40)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--detect-every', type=int, default=3)
+    parser.add_argument('--sampling', choices=SAMPLING_STRATEGIES, default=AUTO)
+    parser.add_argument('--stats-format', choices=STATS_FORMATS, default=BINARY)
+    parser.add_argument('--profiling', choices=PROFILING_MODES, default=None,
+                        help="Write a profile of every video into its stats folder")
+    parser.add_argument('--index', default=None,
+                        help="Stats index to add the results to (default: <output>/stats_index.sqlite)")
+    parser.add_argument('--similarity-index', default=None,
+                        help="Similarity index to add the results to (default: <output>/similarity_index)")
+    parser.add_argument('--face-embedding-model', default=None,
+                        help="DeepFace.represent model for per-face identity embeddings, e.g. Facenet")
+    parser.add_argument('--skip-existing', action='store_true',
+                        help="Skip videos whose stats folder already has overall_statistics.json")
+    parser.add_argument('--summary-every', type=int, default=50, help="Rewrite the summary every N videos")
+    args = parser.parse_args()
+
+    workers = args.workers or max(1, (os.cpu_count() or 1) // args.threads_per_worker)
+    options = {
+        "frame_interval": args.frame_interval,
+        "batch_size": args.batch_size,
+        "detect_every": args.detect_every,
+        "sampling": args.sampling,
+        "stats_format": args.stats_format,
+        "profile": {"name": args.profile},
+        "profiling": args.profiling,
+        "stats_index": args.index or os.path.join(args.output, INDEX_FILE),
+        "face_embedding_model": args.face_embedding_model,
+        "resume": True,  # Continue interrupted videos from their checkpoints
+    }
+
+    videos = find_videos(args.inputs)
+    targets = [(video_path, stats_folder_for(args.output, relative_name)) for video_path, relative_name in videos]
+    duplicates = duplicate_targets(targets)
+    if duplicates:
+        # Workers writing and checkpointing into the same folder would corrupt each other's results
+        parser.error("videos would share a stats folder:\n" + "\n".join(
+            f"  {folder}: {', '.join(paths)}" for folder, paths in sorted(duplicates.items())))
+    jobs = [(video_path, output_folder) for video_path, output_folder in targets
+            if not (args.skip_existing and os.path.exists(os.path.join(output_folder, 'overall_statistics.json')))]
+    os.makedirs(args.output, exist_ok=True)
+    print(f"{len(videos)} videos found, {len(jobs)} to process with {workers} workers "
+          f"x {args.threads_per_worker} threads")
+
+    # Written by this process only: workers leave their timelines and embeddings on disk
+    similarity_index = SimilarityIndex(args.similarity_index or os.path.join(args.output, 'similarity_index'))
+    started_at = time.time()
+    results = []
+    # Spawned workers import TensorFlow/PyTorch only after their thread limits are set
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                             initargs=(args.threads_per_worker, options)) as executor:
+        futures = {executor.submit(_analyze, video_path, output_folder): (video_path, output_folder)
+                   for video_path, output_folder in jobs}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except BrokenProcessPool as e:
+                # A worker died (e.g. _init_worker could not load the models); every job left fails
+                video_path, output_folder = futures[future]
+                result = {"video_path": video_path, "stats_folder": output_folder, "status": "failed",
+                          "error": f"Worker pool broken: {e}", "seconds": 0.0}
+            results.append(result)
+            if result["status"] == "completed":
+                try:
+                    similarity_index.add_folder(result["stats_folder"])
+                except Exception as e:
+                    print(f"Error adding {result['stats_folder']} to the similarity index: {e}")
+            status = result["status"] if result["status"] == "completed" else f"failed: {result['error']}"
+            print(f"[{len(results)}/{len(jobs)}] {result['video_path']} ({result['seconds']:.1f}s) {status}")
+            if len(results) % args.summary_every == 0:
+                write_summary(args.output, results, started_at, options)
+
+    summary = write_summary(args.output, results, started_at, options)
+    print(f"\n{summary['completed']} completed, {summary['failed']} failed in {summary['elapsed_seconds']:.1f}s "
+          f"({summary['videos_per_hour']:.0f} videos/hour); summary in {os.path.join(args.output, SUMMARY_FILE)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Compare faces/sec of the per-crop DeepFace.analyze path against BatchedFaceAnalyzer.
+
+Usage:
+    python app/benchmarks/benchmark_batched_analysis.py uploads/webcam_video.mp4 --batch-sizes 1 8 16 32
+"""
+import argparse
+import os
+import sys
+import time
+
+import cv2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from retinaface import RetinaFace  # noqa: E402
+from utils.batched_analysis import BatchedFaceAnalyzer, analyze_face  # noqa: E402
+
+
+def collect_face_crops(video_path, frame_interval, max_faces):
+    """Detect faces in sampled frames and return up to max_faces crops."""
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise ValueError(f"Could not open video at {video_path}")
+
+    crops = []
+    frame_count = 0
+    while len(crops) < max_faces:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frame_count += 1
+        if frame_count % frame_interval != 0:
+            continue
+
+        faces = RetinaFace.detect_faces(frame)
+        if isinstance(faces, dict):
+            for face_data in faces.values():
+                x, y, w, h = [int(v) for v in face_data['facial_area']]
+                crop = frame[y:h, x:w]
+                if crop.size > 0:
+                    crops.append(crop)
+    cap.release()
+    return crops[:max_faces]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('video_path')
+    parser.add_argument('--frame-interval', type=int, default=10)
+    parser.add_argument('--max-faces', type=int, default=128)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[8, 16, 32])
+    args = parser.parse_args()
+
+    crops = collect_face_crops(args.video_path, args.frame_interval, args.max_faces)
+    if not crops:
+        print("No faces found in the sampled frames.")
+        return
+    print(f"Collected {len(crops)} face crops")
+
+    # Warm up the models so loading time is not counted
+    analyze_face(crops[0])
+
+    start = time.perf_counter()
+    for crop in crops:
+        analyze_face(crop)
+    elapsed = time.perf_counter() - start
+    print(f"{'per-crop':>12}: {len(crops) / elapsed:8.2f} faces/sec ({elapsed:.2f}s)")
+
+    for batch_size in args.batch_sizes:
+        analyzer = BatchedFaceAnalyzer(batch_size=batch_size)
+        analyzer.analyze(crops[:batch_size])  # Warm-up
+
+        start = time.perf_counter()
+        analyzer.analyze(crops)
+        elapsed = time.perf_counter() - start
+        print(f"{f'batch={batch_size}':>12}: {len(crops) / elapsed:8.2f} faces/sec ({elapsed:.2f}s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Accuracy/speed report for downscaled face detection.
+
+Full-resolution detection is the reference: for each detection short side the report
+gives the detection time per frame, the fraction of frames that fell back to full
+resolution and the recall/precision of the mapped-back boxes against the reference
+(a match is IoU >= --iou).
+
+Usage:
+    python app/benchmarks/benchmark_detection_scaling.py uploads/*.mp4 --sizes 360 480 720 --frame-interval 30
+"""
+import argparse
+import os
+import sys
+import time
+
+import cv2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.face_detectors import DETECTORS, RETINAFACE, FaceDetector  # noqa: E402
+from utils.face_tracking import iou  # noqa: E402
+from utils.frame_sampling import GRAB, FrameSampler  # noqa: E402
+
+
+def sample_frames(video_paths, frame_interval, max_frames):
+    frames = []
+    for video_path in video_paths:
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            raise ValueError(f"Could not open video at {video_path}")
+        for _, frame in FrameSampler(cap, GRAB, frame_interval):
+            frames.append(frame)
+            if len(frames) >= max_frames:
+                break
+        cap.release()
+    return frames
+
+
+def detect_all(detector, frames):
+    start = time.perf_counter()
+    boxes = [detector.detect(frame) for frame in frames]
+    return boxes, time.perf_counter() - start
+
+
+def match(reference, boxes, threshold):
+    """Number of boxes greedily matched to reference boxes with IoU >= threshold."""
+    unmatched = list(reference)
+    matched = 0
+    for box in boxes:
+        best = max(unmatched, key=lambda ref: iou(ref, box), default=None)
+        if best is not None and iou(best, box) >= threshold:
+            unmatched.remove(best)
+            matched += 1
+    return matched
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('video_paths', nargs='+')
+    parser.add_argument('--detector', choices=DETECTORS, default=RETINAFACE)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[360, 480, 720])
+    parser.add_argument('--min-face-size', type=int, default=20)
+    parser.add_argument('--frame-interval', type=int, default=30)
+    parser.add_argument('--max-frames', type=int, default=200)
+    parser.add_argument('--iou', type=float, default=0.5)
+    parser.add_argument('--retry-empty', action='store_true',
+                        help="Also detect frames without faces again at full resolution")
+    args = parser.parse_args()
+
+    frames = sample_frames(args.video_paths, args.frame_interval, args.max_frames)
+    height, width = frames[0].shape[:2]
+    print(f"{len(frames)} frames, first video {width}x{height}, detector {args.detector}\n")
+
+    reference_detector = FaceDetector(args.detector)
+    reference_detector.detect(frames[0])  # Keep one-time initialization out of the timings
+    reference, reference_seconds = detect_all(reference_detector, frames)
+    reference_faces = sum(len(boxes) for boxes in reference)
+
+    print(f"{'short side':>10} {'ms/frame':>9} {'speedup':>8} {'fallback':>9} {'faces':>6} {'recall':>7} {'precision':>9}")
+    print(f"{'full':>10} {1000 * reference_seconds / len(frames):>9.2f} {1.0:>8.2f} {0.0:>9.1%} "
+          f"{reference_faces:>6} {1.0:>7.3f} {1.0:>9.3f}")
+    for size in args.sizes:
+        detector = FaceDetector(args.detector, size, args.min_face_size, args.retry_empty)
+        boxes, seconds = detect_all(detector, frames)
+        faces = sum(len(b) for b in boxes)
+        matched = sum(match(ref, b, args.iou) for ref, b in zip(reference, boxes))
+        recall = matched / reference_faces if reference_faces else 1.0
+        precision = matched / faces if faces else 1.0
+        print(f"{size:>10} {1000 * seconds / len(frames):>9.2f} {reference_seconds / seconds:>8.2f} "
+              f"{detector.stats()['fallback_rate']:>9.1%} {faces:>6} {recall:>7.3f} {precision:>9.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""
+Decode time per processed frame for each frame sampling strategy.
+
+Usage:
+    python app/benchmarks/benchmark_frame_sampling.py uploads/webcam_video.mp4 --frame-interval 40 --samples-per-second 1
+"""
+import argparse
+import os
+import sys
+import time
+
+import cv2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.frame_sampling import AUTO, GRAB, READ, SEEK, TIME, FrameSampler  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('video_path')
+    parser.add_argument('--frame-interval', type=int, default=40)
+    parser.add_argument('--samples-per-second', type=float, default=1.0)
+    args = parser.parse_args()
+
+    print(f"{'strategy':>10} {'frames':>7} {'decoded':>8} {'total s':>8} {'ms/frame':>9}")
+    for strategy in (READ, GRAB, SEEK, TIME, AUTO):
+        cap = cv2.VideoCapture(args.video_path)
+        if not cap.isOpened():
+            raise ValueError(f"Could not open video at {args.video_path}")
+        sampler = FrameSampler(cap, strategy, args.frame_interval, args.samples_per_second)
+
+        start = time.perf_counter()
+        frames = sum(1 for _ in sampler)
+        elapsed = time.perf_counter() - start
+        cap.release()
+
+        per_frame = 1000 * elapsed / frames if frames else float('nan')
+        label = strategy if sampler.strategy == strategy else f"{strategy}->{sampler.strategy}"
+        print(f"{label:>10} {frames:>7} {sampler.decoded:>8} {elapsed:>8.3f} {per_frame:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+CPU faces/sec of the emotion models on each inference backend: the DeepFace Keras models
+(BatchedFaceAnalyzer, --actions) and the ViT expression model (predict_emotions), on
+TensorFlow/PyTorch, ONNX Runtime fp32 and ONNX Runtime int8.
+
+Usage:
+    CUDA_VISIBLE_DEVICES= python app/benchmarks/benchmark_inference_backends.py uploads/webcam_video.mp4 --batch-sizes 1 16
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark_batched_analysis import collect_face_crops  # noqa: E402
+from utils.batched_analysis import ACTION_MODELS, BatchedFaceAnalyzer  # noqa: E402
+from utils.live_emotion import predict_emotions  # noqa: E402
+from utils.onnx_backend import INFERENCE_BACKENDS  # noqa: E402
+
+
+def faces_per_second(run, crops, batch_size, repeats):
+    run(crops[:batch_size])  # Keep loading, export and graph initialization out of the timings
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for offset in range(0, len(crops), batch_size):
+            run(crops[offset:offset + batch_size])
+    return repeats * len(crops) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('video_path')
+    parser.add_argument('--frame-interval', type=int, default=10)
+    parser.add_argument('--max-faces', type=int, default=128)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 16])
+    parser.add_argument('--backends', nargs='+', choices=INFERENCE_BACKENDS, default=list(INFERENCE_BACKENDS))
+    parser.add_argument('--actions', nargs='+', choices=ACTION_MODELS, default=['emotion'])
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--skip-vit', action='store_true')
+    args = parser.parse_args()
+
+    crops = collect_face_crops(args.video_path, args.frame_interval, args.max_faces)
+    if not crops:
+        print("No faces found in the sampled frames.")
+        return
+    print(f"{len(crops)} face crops, actions {args.actions}\n")
+
+    print(f"{'model':>8} {'backend':>10} {'batch':>6} {'faces/s':>9}")
+    for backend in args.backends:
+        for batch_size in args.batch_sizes:
+            analyzer = BatchedFaceAnalyzer(args.actions, batch_size=batch_size, backend=backend)
+            rate = faces_per_second(analyzer.analyze, crops, batch_size, args.repeats)
+            print(f"{'deepface':>8} {backend:>10} {batch_size:>6} {rate:>9.1f}")
+    if not args.skip_vit:
+        for backend in args.backends:
+            for batch_size in args.batch_sizes:
+                rate = faces_per_second(lambda batch: predict_emotions(batch, backend), crops, batch_size,
+                                        args.repeats)
+                print(f"{'vit':>8} {backend:>10} {batch_size:>6} {rate:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
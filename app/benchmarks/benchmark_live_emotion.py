@@ -0,0 +1,62 @@
+"""
+Live emotion throughput on a video file: one batched ViT call per frame versus one
+call per face (the old livefeed behaviour).
+
+Usage:
+    python app/benchmarks/benchmark_live_emotion.py uploads/webcam_video.mp4 --max-frames 300
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.face_detectors import DETECTORS, HAAR, FaceDetector  # noqa: E402
+from utils.live_emotion import CaptureSource, predict_emotions  # noqa: E402
+from utils.model_registry import get_vit_expression_model  # noqa: E402
+
+
+def run(video_path, max_frames, batched, detector):
+    source = CaptureSource(video_path)
+    frames = faces = 0
+    inference = 0.0
+    start = time.perf_counter()
+    while frames < max_frames:
+        ret, frame = source.read()
+        if not ret:
+            break
+        crops = [frame[y1:y2, x1:x2] for (x1, y1, x2, y2) in detector.detect(frame)]
+        inference_start = time.perf_counter()
+        if batched:
+            predict_emotions(crops)
+        else:
+            for crop in crops:
+                predict_emotions([crop])
+        inference += time.perf_counter() - inference_start
+        frames += 1
+        faces += len(crops)
+    source.release()
+    return frames, faces, time.perf_counter() - start, inference
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('video_path')
+    parser.add_argument('--max-frames', type=int, default=300)
+    parser.add_argument('--detector', choices=DETECTORS, default=HAAR)
+    parser.add_argument('--detection-size', type=int, default=None)
+    args = parser.parse_args()
+
+    get_vit_expression_model()  # Keep model loading out of the timings
+    detector = FaceDetector(args.detector, args.detection_size)
+
+    print(f"{'mode':>10} {'frames':>7} {'faces':>6} {'total s':>8} {'frames/s':>9} {'faces/s':>8}")
+    for mode, batched in (('per-face', False), ('batched', True)):
+        frames, faces, elapsed, inference = run(args.video_path, args.max_frames, batched, detector)
+        faces_per_sec = faces / inference if inference else float('nan')
+        print(f"{mode:>10} {frames:>7} {faces:>6} {elapsed:>8.3f} {frames / elapsed:>9.2f} {faces_per_sec:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Agreement of the ONNX Runtime backends with DeepFace.analyze.
+
+Face crops from the given videos are labeled by DeepFace.analyze (the reference) and by
+BatchedFaceAnalyzer on every backend. The report gives, per backend, the fraction of crops
+with the same dominant emotion and the mean absolute difference of the emotion scores (in
+percentage points). With --vit the ViT expression model's ONNX exports are compared with
+its PyTorch predictions as well. Exits with status 1 if an ONNX backend agrees on fewer
+than --min-agreement of the crops, so it can gate a deployment.
+
+Usage:
+    python app/benchmarks/check_onnx_agreement.py uploads/*.mp4 --max-faces 300 --vit
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark_batched_analysis import collect_face_crops  # noqa: E402
+from utils.batched_analysis import EMOTION_LABELS, BatchedFaceAnalyzer, analyze_face  # noqa: E402
+from utils.live_emotion import predict_emotions  # noqa: E402
+from utils.onnx_backend import INFERENCE_BACKENDS, NATIVE, ONNX, ONNX_INT8  # noqa: E402
+
+
+def compare(reference_labels, reference_scores, labels, scores):
+    agreement = float(np.mean([a == b for a, b in zip(reference_labels, labels)]))
+    difference = float(np.mean(np.abs(np.asarray(reference_scores) - np.asarray(scores))))
+    return agreement, difference
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('video_paths', nargs='+')
+    parser.add_argument('--frame-interval', type=int, default=10)
+    parser.add_argument('--max-faces', type=int, default=200)
+    parser.add_argument('--backends', nargs='+', choices=INFERENCE_BACKENDS, default=[NATIVE, ONNX, ONNX_INT8])
+    parser.add_argument('--min-agreement', type=float, default=0.95)
+    parser.add_argument('--vit', action='store_true', help="Also compare the ViT expression model's backends")
+    args = parser.parse_args()
+
+    crops = []
+    for video_path in args.video_paths:
+        crops += collect_face_crops(video_path, args.frame_interval, args.max_faces - len(crops))
+    if not crops:
+        print("No faces found in the sampled frames.")
+        return
+    print(f"{len(crops)} face crops\n")
+
+    reference = [analyze_face(crop, ['emotion']) for crop in crops]
+    reference_labels = [result['dominant_emotion'] for result in reference]
+    reference_scores = [[result['emotion'][label] for label in EMOTION_LABELS] for result in reference]
+
+    failed = False
+    print(f"{'model':>8} {'backend':>10} {'agreement':>10} {'mean |diff|':>12}")
+    for backend in args.backends:
+        results = BatchedFaceAnalyzer(['emotion'], backend=backend).analyze(crops)
+        labels = [result['dominant_emotion'] for result in results]
+        scores = [[result['emotion'][label] for label in EMOTION_LABELS] for result in results]
+        agreement, difference = compare(reference_labels, reference_scores, labels, scores)
+        print(f"{'deepface':>8} {backend:>10} {agreement:>10.3f} {difference:>12.3f}")
+        failed |= backend != NATIVE and agreement < args.min_agreement
+
+    if args.vit:
+        # The ViT has no DeepFace reference; its PyTorch predictions are the reference
+        vit_reference = predict_emotions(crops)
+        for backend in args.backends:
+            if backend == NATIVE:
+                continue
+            predictions = predict_emotions(crops, backend)
+            agreement, difference = compare([label for label, _, _ in vit_reference],
+                                            [100 * probs for _, _, probs in vit_reference],
+                                            [label for label, _, _ in predictions],
+                                            [100 * probs for _, _, probs in predictions])
+            print(f"{'vit':>8} {backend:>10} {agreement:>10.3f} {difference:>12.3f}")
+            failed |= agreement < args.min_agreement
+
+    if failed:
+        print(f"\nAgreement below {args.min_agreement}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
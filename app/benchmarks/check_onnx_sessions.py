@@ -0,0 +1,62 @@
+"""
+Check that every ONNX Runtime export loads and runs on the CPU provider.
+
+Exports (and quantizes) the DeepFace attribute models and, with --vit, the ViT expression
+model on first use, opens an ONNX Runtime session for each and runs a batch of synthetic
+face crops through it. Needs no video, so it can run right after installing onnxruntime and
+tf2onnx; an export whose operators have no CPU kernel (e.g. ConvInteger with int8 weights)
+fails here instead of on the first request. Exits with status 1 if any session fails.
+
+Usage:
+    python app/benchmarks/check_onnx_sessions.py --vit
+"""
+import argparse
+import os
+import sys
+import traceback
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.batched_analysis import DEFAULT_ACTIONS, BatchedFaceAnalyzer  # noqa: E402
+from utils.onnx_backend import ONNX, ONNX_INT8  # noqa: E402
+
+
+def check(name, run):
+    try:
+        run()
+    except Exception:
+        print(f"{name:>24} FAILED")
+        traceback.print_exc()
+        return False
+    print(f"{name:>24} ok")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backends', nargs='+', choices=(ONNX, ONNX_INT8), default=[ONNX, ONNX_INT8])
+    parser.add_argument('--actions', nargs='+', choices=DEFAULT_ACTIONS, default=list(DEFAULT_ACTIONS))
+    parser.add_argument('--batch-size', type=int, default=4)
+    parser.add_argument('--vit', action='store_true', help="Also check the ViT expression model's exports")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    crops = [rng.integers(0, 256, (160, 120, 3), dtype=np.uint8) for _ in range(args.batch_size)]
+
+    ok = True
+    for backend in args.backends:
+        for action in args.actions:
+            ok &= check(f"{action} {backend}",
+                        lambda: BatchedFaceAnalyzer([action], backend=backend).analyze(crops))
+        if args.vit:
+            from utils.live_emotion import predict_emotions
+            ok &= check(f"vit {backend}", lambda: predict_emotions(crops, backend))
+
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,6 +5,7 @@ import numpy as np
 from deepface import DeepFace
 from retinaface import RetinaFace
 from collections import defaultdict
+from utils.frame_sampling import AUTO, FrameSampler
 
 # Configuration
 video_path = r"/Users/rahsutikin/Library/Mobile Documents/com~apple~CloudDocs/pers/tusharIdeas/emotionrecognition/AdobeStock_1131581196.mov"
@@ -32,18 +33,9 @@ if not cap.isOpened():
 face_stats = {}  # Dictionary to store statistics for each face
 frame_count = 0  # Total frames processed
 
-# Process the video
-while True:
-    ret, frame = cap.read()
-    if not ret:
-        break  # Exit the loop if we've reached the end of the video
-
-    frame_count += 1
-
-    # Process only every nth frame
-    if frame_count % frame_interval != 0:
-        continue
-
+# Process the video, grabbing (not decoding) the frames in between sampled frames
+sampler = FrameSampler(cap, AUTO, frame_interval)
+for frame_count, frame in sampler:
     print(f"Processing frame {frame_count}...")
 
     # Detect faces using RetinaFace
@@ -123,7 +115,7 @@ for face_id, stats in face_stats.items():
 
 # Save overall statistics
 overall_stats = {
-    "total_frames_processed": frame_count,
+    "total_frames_processed": sampler.position,
     "total_faces_detected": len(face_stats),
     "faces": list(face_stats.keys())
 }
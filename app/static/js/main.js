@@ -1,5 +1,6 @@
 let uploadedVideoBlob = null;
 let savedFrameData = null;
+let frameSessionId = null;
 let syntheticImageData = null;
 
 // Function to upload video
@@ -53,8 +54,17 @@ async function generateStatistics() {
         console.log("Server response (upload):", result); // Log the upload response
 
         if (response.ok) {
+            // Processing runs in the background; wait for the job to finish (cached results are ready at once)
+            if (!result.cached) {
+                const job = await waitForJob(result.job_id);
+                if (job.status !== 'completed') {
+                    statsOutput.textContent = `Error: ${job.error || 'Video processing failed'}`;
+                    return;
+                }
+            }
+
             // Fetch and display statistics
-            const statsResponse = await fetch(`/get_stats?stats_folder=${result.stats_folder}`);
+            const statsResponse = await fetch(`/get_stats?stats_folder=${result.stats_folder}&thumbnails=1`);
             const stats = await statsResponse.json();
             console.log("Statistics data:", stats); // Log the statistics data
 
@@ -76,6 +86,47 @@ async function generateStatistics() {
     }
 }
 
+// Function to follow a background processing job until it finishes.
+// Progress, ETA and the per-face results so far are pushed by the server as events.
+function waitForJob(jobId) {
+    const statsOutput = document.getElementById('statsOutput');
+    return new Promise(resolve => {
+        const events = new EventSource(`/jobs/${jobId}/events`);
+
+        events.onmessage = (event) => {
+            const job = JSON.parse(event.data);
+            if (job.status === 'completed' || job.status === 'failed') {
+                events.close();
+                resolve(job);
+                return;
+            }
+
+            const progress = job.progress || {};
+            if (progress.faces && Object.keys(progress.faces).length > 0) {
+                displayStats(progress.faces);
+            } else {
+                statsOutput.innerHTML = '';
+            }
+            const total = progress.total_frames ? ` / ${progress.total_frames}` : '';
+            const eta = job.eta_seconds != null ? `, about ${Math.ceil(job.eta_seconds)}s left` : '';
+            const status = document.createElement('p');
+            status.textContent = `Processing (${job.status}): ${progress.frames_decoded || 0}${total} frames decoded, ${progress.frames_analyzed || 0} analyzed${eta}`;
+            statsOutput.prepend(status);
+        };
+
+        events.onerror = () => {
+            // The stream ended or the connection dropped; the job record has the final state
+            events.close();
+            fetch(`/jobs/${jobId}`)
+                .then(response => response.json().then(job => response.ok ? job : { status: 'failed', error: job.error }))
+                .then(job => job.status === 'completed' || job.status === 'failed'
+                    ? resolve(job)
+                    : setTimeout(() => waitForJob(jobId).then(resolve), 2000))
+                .catch(error => resolve({ status: 'failed', error: error.message }));
+        };
+    });
+}
+
 // Function to generate AI story
 async function generateAIStory() {
     const storyOutput = document.getElementById('storyOutput');
@@ -229,23 +280,29 @@ async function saveFrame() {
     const ctx = canvas.getContext('2d');
     ctx.drawImage(videoPlayer, 0, 0, canvas.width, canvas.height);
 
-    // Convert the canvas image to a base64-encoded string
-    const frameData = canvas.toDataURL('image/jpeg');
+    // Send the JPEG bytes as they are, without base64 encoding them into JSON
+    const frameBlob = await new Promise(resolve => canvas.toBlob(resolve, 'image/jpeg'));
+    const sessionQuery = frameSessionId ? `?session_id=${encodeURIComponent(frameSessionId)}` : '';
 
     try {
-        const response = await fetch('/save_frame', {
+        const response = await fetch(`/save_frame${sessionQuery}`, {
             method: 'POST',
             headers: {
-                'Content-Type': 'application/json'
+                'Content-Type': 'image/jpeg'
             },
-            body: JSON.stringify({ frame_data: frameData })
+            body: frameBlob
         });
 
         const result = await response.json();
         if (response.ok) {
+            frameSessionId = result.session_id;
             // Display the saved frame
             const savedFrame = document.getElementById('savedFrame');
-            savedFrame.src = frameData;
+            if (savedFrameData) {
+                URL.revokeObjectURL(savedFrameData);
+            }
+            savedFrameData = URL.createObjectURL(frameBlob);
+            savedFrame.src = savedFrameData;
             savedFrame.style.display = 'block';
             alert(`Frame saved successfully: ${result.frame_path}`);
         } else {
@@ -271,13 +328,18 @@ async function generateImage() {
         return;
     }
 
+    if (!frameSessionId) {
+        alert("Please save a frame first.");
+        return;
+    }
+
     try {
         const response = await fetch('/generate_synthetic_image', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json'
             },
-            body: JSON.stringify({ model_name: modelName, prompt: prompt })
+            body: JSON.stringify({ model_name: modelName, prompt: prompt, session_id: frameSessionId })
         });
 
         const result = await response.json();
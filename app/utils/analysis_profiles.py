@@ -0,0 +1,59 @@
+from utils.batched_analysis import ACTION_MODELS, DEFAULT_ACTIONS
+from utils.face_detectors import DETECTORS, RETINAFACE, YUNET
+from utils.onnx_backend import INFERENCE_BACKENDS, NATIVE, ONNX_INT8
+
+# Built-in analysis profiles. actions are the DeepFace attributes to analyze ('emotion' is
+# always required), detector one of utils.face_detectors.DETECTORS and detection_size the
+# short side (in pixels) frames are downscaled to for detection; None detects at full resolution.
+# Frames whose downscaled detection finds no face or a face under min_face_size pixels are
+# detected again at full resolution. backend is the attribute models' inference runtime, one
+# of utils.onnx_backend.INFERENCE_BACKENDS.
+PROFILES = {
+    # The original behaviour: every attribute, RetinaFace on full frames
+    "full": {"actions": list(DEFAULT_ACTIONS), "detector": RETINAFACE, "detection_size": None,
+             "min_face_size": 20, "backend": NATIVE},
+    # Emotion only; skips the age, gender and race models
+    "emotion": {"actions": ["emotion"], "detector": RETINAFACE, "detection_size": None,
+                "min_face_size": 20, "backend": NATIVE},
+    # Tuned for CPU throughput: emotion only, YuNet on 480p frames
+    "fast": {"actions": ["emotion"], "detector": YUNET, "detection_size": 480,
+             "min_face_size": 20, "backend": NATIVE},
+    # "fast" with the emotion model int8-quantized on ONNX Runtime, for GPU-less nodes
+    "cpu": {"actions": ["emotion"], "detector": YUNET, "detection_size": 480,
+            "min_face_size": 20, "backend": ONNX_INT8},
+}
+DEFAULT_PROFILE = "full"
+
+
+def resolve_profile(name=None, actions=None, detector=None, detection_size=None, min_face_size=None,
+                    backend=None):
+    """
+    The profile called name (DEFAULT_PROFILE if None) with the given fields overridden, as a
+    dict with name, actions, detector, detection_size, min_face_size and backend. Raises
+    ValueError for unknown profiles, actions, detectors or backends.
+    """
+    name = name or DEFAULT_PROFILE
+    if name not in PROFILES:
+        raise ValueError(f"profile must be one of {list(PROFILES)}")
+    profile = dict(PROFILES[name], name=name)
+
+    if actions is not None:
+        profile["actions"] = [action for action in DEFAULT_ACTIONS if action in actions]
+        unknown = set(actions) - set(ACTION_MODELS)
+        if unknown:
+            raise ValueError(f"Unknown actions: {sorted(unknown)}")
+    if "emotion" not in profile["actions"]:
+        raise ValueError("actions must include 'emotion'")
+    if detector is not None:
+        if detector not in DETECTORS:
+            raise ValueError(f"detector must be one of {list(DETECTORS)}")
+        profile["detector"] = detector
+    if detection_size is not None:
+        profile["detection_size"] = int(detection_size) or None
+    if min_face_size is not None:
+        profile["min_face_size"] = int(min_face_size)
+    if backend is not None:
+        if backend not in INFERENCE_BACKENDS:
+            raise ValueError(f"backend must be one of {list(INFERENCE_BACKENDS)}")
+        profile["backend"] = backend
+    return profile
@@ -0,0 +1,151 @@
+import cv2
+import numpy as np
+from deepface import DeepFace
+from utils.metrics import timed
+from utils.model_registry import get_deepface_model, get_onnx_deepface_model
+from utils.onnx_backend import INFERENCE_BACKENDS, NATIVE, ONNX_INT8
+
+DEFAULT_ACTIONS = ('emotion', 'age', 'gender', 'race')
+
+# Output labels of the DeepFace attribute models, in model output order
+EMOTION_LABELS = ['angry', 'disgust', 'fear', 'happy', 'sad', 'surprise', 'neutral']
+GENDER_LABELS = ['Woman', 'Man']
+RACE_LABELS = ['asian', 'indian', 'black', 'white', 'middle eastern', 'latino hispanic']
+
+# DeepFace model name for each action
+ACTION_MODELS = {
+    'emotion': 'Emotion',
+    'age': 'Age',
+    'gender': 'Gender',
+    'race': 'Race',
+}
+
+MODEL_INPUT_SIZE = (224, 224)
+EMOTION_INPUT_SIZE = (48, 48)
+
+
+def resize_with_padding(img, target_size=MODEL_INPUT_SIZE):
+    """
+    Resize a BGR face crop to target_size keeping its aspect ratio, padding with black,
+    and scale pixel values to [0, 1]. Mirrors DeepFace's own preprocessing.
+    """
+    target_h, target_w = target_size
+    factor = min(target_h / img.shape[0], target_w / img.shape[1])
+    new_w = max(1, int(img.shape[1] * factor))
+    new_h = max(1, int(img.shape[0] * factor))
+    resized = cv2.resize(img, (new_w, new_h))
+
+    pad_h = target_h - new_h
+    pad_w = target_w - new_w
+    padded = cv2.copyMakeBorder(resized, pad_h // 2, pad_h - pad_h // 2, pad_w // 2, pad_w - pad_w // 2,
+                                cv2.BORDER_CONSTANT, value=(0, 0, 0))
+    padded = padded.astype(np.float32)
+    if padded.max() > 1:
+        padded /= 255.0
+    return padded
+
+
+def analyze_face(face_region, actions=DEFAULT_ACTIONS):
+    """Per-crop analysis: one DeepFace.analyze call (and forward pass per action) for one face."""
+    return DeepFace.analyze(face_region, actions=list(actions), enforce_detection=False)[0]
+
+
+def represent_face(face_regions, model_name='Facenet'):
+    """
+    Identity embedding of one face from several crops of it: the L2-normalized mean of the
+    normalized DeepFace.represent embeddings (model_name, e.g. 'Facenet' or 'ArcFace').
+    """
+    embeddings = []
+    for face_region in face_regions:
+        with timed('deepface_represent'):
+            result = DeepFace.represent(face_region, model_name=model_name, enforce_detection=False,
+                                        detector_backend='skip')
+        embedding = np.asarray(result[0]['embedding'], dtype=np.float32)
+        embeddings.append(embedding / max(np.linalg.norm(embedding), 1e-12))
+    mean = np.mean(embeddings, axis=0)
+    return mean / max(np.linalg.norm(mean), 1e-12)
+
+
+class BatchedFaceAnalyzer:
+    """
+    Runs the DeepFace attribute models on many face crops at once.
+
+    Crops are resized to the model input and stacked, so every action costs one
+    forward pass per ``batch_size`` crops instead of one per crop. The returned
+    dictionaries have the same keys as a ``DeepFace.analyze`` result entry.
+
+    Unlike ``DeepFace.analyze(..., enforce_detection=False)`` the crops are not
+    re-detected: callers pass crops that already come from a face detector.
+
+    backend selects the inference runtime (see utils.onnx_backend): NATIVE runs the Keras
+    models, ONNX and ONNX_INT8 run their ONNX exports on ONNX Runtime.
+    """
+
+    def __init__(self, actions=DEFAULT_ACTIONS, batch_size=16, backend=NATIVE):
+        if backend not in INFERENCE_BACKENDS:
+            raise ValueError(f"backend must be one of {list(INFERENCE_BACKENDS)}")
+        self.actions = tuple(actions)
+        self.batch_size = max(1, int(batch_size))
+        self.backend = backend
+        if backend == NATIVE:
+            self.models = {action: get_deepface_model(ACTION_MODELS[action]) for action in self.actions}
+        else:
+            self.models = {action: get_onnx_deepface_model(ACTION_MODELS[action], quantized=backend == ONNX_INT8)
+                           for action in self.actions}
+
+    def _predict(self, action, batch):
+        model = self.models[action]
+        with timed(f'deepface_{action}'):
+            if self.backend != NATIVE:
+                return np.asarray(model.predict(batch))
+            # The DeepFace clients wrap a Keras model; call it directly to get batched predictions
+            return np.asarray(model.model.predict(batch, verbose=0))
+
+    def analyze(self, face_regions):
+        """
+        Analyze a list of BGR face crops. Returns one result dict per crop, or None
+        for crops that are empty and cannot be analyzed.
+        """
+        results = [None] * len(face_regions)
+        valid = [i for i, region in enumerate(face_regions) if region is not None and region.size > 0]
+
+        for start in range(0, len(valid), self.batch_size):
+            indices = valid[start:start + self.batch_size]
+            with timed('preprocess'):
+                batch = np.stack([resize_with_padding(face_regions[i]) for i in indices])
+            batch_results = [{} for _ in indices]
+
+            if 'emotion' in self.actions:
+                gray = np.stack([
+                    cv2.resize(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY), EMOTION_INPUT_SIZE) for img in batch
+                ])[..., np.newaxis]
+                predictions = self._predict('emotion', gray)
+                predictions = 100 * predictions / predictions.sum(axis=1, keepdims=True)
+                for result, scores in zip(batch_results, predictions):
+                    result['emotion'] = {label: float(score) for label, score in zip(EMOTION_LABELS, scores)}
+                    result['dominant_emotion'] = EMOTION_LABELS[int(np.argmax(scores))]
+
+            if 'age' in self.actions:
+                predictions = self._predict('age', batch)
+                # Apparent age is the expectation over the 101 age buckets
+                ages = predictions @ np.arange(predictions.shape[1])
+                for result, age in zip(batch_results, ages):
+                    result['age'] = float(age)
+
+            if 'gender' in self.actions:
+                predictions = self._predict('gender', batch)
+                for result, scores in zip(batch_results, predictions):
+                    result['gender'] = {label: float(100 * score) for label, score in zip(GENDER_LABELS, scores)}
+                    result['dominant_gender'] = GENDER_LABELS[int(np.argmax(scores))]
+
+            if 'race' in self.actions:
+                predictions = self._predict('race', batch)
+                predictions = 100 * predictions / predictions.sum(axis=1, keepdims=True)
+                for result, scores in zip(batch_results, predictions):
+                    result['race'] = {label: float(score) for label, score in zip(RACE_LABELS, scores)}
+                    result['dominant_race'] = RACE_LABELS[int(np.argmax(scores))]
+
+            for i, result in zip(indices, batch_results):
+                results[i] = result
+
+        return results
@@ -0,0 +1,48 @@
+import logging
+import os
+import pickle
+
+CHECKPOINT_FILE = 'checkpoint.pkl'
+
+
+def checkpoint_path(output_folder):
+    return os.path.join(output_folder, CHECKPOINT_FILE)
+
+
+def save_checkpoint(output_folder, signature, state):
+    """
+    Atomically write a processing checkpoint to the stats folder.
+
+    signature identifies the run (video and output-affecting parameters); a checkpoint is
+    only resumed by a run with the same signature. state holds the aggregators, tracker
+    and frame counters needed to continue.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    path = checkpoint_path(output_folder)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump({"signature": signature, "state": state}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(output_folder, signature):
+    """Return the checkpointed state for signature, or None if there is no usable checkpoint."""
+    path = checkpoint_path(output_folder)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            checkpoint = pickle.load(f)
+    except Exception as e:
+        logging.warning(f"Ignoring unreadable checkpoint {path}: {e}")
+        return None
+    if checkpoint.get("signature") != signature:
+        logging.info(f"Ignoring checkpoint {path} written with different parameters")
+        return None
+    return checkpoint["state"]
+
+
+def clear_checkpoint(output_folder):
+    path = checkpoint_path(output_folder)
+    if os.path.exists(path):
+        os.remove(path)
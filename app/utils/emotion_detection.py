@@ -1,11 +1,28 @@
+import contextlib
+import copy
 import cv2
 import os
-import base64
 import json
+import logging
+import time
 import numpy as np
-from collections import defaultdict
-from deepface import DeepFace
-from retinaface import RetinaFace
+from utils.analysis_profiles import resolve_profile
+from utils.batched_analysis import DEFAULT_ACTIONS, BatchedFaceAnalyzer, analyze_face, represent_face
+from utils.checkpoint import clear_checkpoint, load_checkpoint, save_checkpoint
+from utils.face_tracking import FaceTracker
+from utils.frame_sampling import FrameSampler, GRAB
+from utils.face_detectors import FaceDetector
+from utils.metrics import timed
+from utils.onnx_backend import NATIVE
+from utils.result_cache import ANALYSIS_VERSION
+from utils.stats_aggregator import FaceAggregator, TOP_K, encode_thumbnail
+from utils.stats_index import StatsIndex
+from utils.emotion_timeline import timeline_log_path
+from utils.stats_storage import BINARY, data_folder, save_face_statistics
+from utils.video_pipeline import Pipeline
+
+# Thumbnails (the most confident crops with TOP_K) averaged into a face's identity embedding
+FACE_EMBEDDING_CROPS = 5
 
 def convert_float32_to_float(obj):
     if isinstance(obj, np.float32):
@@ -17,7 +34,170 @@ def convert_float32_to_float(obj):
     else:
         return obj
 
-def process_video(video_path, output_folder, frame_interval=5):
+def update_face_stats(face_stats, face_id, analysis, face_region, frame_index=-1, aggregator_options=None,
+                      thumbnail=None, box=None, timestamp_ms=None, output_folder=None):
+    """
+    Fold one DeepFace analysis result for face_id into its constant-memory aggregator. With
+    output_folder the face's timeline is streamed to a log under its data folder there.
+    """
+    if face_id not in face_stats:
+        timeline_path = timeline_log_path(data_folder(output_folder, face_id)) if output_folder else None
+        face_stats[face_id] = FaceAggregator(**(aggregator_options or {}), timeline_path=timeline_path)
+    face_stats[face_id].update(analysis, face_region, frame_index, thumbnail=thumbnail, box=box,
+                               timestamp_ms=timestamp_ms)
+
+def sample_frames(sampler, detect_every, decode_state, sampled=0):
+    """
+    Decode stage: yield the sampled frames, flagging the ones that need full detection.
+    sampled is the number of frames already sampled before this run (when resuming).
+    """
+    frames = iter(sampler)
+    while True:
+        with timed('decode'):
+            sample = next(frames, None)
+        if sample is None:
+            break
+        frame_index, frame = sample
+        decode_state["frames_decoded"] = sampler.position
+        yield {"frame_index": frame_index, "timestamp_ms": sampler.timestamp_ms, "frame": frame,
+               "sample_number": sampled, "detect": sampled % max(detect_every, 1) == 0, "boxes": None}
+        sampled += 1
+    decode_state["frames_decoded"] = sampler.position
+
+def detect_faces(item, detector):
+    """Detect stage: run the face detector on frames scheduled for full detection."""
+    if item["detect"]:
+        with timed('detect'):
+            item["boxes"], item["detection_fallback"] = detector.detect_with_fallback(item["frame"])
+    return item
+
+def track_faces(item, tracker, checkpoint_every=0):
+    """
+    Track stage (ordered): associate detections with tracks, or follow the known faces on
+    frames without detection, and cut out the face regions. Every checkpoint_every-th
+    sampled frame carries a copy of the tracker state for the checkpoint written once
+    that frame has been aggregated.
+    """
+    frame = item["frame"]
+    with timed('track'):
+        if item["boxes"] is not None:
+            tracked_faces = tracker.update(frame, item["boxes"], item["frame_index"])
+        else:
+            tracked_faces = tracker.track(frame, item["frame_index"])
+
+    # Extract the face regions
+    with timed('crop'):
+        item["faces"] = [(f"face_{track_id}", frame[y:h, x:w]) for track_id, (x, y, w, h) in tracked_faces]
+        item["face_boxes"] = [tuple(int(v) for v in box) for _, box in tracked_faces]
+    if checkpoint_every > 0 and (item["sample_number"] + 1) % checkpoint_every == 0:
+        item["tracker_state"] = copy.deepcopy(tracker)
+    return item
+
+def analyze_faces(items, analyzer, actions=DEFAULT_ACTIONS):
+    """
+    Analyze stage: run the profile's actions (emotion/age/gender/race) on every face of the
+    given frames, as batched inference when an analyzer is given and one DeepFace.analyze
+    call per crop otherwise.
+    """
+    face_regions = [face_region for item in items for _, face_region in item["faces"]]
+
+    analyses = None
+    if analyzer is not None:
+        try:
+            analyses = analyzer.analyze(face_regions)
+        except Exception as e:
+            logging.exception(f"Error in batched face analysis, falling back to per-face analysis: {e}")
+
+    if analyses is None:
+        analyses = []
+        for face_region in face_regions:
+            try:
+                with timed('deepface_analyze'):
+                    analyses.append(analyze_face(face_region, actions))
+            except Exception as e:
+                logging.exception(f"Error analyzing face: {e}")
+                analyses.append(None)
+
+    position = 0
+    for item in items:
+        item["analyses"] = analyses[position:position + len(item["faces"])]
+        position += len(item["faces"])
+    return items
+
+def encode_thumbnails(item):
+    """Encode stage: JPEG-encode the analyzed face regions."""
+    item["thumbnails"] = [
+        encode_thumbnail(face_region) if analysis is not None else None
+        for (_, face_region), analysis in zip(item["faces"], item["analyses"])
+    ]
+    return item
+
+def process_video(video_path, output_folder, frame_interval=5, progress_callback=None, batch_size=16,
+                  detect_every=1, reid=False, stats_format=BINARY, series_capacity=10000,
+                  thumbnail_capacity=20, thumbnail_strategy=TOP_K, detect_workers=1, analyze_workers=1,
+                  encode_workers=1, queue_size=8, sampling=GRAB, samples_per_second=None, resume=False,
+                  checkpoint_every=100, partial_results_interval=2.0, profile=None, stats_index=None,
+                  face_embedding_model=None, similarity_index=None):
+    """
+    Detect faces in every frame_interval-th frame, analyze emotion/age/gender/race and
+    write per-face and overall statistics to output_folder. Each face's full emotion
+    timeline (frame index, CAP_PROP_POS_MSEC timestamp, emotion vector) is written with its
+    multi-resolution aggregates as well (see utils.emotion_timeline).
+
+    batch_size controls how many face crops (gathered across sampled frames) are analyzed
+    in one batched forward pass; 1 keeps the original one-DeepFace.analyze-per-crop path
+    (unless the profile selects an ONNX backend, which always runs batched).
+
+    Faces are followed across frames by a FaceTracker, so face ids are persistent track ids
+    rather than per-frame detection order. RetinaFace only runs on every detect_every-th
+    sampled frame; the sampled frames in between reuse the tracked boxes. reid enables
+    appearance-based re-identification of faces that were briefly lost.
+
+    stats_format selects how per-face statistics are stored (see utils.stats_storage).
+
+    Per-face memory is constant in the video length: statistics are aggregated online,
+    only the last series_capacity per-frame rows and thumbnail_capacity thumbnails
+    (selected by thumbnail_strategy, see utils.stats_aggregator) are kept, and the full
+    timeline is streamed to an append-only log in the face's data folder, from which its
+    .npy columns and aggregates are built at the end.
+
+    Decoding, detection, tracking, analysis and thumbnail encoding run as pipeline stages
+    connected by queues of queue_size items (see utils.video_pipeline); detect_workers,
+    analyze_workers and encode_workers set the threads per stage (encode_workers=0 encodes
+    lazily, only the thumbnails that are kept). Results are aggregated in frame order, so
+    the output does not depend on the worker counts. progress_callback also receives the
+    per-stage throughput and queue depth counters.
+
+    sampling picks how frames are skipped (see utils.frame_sampling): GRAB avoids
+    retrieving skipped frames, SEEK jumps between sampled frames, TIME samples
+    samples_per_second frames per second of video instead of every frame_interval-th frame.
+
+    Every checkpoint_every sampled frames (0 disables checkpointing) the aggregator and
+    tracker state and the last processed frame index are written to output_folder (see
+    utils.checkpoint); timeline logs are only recorded by their row count, so checkpoints
+    stay small however long the video is. With resume=True a checkpoint from an interrupted run with the same
+    parameters is loaded and processing continues after its last frame.
+
+    At most every partial_results_interval seconds progress_callback also receives the
+    per-face summaries aggregated so far (faces={face_id: summary}), so clients can show
+    partial results while a long video is still being processed.
+
+    profile selects the analysis actions, face detector, detection resolution and inference
+    backend: the name of a built-in profile or a dict of overrides with a "name" key (see
+    utils.analysis_profiles). The resolved profile is recorded in overall_statistics.json.
+
+    stats_index is the path of a utils.stats_index SQLite index; the finished statistics
+    are added to it, so they can be queried across videos.
+
+    face_embedding_model (a DeepFace.represent model, e.g. 'Facenet') computes an identity
+    embedding per face from its first FACE_EMBEDDING_CROPS thumbnails. similarity_index is
+    a utils.similarity_index.SimilarityIndex that the timelines and face embeddings are
+    added to for k-NN search across videos.
+    """
+    if not isinstance(profile, dict):
+        profile = {"name": profile}
+    profile = resolve_profile(**profile)
+
     # Open the video file
     cap = cv2.VideoCapture(video_path)
     if not cap.isOpened():
@@ -25,124 +205,169 @@ def process_video(video_path, output_folder, frame_interval=5):
 
     # Initialize data structures to track faces and statistics
     face_stats = {}
-    frame_count = 0
+    decode_state = {"frames_decoded": 0}
+    frames_analyzed = 0
+    # Counted per aggregated frame (detection runs ahead of aggregation), so they can be checkpointed
+    detection = {"frames": 0, "fallbacks": 0}
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) or None
+    tracker = FaceTracker(reid=reid)
+    start_frame = 0
+
+    # Everything that has to match for a checkpoint to be resumable
+    checkpoint_signature = {
+        "analysis_version": ANALYSIS_VERSION,
+        "video_path": os.path.abspath(video_path),
+        "video_size": os.path.getsize(video_path),
+        "frame_interval": frame_interval,
+        "batched": batch_size > 1,
+        "detect_every": detect_every,
+        "reid": reid,
+        "sampling": sampling,
+        "samples_per_second": samples_per_second,
+        "series_capacity": series_capacity,
+        "thumbnail_capacity": thumbnail_capacity,
+        "thumbnail_strategy": thumbnail_strategy,
+        "profile": profile,
+    }
+    if resume:
+        state = load_checkpoint(output_folder, checkpoint_signature)
+        if state is not None:
+            face_stats = state["face_stats"]
+            tracker = state["tracker"]
+            frames_analyzed = state["frames_analyzed"]
+            detection = state.get("detection", detection)
+            start_frame = state["frame_index"]
+            decode_state["frames_decoded"] = start_frame
+            logging.info(f"Resuming {video_path} after frame {start_frame}")
+
+    # Detector and attribute models come from the shared, already-loaded registry
+    detector = FaceDetector(profile["detector"], profile["detection_size"], profile["min_face_size"])
+    analyzer = None
+    if batch_size > 1 or profile["backend"] != NATIVE:
+        analyzer = BatchedFaceAnalyzer(profile["actions"], batch_size=batch_size, backend=profile["backend"])
+
+    aggregator_options = {
+        "series_capacity": series_capacity,
+        "thumbnail_capacity": thumbnail_capacity,
+        "thumbnail_strategy": thumbnail_strategy,
+    }
+
+    pipeline = Pipeline(queue_size=queue_size)
+    pipeline.add_stage('detect', lambda item: detect_faces(item, detector), workers=detect_workers)
+    pipeline.add_stage('track', lambda item: track_faces(item, tracker, checkpoint_every), ordered=True)
+    if batch_size > 1:
+        # Frames are grouped until they hold batch_size face crops
+        pipeline.add_stage('analyze', lambda items: analyze_faces(items, analyzer, profile["actions"]),
+                           workers=analyze_workers,
+                           batch_size=batch_size, batch_weight=lambda item: len(item["faces"]))
+    else:
+        pipeline.add_stage('analyze', lambda item: analyze_faces([item], analyzer, profile["actions"])[0],
+                           workers=analyze_workers)
+    if encode_workers > 0:
+        pipeline.add_stage('encode', encode_thumbnails, workers=encode_workers)
 
     # Process the video
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
+    last_partial = time.monotonic()
+    try:
+        sampler = FrameSampler(cap, sampling, frame_interval, samples_per_second, start_frame=start_frame)
+        # Closed before the capture is released, also when the loop body raises: closing
+        # stops and joins the pipeline threads, so decoding never reads a released capture
+        with contextlib.closing(pipeline.run(sample_frames(sampler, detect_every, decode_state,
+                                                           frames_analyzed))) as results:
+            for item in results:
+                thumbnails = item.get("thumbnails") or [None] * len(item["faces"])
+                for (face_id, face_region), analysis, thumbnail, box in zip(item["faces"], item["analyses"],
+                                                                            thumbnails, item["face_boxes"]):
+                    if analysis is None:
+                        continue
+                    update_face_stats(face_stats, face_id, analysis, face_region, item["frame_index"],
+                                      aggregator_options, thumbnail, box, item["timestamp_ms"], output_folder)
 
-        frame_count += 1
-
-        # Process only every nth frame
-        if frame_count % frame_interval != 0:
-            continue
-
-        # Detect faces using RetinaFace
-        faces = RetinaFace.detect_faces(frame)
-
-        if isinstance(faces, dict):  # Check if faces are detected
-            for face_id, face_data in faces.items():
-                # Extract face bounding box
-                x, y, w, h = face_data['facial_area']
-                x, y, w, h = int(x), int(y), int(w), int(h)
-
-                # Extract the face region
-                face_region = frame[y:h, x:w]
-
-                # Analyze emotions, age, gender, and race using DeepFace
-                try:
-                    analysis = DeepFace.analyze(face_region, actions=['emotion', 'age', 'gender', 'race'], enforce_detection=False)
-                    dominant_emotion = analysis[0]['dominant_emotion']
-                    emotion_scores = analysis[0]['emotion']
-                    age = analysis[0]['age']
-                    gender = analysis[0]['gender']
-                    race = analysis[0]['race']
-
-                    # Initialize face statistics if not already done
-                    if face_id not in face_stats:
-                        face_stats[face_id] = {
-                            "total_frames": 0,
-                            "emotion_counts": defaultdict(int),
-                            "emotion_confidences": defaultdict(list),
-                            "age": [],
-                            "gender": [],  # Store dominant gender as a string
-                            "race": defaultdict(list),
-                            "embeddings": [],
-                            "thumbnails": []
-                        }
-
-                    # Update face statistics
-                    face_stats[face_id]["total_frames"] += 1
-                    face_stats[face_id]["emotion_counts"][dominant_emotion] += 1
-                    for emotion, score in emotion_scores.items():
-                        face_stats[face_id]["emotion_confidences"][emotion].append(score)
-                    face_stats[face_id]["age"].append(age)
-                    
-                    # Extract dominant gender and store it
-                    dominant_gender = max(gender, key=gender.get)  # Get the gender with the highest confidence
-                    face_stats[face_id]["gender"].append(dominant_gender)
-                    
-                    for race_name, race_score in race.items():
-                        face_stats[face_id]["race"][race_name].append(race_score)
-                    face_stats[face_id]["embeddings"].append(emotion_scores)
-
-                    # Save the face thumbnail as a base64-encoded image
-                    _, buffer = cv2.imencode('.jpg', face_region)
-                    face_stats[face_id]["thumbnails"].append(base64.b64encode(buffer).decode('utf-8'))
-                except Exception as e:
-                    print(f"Error analyzing face: {e}")
-
-    # Release the video capture object
-    cap.release()
+                frames_analyzed += 1
+                if item["detect"]:
+                    detection["frames"] += 1
+                    detection["fallbacks"] += int(item["detection_fallback"])
+                if "tracker_state" in item:
+                    # Everything up to this frame is aggregated; persist it
+                    save_checkpoint(output_folder, checkpoint_signature, {
+                        "face_stats": face_stats,
+                        "tracker": item["tracker_state"],
+                        "frames_analyzed": frames_analyzed,
+                        "frame_index": item["frame_index"],
+                        "detection": dict(detection),
+                    })
+
+                # Report progress to the caller (e.g. the job queue)
+                if progress_callback is not None:
+                    partial = {}
+                    if time.monotonic() - last_partial >= partial_results_interval:
+                        partial["faces"] = {face_id: convert_float32_to_float(aggregator.summary(face_id))
+                                            for face_id, aggregator in face_stats.items()}
+                        last_partial = time.monotonic()
+                    progress_callback(frames_decoded=decode_state["frames_decoded"], frames_analyzed=frames_analyzed,
+                                      total_frames=total_frames, stages=pipeline.stats(), **partial)
+    finally:
+        # Release the video capture object
+        cap.release()
+
+    frame_count = decode_state["frames_decoded"]
+    if progress_callback is not None:
+        progress_callback(frames_decoded=frame_count, frames_analyzed=frames_analyzed, total_frames=frame_count,
+                          stages=pipeline.stats(),
+                          faces={face_id: convert_float32_to_float(aggregator.summary(face_id))
+                                 for face_id, aggregator in face_stats.items()})
 
     # Save statistics for each face
     os.makedirs(output_folder, exist_ok=True)
-    for face_id, stats in face_stats.items():
-        # Calculate most common emotion
-        most_common_emotion = max(stats["emotion_counts"], key=stats["emotion_counts"].get)
-
-        # Calculate average confidence for each emotion
-        avg_confidences = {emotion: np.mean(scores) for emotion, scores in stats["emotion_confidences"].items()}
-
-        # Calculate average age
-        avg_age = np.mean(stats["age"])
-
-        # Calculate most common gender
-        most_common_gender = max(set(stats["gender"]), key=stats["gender"].count)
-
-        # Calculate average race scores
-        avg_race = {race_name: np.mean(scores) for race_name, scores in stats["race"].items()}
-
-        # Prepare the final statistics dictionary
-        face_statistics = {
-            "face_id": face_id,
-            "total_frames_processed": stats["total_frames"],
-            "most_common_emotion": most_common_emotion,
-            "emotion_counts": dict(stats["emotion_counts"]),
-            "average_confidences": avg_confidences,
-            "average_age": avg_age,
-            "most_common_gender": most_common_gender,
-            "average_race": avg_race,
-            "probabilistic_embeddings_shape": (len(stats["embeddings"]), len(stats["embeddings"][0])),
-            "embedding_example": stats["embeddings"][0],  # Example embedding from the first frame
-            "thumbnails": stats["thumbnails"]  # List of base64-encoded thumbnails
-        }
-
-        # Save statistics to a JSON file
-        face_statistics = convert_float32_to_float(face_statistics)
-        output_file = os.path.join(output_folder, f"face_{face_id}_statistics.json")
-        with open(output_file, "w") as f:
-            json.dump(face_statistics, f, indent=4)
+    face_summaries = []
+    for face_id, aggregator in face_stats.items():
+        # Save the summary, series and thumbnails
+        face_statistics = convert_float32_to_float(aggregator.summary(face_id))
+        face_summaries.append(face_statistics)
+        thumbnails = aggregator.thumbnails()
+        face_embedding = None
+        if face_embedding_model and thumbnails:
+            try:
+                crops = [cv2.imdecode(np.frombuffer(t, dtype=np.uint8), cv2.IMREAD_COLOR)
+                         for t in thumbnails[:FACE_EMBEDDING_CROPS]]
+                face_embedding = (face_embedding_model, represent_face(crops, face_embedding_model))
+            except Exception as e:
+                logging.exception(f"Error computing the face embedding of {face_id}: {e}")
+        with timed('write_stats'):
+            save_face_statistics(output_folder, face_id, face_statistics, aggregator.series(),
+                                 thumbnails, stats_format, aggregator.timeline(), face_embedding)
 
     # Save overall statistics
     overall_stats = {
+        "video_path": video_path,
         "total_frames_processed": frame_count,
         "total_faces_detected": len(face_stats),
-        "faces": list(face_stats.keys())
+        "faces": list(face_stats.keys()),
+        "stats_format": stats_format,
+        "profile": profile,
+        "detection": dict(detection, fallback_rate=detection["fallbacks"] / detection["frames"]
+                          if detection["frames"] else 0.0),
     }
 
     overall_stats_file = os.path.join(output_folder, "overall_statistics.json")
-    with open(overall_stats_file, "w") as f:
-        json.dump(overall_stats, f, indent=4)
\ No newline at end of file
+    with timed('write_stats'), open(overall_stats_file, "w") as f:
+        json.dump(overall_stats, f, indent=4)
+
+    if stats_index is not None:
+        try:
+            with timed('write_stats'):
+                StatsIndex(stats_index).add(output_folder, overall_stats, face_summaries)
+        except Exception as e:
+            # The statistics themselves are written; a later backfill can index them
+            logging.exception(f"Error indexing statistics of {output_folder}: {e}")
+    if similarity_index is not None:
+        try:
+            similarity_index.add_folder(output_folder)
+        except Exception as e:
+            logging.exception(f"Error adding {output_folder} to the similarity index: {e}")
+
+    # The statistics are complete; the checkpoint and the timeline logs are no longer needed
+    clear_checkpoint(output_folder)
+    for aggregator in face_stats.values():
+        if aggregator.timeline_log is not None:
+            aggregator.timeline_log.remove()
\ No newline at end of file
@@ -0,0 +1,244 @@
+import json
+import os
+
+import numpy as np
+
+TIMELINE_FOLDER = 'timeline'
+TIMELINE_META = 'timeline.json'
+
+# Aggregate pyramid: level 0 bins are BASE_BIN_MS wide, every further level LEVEL_FACTOR
+# times wider, until one bin covers the whole timeline (250 ms, 1 s, 4 s, 16 s, ...)
+BASE_BIN_MS = 250
+LEVEL_FACTOR = 4
+DEFAULT_MAX_POINTS = 1000
+
+
+TIMELINE_LOG = 'timeline.rows'
+
+
+class TimelineLog:
+    """
+    Complete per-frame timeline of one face (frame index, timestamp in ms and emotion
+    vector of every analyzed frame), streamed to an append-only file of fixed-size rows.
+    Only the last ``flush_rows`` rows are held in memory, so memory stays constant however
+    long the video is (a two-hour video sampled every 5th frame is ~43k rows, ~2 MB on disk).
+
+    Pickling (in a processing checkpoint) flushes the buffer and stores only the path and
+    row count; unpickling truncates the file back to that count, dropping rows appended
+    after the checkpoint, which the resumed run analyzes again.
+    """
+
+    def __init__(self, path, flush_rows=256):
+        self.path = path
+        self.flush_rows = flush_rows
+        self.count = 0
+        self.width = None
+        self._pending = []
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, 'wb').close()  # A fresh run never appends to a stale log
+
+    def dtype(self):
+        return np.dtype([('frame_index', np.int64), ('timestamp_ms', np.float64),
+                         ('emotion', np.float32, (self.width,))])
+
+    def append(self, frame_index, timestamp_ms, emotion_vector):
+        if self.width is None:
+            self.width = len(emotion_vector)
+        self._pending.append((frame_index, timestamp_ms, emotion_vector))
+        self.count += 1
+        if len(self._pending) >= self.flush_rows:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        with open(self.path, 'ab') as f:
+            f.write(np.array(self._pending, dtype=self.dtype()).tobytes())
+        self._pending = []
+
+    def values(self):
+        """(frame_index, timestamp_ms, emotion) columns of the appended rows, memory-mapped."""
+        self.flush()
+        if self.count == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros((0, 0), dtype=np.float32)
+        rows = np.memmap(self.path, dtype=self.dtype(), mode='r', shape=(self.count,))
+        return rows['frame_index'], rows['timestamp_ms'], rows['emotion']
+
+    def remove(self):
+        self._pending = []
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __getstate__(self):
+        self.flush()
+        return {"path": self.path, "flush_rows": self.flush_rows, "count": self.count, "width": self.width}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._pending = []
+        size = self.count * self.dtype().itemsize if self.width is not None else 0
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < size:
+            raise ValueError(f"Timeline log {self.path} is shorter than its checkpointed {self.count} rows")
+        with open(self.path, 'r+b') as f:
+            f.truncate(size)
+
+
+def _aggregate(bins, count, total, minimum, maximum):
+    """Merge rows with equal (sorted) bin numbers: counts and sums add up, min/max reduce."""
+    starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+    return (bins[starts], np.add.reduceat(count, starts), np.add.reduceat(total, starts),
+            np.minimum.reduceat(minimum, starts), np.maximum.reduceat(maximum, starts))
+
+
+def build_levels(timestamp_ms, emotion, base_bin_ms=BASE_BIN_MS, factor=LEVEL_FACTOR):
+    """
+    Multi-resolution aggregates of a timeline sorted by timestamp, as a list of levels,
+    finest first. Each level is a dict of arrays over its non-empty bins: bin (bin number;
+    the bin starts at bin * bin_ms), count, sum, min and max of every emotion. Level k + 1
+    is computed from level k, so building the pyramid is linear in the number of samples.
+    """
+    if len(timestamp_ms) == 0:
+        return []
+    values = np.asarray(emotion, dtype=np.float64)
+    bins = (np.asarray(timestamp_ms) // base_bin_ms).astype(np.int64)
+    level = _aggregate(bins, np.ones(len(bins), dtype=np.int64), values, values, values)
+    levels = []
+    bin_ms = base_bin_ms
+    while True:
+        levels.append({"bin_ms": bin_ms, "bin": level[0], "count": level[1], "sum": level[2],
+                       "min": level[3], "max": level[4]})
+        if len(level[0]) <= 1:
+            return levels
+        bin_ms *= factor
+        level = _aggregate(level[0] // factor, *level[1:])
+
+
+def save_timeline(folder, frame_index, timestamp_ms, emotion, labels, base_bin_ms=BASE_BIN_MS,
+                  factor=LEVEL_FACTOR):
+    """
+    Write a timeline and its aggregate pyramid to folder as .npy columns (memory-mappable)
+    plus timeline.json; returns the metadata written there.
+    """
+    # Range queries binary-search the timestamps; backend timestamps are not guaranteed to
+    # be monotonic (e.g. after a seek)
+    timestamp_ms = np.asarray(timestamp_ms, dtype=np.float64)
+    order = np.argsort(timestamp_ms, kind='stable')
+    timestamp_ms = timestamp_ms[order]
+    emotion = np.asarray(emotion, dtype=np.float32)[order]
+    os.makedirs(folder, exist_ok=True)
+    np.save(os.path.join(folder, 'frame_index.npy'), np.asarray(frame_index, dtype=np.int64)[order])
+    np.save(os.path.join(folder, 'timestamp_ms.npy'), timestamp_ms)
+    np.save(os.path.join(folder, 'emotion.npy'), emotion)
+    levels = build_levels(timestamp_ms, emotion, base_bin_ms, factor)
+    for k, level in enumerate(levels):
+        for name in ('bin', 'count', 'sum', 'min', 'max'):
+            np.save(os.path.join(folder, f'level_{k}_{name}.npy'), level[name])
+    meta = {
+        "labels": list(labels or []),
+        "samples": int(len(timestamp_ms)),
+        "start_ms": float(timestamp_ms[0]) if len(timestamp_ms) else None,
+        "end_ms": float(timestamp_ms[-1]) if len(timestamp_ms) else None,
+        "levels": [{"bin_ms": level["bin_ms"], "bins": int(len(level["bin"]))} for level in levels],
+    }
+    with open(os.path.join(folder, TIMELINE_META), 'w') as f:
+        json.dump(meta, f, indent=4)
+    return meta
+
+
+def timeline_folder(face_data_folder):
+    return os.path.join(face_data_folder, TIMELINE_FOLDER)
+
+
+def timeline_log_path(face_data_folder):
+    """Where process_video streams a face's TimelineLog until the timeline is saved."""
+    return os.path.join(timeline_folder(face_data_folder), TIMELINE_LOG)
+
+
+def _load(folder, name):
+    return np.load(os.path.join(folder, f'{name}.npy'), mmap_mode='r')
+
+
+def load_timeline(folder):
+    """(frame_index, timestamp_ms, emotion, labels) of a saved timeline, memory-mapped."""
+    with open(os.path.join(folder, TIMELINE_META), 'r') as f:
+        labels = json.load(f)["labels"]
+    return _load(folder, 'frame_index'), _load(folder, 'timestamp_ms'), _load(folder, 'emotion'), labels
+
+
+def timeline_sample(folder, timestamp_ms):
+    """(frame_index, timestamp_ms, {emotion: score}) of the sample closest to timestamp_ms."""
+    frame_index, timestamps, emotion, labels = load_timeline(folder)
+    if len(timestamps) == 0:
+        raise ValueError("The timeline is empty")
+    position = int(np.clip(np.searchsorted(timestamps, timestamp_ms), 1, len(timestamps) - 1)) \
+        if len(timestamps) > 1 else 0
+    if position > 0 and abs(timestamps[position - 1] - timestamp_ms) <= abs(timestamps[position] - timestamp_ms):
+        position -= 1
+    return int(frame_index[position]), float(timestamps[position]), dict(zip(labels, emotion[position].tolist()))
+
+
+def _columns(labels, matrix):
+    return {label: matrix[:, i].tolist() for i, label in enumerate(labels)}
+
+
+def query_timeline(folder, start_ms=None, end_ms=None, max_points=DEFAULT_MAX_POINTS, resolution_ms=None):
+    """
+    The timeline in folder over [start_ms, end_ms] (default: all of it), columnar.
+
+    With resolution_ms the coarsest level whose bins are at most resolution_ms wide is used
+    (raw samples if resolution_ms is below the finest bin). Otherwise the raw samples are
+    returned when there are at most max_points of them in the range, else the finest level
+    with at most max_points bins in the range. Only the selected slice of the memory-mapped
+    arrays is read, found by binary search, so the cost depends on the points returned and
+    not on the video's length. Raw results carry frame_index and emotion; aggregates carry
+    each bin's sample count and mean, min and max per emotion, timestamp_ms being bin starts.
+    """
+    with open(os.path.join(folder, TIMELINE_META), 'r') as f:
+        meta = json.load(f)
+    labels = meta["labels"]
+    max_points = max(1, int(max_points))
+    start_ms = -np.inf if start_ms is None else float(start_ms)
+    end_ms = np.inf if end_ms is None else float(end_ms)
+    result = {"labels": labels, "start_ms": meta["start_ms"], "end_ms": meta["end_ms"], "samples": meta["samples"]}
+
+    timestamps = _load(folder, 'timestamp_ms')
+    first = np.searchsorted(timestamps, start_ms, side='left')
+    last = np.searchsorted(timestamps, end_ms, side='right')
+    levels = meta["levels"]
+    if resolution_ms is not None:
+        eligible = [k for k, level in enumerate(levels) if level["bin_ms"] <= resolution_ms]
+        selected = eligible[-1] if eligible else None
+    elif last - first <= max_points:
+        selected = None
+    else:
+        selected = len(levels) - 1
+        for k, level in enumerate(levels):
+            bins = _load(folder, f'level_{k}_bin')
+            lo, hi = _bin_range(bins, level["bin_ms"], start_ms, end_ms)
+            if hi - lo <= max_points:
+                selected = k
+                break
+
+    if selected is None:
+        result.update(resolution_ms=None, frame_index=_load(folder, 'frame_index')[first:last].tolist(),
+                      timestamp_ms=timestamps[first:last].tolist(),
+                      emotion=_columns(labels, _load(folder, 'emotion')[first:last]))
+        return result
+
+    bin_ms = levels[selected]["bin_ms"]
+    bins = _load(folder, f'level_{selected}_bin')
+    lo, hi = _bin_range(bins, bin_ms, start_ms, end_ms)
+    count = np.asarray(_load(folder, f'level_{selected}_count')[lo:hi])
+    mean = np.asarray(_load(folder, f'level_{selected}_sum')[lo:hi]) / count[:, None]
+    result.update(resolution_ms=bin_ms, timestamp_ms=(np.asarray(bins[lo:hi]) * bin_ms).tolist(),
+                  count=count.tolist(), mean=_columns(labels, mean),
+                  min=_columns(labels, _load(folder, f'level_{selected}_min')[lo:hi]),
+                  max=_columns(labels, _load(folder, f'level_{selected}_max')[lo:hi]))
+    return result
+
+
+def _bin_range(bins, bin_ms, start_ms, end_ms):
+    """Index range of the bins overlapping [start_ms, end_ms]."""
+    first_bin = np.floor(start_ms / bin_ms) if np.isfinite(start_ms) else np.iinfo(np.int64).min
+    last_bin = np.floor(end_ms / bin_ms) if np.isfinite(end_ms) else np.iinfo(np.int64).max
+    return np.searchsorted(bins, first_bin, side='left'), np.searchsorted(bins, last_bin, side='right')
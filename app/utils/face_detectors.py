@@ -0,0 +1,119 @@
+import threading
+
+import cv2
+
+from utils.model_registry import get_retinaface, get_yunet_model_path
+
+# Detector backends
+RETINAFACE = 'retinaface'  # Most accurate, slowest
+HAAR = 'haar'              # OpenCV Haar cascade
+YUNET = 'yunet'            # OpenCV YuNet: small CNN, fast on CPU
+DETECTORS = (RETINAFACE, HAAR, YUNET)
+
+
+def scale_to_short_side(frame, short_side):
+    """Downscale frame so its short side is short_side pixels; returns (image, scale). Never upscales."""
+    height, width = frame.shape[:2]
+    if not short_side or min(height, width) <= short_side:
+        return frame, 1.0
+    scale = short_side / min(height, width)
+    size = (int(round(width * scale)), int(round(height * scale)))
+    return cv2.resize(frame, size, interpolation=cv2.INTER_AREA), scale
+
+
+class FaceDetector:
+    """
+    Face detection with a selectable backend.
+
+    ``detect`` returns (x1, y1, x2, y2) boxes in coordinates of the frame it was given.
+    With ``detection_size`` the backend runs on a copy downscaled to that short side and
+    the boxes are mapped back, so callers always crop from the full-resolution frame.
+    Small faces are easily missed at the lower resolution: when the downscaled pass finds
+    a face whose short side is under ``min_face_size`` pixels (in the downscaled image),
+    the frame is detected again at full resolution. Frames where it finds nothing are only
+    retried with ``retry_empty``; most frames of real footage hold no face, and retrying
+    them all would cancel the speedup of the downscaled pass.
+    OpenCV detectors are not thread-safe; each thread gets its own instance.
+    """
+
+    def __init__(self, backend=RETINAFACE, detection_size=None, min_face_size=20, retry_empty=False):
+        if backend not in DETECTORS:
+            raise ValueError(f"Unknown detector: {backend}")
+        self.backend = backend
+        self.detection_size = detection_size
+        self.min_face_size = min_face_size
+        self.retry_empty = retry_empty
+        self.frames = 0
+        self.fallbacks = 0  # Frames detected again at full resolution
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        if backend == RETINAFACE:
+            self.retinaface_model = get_retinaface()
+        elif backend == YUNET:
+            self.yunet_model_path = get_yunet_model_path()
+
+    def _detect_retinaface(self, image):
+        from retinaface import RetinaFace
+        faces = RetinaFace.detect_faces(image, model=self.retinaface_model)
+        if not isinstance(faces, dict):  # No faces detected
+            return []
+        return [tuple(int(v) for v in face_data['facial_area']) for face_data in faces.values()]
+
+    def _detect_haar(self, image, scale):
+        if not hasattr(self._local, 'cascade'):
+            self._local.cascade = cv2.CascadeClassifier(
+                cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        min_side = max(20, int(50 * scale))  # 50px faces at full resolution
+        faces = self._local.cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5,
+                                                     minSize=(min_side, min_side))
+        return [(int(x), int(y), int(x + w), int(y + h)) for (x, y, w, h) in faces]
+
+    def _detect_yunet(self, image):
+        height, width = image.shape[:2]
+        if not hasattr(self._local, 'yunet'):
+            self._local.yunet = cv2.FaceDetectorYN.create(self.yunet_model_path, "", (width, height),
+                                                          score_threshold=0.7)
+        self._local.yunet.setInputSize((width, height))
+        _, faces = self._local.yunet.detect(image)
+        if faces is None:
+            return []
+        boxes = []
+        for x, y, w, h in faces[:, :4]:
+            boxes.append((max(int(x), 0), max(int(y), 0), min(int(x + w), width), min(int(y + h), height)))
+        return boxes
+
+    def _detect(self, image, scale=1.0):
+        if self.backend == RETINAFACE:
+            return self._detect_retinaface(image)
+        if self.backend == HAAR:
+            return self._detect_haar(image, scale)
+        return self._detect_yunet(image)
+
+    def detect(self, frame):
+        return self.detect_with_fallback(frame)[0]
+
+    def detect_with_fallback(self, frame):
+        """(boxes, whether the frame was detected again at full resolution)."""
+        image, scale = scale_to_short_side(frame, self.detection_size)
+        boxes = self._detect(image, scale)
+        with self._lock:
+            self.frames += 1
+        if scale == 1.0:
+            return boxes, False
+
+        if boxes:
+            retry = min(min(x2 - x1, y2 - y1) for x1, y1, x2, y2 in boxes) < self.min_face_size
+        else:
+            retry = self.retry_empty
+        if retry:
+            with self._lock:
+                self.fallbacks += 1
+            return self._detect(frame), True
+        # Map back to full-resolution coordinates
+        return [tuple(int(round(v / scale)) for v in box) for box in boxes], False
+
+    def stats(self):
+        with self._lock:
+            return {"frames": self.frames, "fallbacks": self.fallbacks,
+                    "fallback_rate": self.fallbacks / self.frames if self.frames else 0.0}
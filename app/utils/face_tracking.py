@@ -0,0 +1,234 @@
+import cv2
+import numpy as np
+
+# Template matching runs on crops scaled so their longest side is at most this many pixels
+TEMPLATE_MAX_SIDE = 64
+
+
+def iou(box_a, box_b):
+    """Intersection over union of two (x1, y1, x2, y2) boxes."""
+    ix1, iy1 = max(box_a[0], box_b[0]), max(box_a[1], box_b[1])
+    ix2, iy2 = min(box_a[2], box_b[2]), min(box_a[3], box_b[3])
+    inter = max(0, ix2 - ix1) * max(0, iy2 - iy1)
+    area_a = max(0, box_a[2] - box_a[0]) * max(0, box_a[3] - box_a[1])
+    area_b = max(0, box_b[2] - box_b[0]) * max(0, box_b[3] - box_b[1])
+    union = area_a + area_b - inter
+    return inter / union if union > 0 else 0.0
+
+
+def centroid_distance(box_a, box_b):
+    """Distance between box centres, relative to the diagonal of box_a."""
+    ca = np.array([(box_a[0] + box_a[2]) / 2, (box_a[1] + box_a[3]) / 2])
+    cb = np.array([(box_b[0] + box_b[2]) / 2, (box_b[1] + box_b[3]) / 2])
+    diagonal = np.hypot(box_a[2] - box_a[0], box_a[3] - box_a[1])
+    return float(np.linalg.norm(ca - cb) / max(diagonal, 1.0))
+
+
+def histogram_embedding(face_region):
+    """Cheap appearance embedding: L2-normalized hue/saturation histogram of the face crop."""
+    hsv = cv2.cvtColor(face_region, cv2.COLOR_BGR2HSV)
+    hist = cv2.calcHist([hsv], [0, 1], None, [16, 16], [0, 180, 0, 256]).flatten()
+    norm = np.linalg.norm(hist)
+    return hist / norm if norm > 0 else hist
+
+
+def clip_box(box, frame_shape):
+    height, width = frame_shape[:2]
+    x1, y1, x2, y2 = box
+    return (int(min(max(x1, 0), width)), int(min(max(y1, 0), height)),
+            int(min(max(x2, 0), width)), int(min(max(y2, 0), height)))
+
+
+class Track:
+    def __init__(self, track_id, box, gray, frame_index, embedding=None):
+        self.track_id = track_id
+        self.box = box
+        self.last_seen = frame_index
+        self.missed = 0
+        self.hits = 1
+        self.embedding = embedding
+        self.template = None
+        self.set_template(gray)
+
+    def set_template(self, gray):
+        x1, y1, x2, y2 = self.box
+        crop = gray[y1:y2, x1:x2]
+        self.template = crop.copy() if crop.size > 0 else None
+
+    def update_embedding(self, embedding, momentum=0.8):
+        if embedding is None:
+            return
+        if self.embedding is None:
+            self.embedding = embedding
+        else:
+            mixed = momentum * self.embedding + (1 - momentum) * embedding
+            self.embedding = mixed / max(np.linalg.norm(mixed), 1e-12)
+
+
+class FaceTracker:
+    """
+    Assigns persistent track ids to face boxes across frames.
+
+    ``update`` associates fresh detections with existing tracks by IoU (falling back to
+    centroid distance for fast motion) and, when ``reid`` is enabled, re-identifies faces
+    that were lost for a while by appearance embedding. ``track`` follows the existing
+    boxes on frames where detection is skipped, using template matching in a small
+    search window around each box.
+
+    Track ids start at 1 and are never reused.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_centroid_distance=0.5, max_missed=3,
+                 track_threshold=0.6, reid=False, reid_threshold=0.8, max_lost=50):
+        self.iou_threshold = iou_threshold
+        self.max_centroid_distance = max_centroid_distance
+        self.max_missed = max_missed
+        self.track_threshold = track_threshold
+        self.reid = reid
+        self.reid_threshold = reid_threshold
+        self.max_lost = max_lost
+        self.tracks = []  # Active tracks
+        self.lost = []  # Tracks that went missing, kept for re-identification
+        self._next_id = 1
+
+    def _new_track(self, box, gray, frame_index, embedding):
+        track = Track(self._next_id, box, gray, frame_index, embedding)
+        self._next_id += 1
+        self.tracks.append(track)
+        return track
+
+    def _match(self, boxes):
+        """Greedy association of detections to active tracks. Returns {detection index: track}."""
+        candidates = []
+        for t, track in enumerate(self.tracks):
+            for d, box in enumerate(boxes):
+                overlap = iou(track.box, box)
+                if overlap >= self.iou_threshold:
+                    candidates.append((-overlap, 0, t, d))
+                else:
+                    distance = centroid_distance(track.box, box)
+                    if distance <= self.max_centroid_distance:
+                        # Ranked after every IoU match
+                        candidates.append((distance, 1, t, d))
+
+        matches = {}
+        used_tracks = set()
+        for _, _, t, d in sorted(candidates, key=lambda c: (c[1], c[0])):
+            if t in used_tracks or d in matches:
+                continue
+            matches[d] = self.tracks[t]
+            used_tracks.add(t)
+        return matches
+
+    def _reidentify(self, embedding, exclude):
+        best, best_score = None, self.reid_threshold
+        for track in self.lost + self.tracks:
+            if track in exclude or track.embedding is None:
+                continue
+            score = float(np.dot(track.embedding, embedding))
+            if score >= best_score:
+                best, best_score = track, score
+        return best
+
+    def _age_unmatched(self, matched):
+        still_active = []
+        for track in self.tracks:
+            if track not in matched:
+                track.missed += 1
+            if track.missed > self.max_missed:
+                self.lost.append(track)
+            else:
+                still_active.append(track)
+        self.tracks = still_active
+        self.lost = self.lost[-self.max_lost:]
+
+    def update(self, frame, boxes, frame_index):
+        """
+        Associate detections (list of (x1, y1, x2, y2) boxes) with tracks.
+        Returns a list of (track_id, box), one per detection, in detection order.
+        """
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        boxes = [clip_box(box, frame.shape) for box in boxes]
+        matches = self._match(boxes)
+
+        results = []
+        matched = set(matches.values())
+        for d, box in enumerate(boxes):
+            embedding = None
+            if self.reid:
+                x1, y1, x2, y2 = box
+                face_region = frame[y1:y2, x1:x2]
+                embedding = histogram_embedding(face_region) if face_region.size > 0 else None
+
+            track = matches.get(d)
+            if track is None and embedding is not None:
+                track = self._reidentify(embedding, matched)
+                if track is not None:
+                    if track in self.lost:
+                        self.lost.remove(track)
+                        self.tracks.append(track)
+                    matched.add(track)
+            if track is None:
+                track = self._new_track(box, gray, frame_index, embedding)
+                matched.add(track)
+            else:
+                track.box = box
+                track.last_seen = frame_index
+                track.missed = 0
+                track.hits += 1
+                track.set_template(gray)
+                track.update_embedding(embedding)
+            results.append((track.track_id, box))
+
+        self._age_unmatched(matched)
+        return results
+
+    def track(self, frame, frame_index):
+        """
+        Follow the active tracks into a frame without running detection.
+        Returns a list of (track_id, box) for the tracks that were found again.
+        """
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        results = []
+        found = set()
+        for track in self.tracks:
+            box = self._follow(track, gray)
+            if box is None:
+                continue
+            track.box = box
+            track.last_seen = frame_index
+            track.set_template(gray)
+            found.add(track)
+            results.append((track.track_id, box))
+
+        self._age_unmatched(found)
+        return results
+
+    def _follow(self, track, gray):
+        if track.template is None:
+            return None
+        x1, y1, x2, y2 = track.box
+        box_w, box_h = x2 - x1, y2 - y1
+
+        # Search in a window twice the size of the box, centred on it
+        window = clip_box((x1 - box_w // 2, y1 - box_h // 2, x2 + box_w // 2, y2 + box_h // 2), gray.shape)
+        wx1, wy1, wx2, wy2 = window
+        search = gray[wy1:wy2, wx1:wx2]
+        if search.shape[0] < box_h or search.shape[1] < box_w:
+            return None
+
+        scale = min(1.0, TEMPLATE_MAX_SIDE / max(box_w, box_h, 1))
+        template = track.template
+        if scale < 1.0:
+            template = cv2.resize(template, (max(1, int(box_w * scale)), max(1, int(box_h * scale))))
+            search = cv2.resize(search, (max(template.shape[1], int(search.shape[1] * scale)),
+                                         max(template.shape[0], int(search.shape[0] * scale))))
+
+        scores = cv2.matchTemplate(search, template, cv2.TM_CCOEFF_NORMED)
+        _, best_score, _, best_loc = cv2.minMaxLoc(scores)
+        if best_score < self.track_threshold:
+            return None
+
+        nx1 = wx1 + int(best_loc[0] / scale)
+        ny1 = wy1 + int(best_loc[1] / scale)
+        return clip_box((nx1, ny1, nx1 + box_w, ny1 + box_h), gray.shape)
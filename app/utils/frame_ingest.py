@@ -0,0 +1,115 @@
+import os
+import re
+import uuid
+
+import cv2
+import numpy as np
+
+from utils.batched_analysis import BatchedFaceAnalyzer
+from utils.face_detectors import RETINAFACE, FaceDetector
+from utils.onnx_backend import NATIVE
+
+# Leading bytes of the accepted image formats and the extension their files get
+IMAGE_SIGNATURES = {b'\xff\xd8\xff': '.jpg', b'\x89PNG\r\n\x1a\n': '.png'}
+CHUNK_SIZE = 64 * 1024
+_SESSION_ID = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+def new_session_id():
+    return uuid.uuid4().hex
+
+
+def valid_session_id(session_id):
+    return bool(session_id) and _SESSION_ID.match(session_id) is not None
+
+
+def image_extension(header):
+    """File extension for an encoded image's leading bytes; ValueError if it is not a JPEG or PNG."""
+    for signature, extension in IMAGE_SIGNATURES.items():
+        if bytes(header[:len(signature)]) == signature:
+            return extension
+    raise ValueError("Frame must be a JPEG or PNG image")
+
+
+def decode_frame(data):
+    """Decode JPEG/PNG bytes (or any buffer) into a BGR array without copying the encoded bytes."""
+    frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if frame is None:
+        raise ValueError("Could not decode frame")
+    return frame
+
+
+def session_frame_path(folder, session_id):
+    """Path of the saved frame of session_id in folder, or None if the session has none."""
+    for extension in IMAGE_SIGNATURES.values():
+        path = os.path.join(folder, session_id + extension)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def _replace_session_frame(folder, session_id, extension, tmp_path):
+    path = os.path.join(folder, session_id + extension)
+    os.replace(tmp_path, path)
+    # A frame saved earlier in the other format is stale now
+    for other in IMAGE_SIGNATURES.values():
+        if other != extension and os.path.exists(os.path.join(folder, session_id + other)):
+            os.remove(os.path.join(folder, session_id + other))
+    return path
+
+
+def save_frame_bytes(data, folder, session_id):
+    """Write an encoded frame as session_id's frame in folder; returns its path."""
+    extension = image_extension(data)
+    os.makedirs(folder, exist_ok=True)
+    tmp_path = os.path.join(folder, f".{session_id}.{uuid.uuid4().hex}.tmp")
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    return _replace_session_frame(folder, session_id, extension, tmp_path)
+
+
+def save_frame_stream(stream, folder, session_id, max_bytes=None):
+    """
+    Copy an encoded frame from a file-like stream to session_id's frame in folder in
+    CHUNK_SIZE pieces, without holding the whole body in memory; returns its path.
+    Raises ValueError for bodies that are not JPEG/PNG, empty or larger than max_bytes.
+    """
+    first = stream.read(CHUNK_SIZE)
+    if not first:
+        raise ValueError("No frame data provided")
+    extension = image_extension(first)
+    os.makedirs(folder, exist_ok=True)
+    tmp_path = os.path.join(folder, f".{session_id}.{uuid.uuid4().hex}.tmp")
+    written = 0
+    try:
+        with open(tmp_path, 'wb') as f:
+            chunk = first
+            while chunk:
+                written += len(chunk)
+                if max_bytes is not None and written > max_bytes:
+                    raise ValueError(f"Frame is larger than {max_bytes} bytes")
+                f.write(chunk)
+                chunk = stream.read(CHUNK_SIZE)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    return _replace_session_frame(folder, session_id, extension, tmp_path)
+
+
+class FrameAnalyzer:
+    """Face detection and emotion analysis of single frames, all faces in one batched call."""
+
+    def __init__(self, detector=RETINAFACE, detection_size=None, min_face_size=20, backend=NATIVE):
+        self.detector = FaceDetector(detector, detection_size, min_face_size)
+        self.analyzer = BatchedFaceAnalyzer(actions=('emotion',), backend=backend)
+
+    def analyze(self, frame):
+        """One {"box": [x1, y1, x2, y2], "dominant_emotion", "emotion"} dict per analyzable face."""
+        boxes = self.detector.detect(frame)
+        crops = [frame[y1:y2, x1:x2] for x1, y1, x2, y2 in boxes]
+        faces = []
+        for box, analysis in zip(boxes, self.analyzer.analyze(crops)):
+            if analysis is not None:
+                faces.append({"box": [int(v) for v in box], "dominant_emotion": analysis['dominant_emotion'],
+                              "emotion": analysis['emotion']})
+        return faces
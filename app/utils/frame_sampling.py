@@ -0,0 +1,119 @@
+import cv2
+
+# Frame sampling strategies
+READ = 'read'  # cap.read() every frame and drop the unwanted ones (original behaviour)
+GRAB = 'grab'  # cap.grab() skipped frames, retrieve only the sampled ones
+SEEK = 'seek'  # Jump straight to each sampled frame with CAP_PROP_POS_FRAMES
+TIME = 'time'  # Sample a fixed number of frames per second of video
+AUTO = 'auto'  # SEEK for large intervals on seekable files, GRAB otherwise
+SAMPLING_STRATEGIES = (READ, GRAB, SEEK, TIME, AUTO)
+
+# Above this interval a seek (keyframe jump + short decode) beats grabbing every frame
+DEFAULT_SEEK_THRESHOLD = 60
+
+
+class FrameSampler:
+    """
+    Iterates over the sampled frames of a cv2.VideoCapture, yielding (frame_index, frame).
+
+    frame_index is 1-based, like the frame_count process_video always used: with
+    frame_interval=40 the frames yielded are 40, 80, 120, ... For TIME sampling the
+    frames nearest to k / samples_per_second seconds are yielded instead.
+
+    ``position`` is the number of frames the capture has advanced past and ``decoded``
+    the number of frames that were actually retrieved into an image. ``timestamp_ms`` is
+    the presentation time of the frame yielded last (CAP_PROP_POS_MSEC, or its index over
+    the frame rate for backends that do not report it).
+    """
+
+    def __init__(self, cap, strategy=GRAB, frame_interval=40, samples_per_second=None,
+                 seek_threshold=DEFAULT_SEEK_THRESHOLD, start_frame=0):
+        if strategy not in SAMPLING_STRATEGIES:
+            raise ValueError(f"Unknown sampling strategy: {strategy}")
+        self.cap = cap
+        self.frame_interval = max(1, int(frame_interval))
+        self.samples_per_second = samples_per_second
+        self.fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+        self.frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) or 0
+
+        if strategy == TIME and (not samples_per_second or self.fps <= 0):
+            # Without a known frame rate fall back to every frame_interval-th frame
+            strategy = GRAB
+        if strategy == AUTO:
+            seekable = self.frame_count > 0
+            strategy = SEEK if seekable and self.frame_interval >= seek_threshold else GRAB
+        self.strategy = strategy
+
+        self.position = 0
+        self.decoded = 0
+        self.timestamp_ms = 0.0
+        if start_frame > 0:
+            self._seek(start_frame)
+
+    def _seek(self, position):
+        """Move the capture so the next read returns 0-based frame ``position``."""
+        if self.cap.set(cv2.CAP_PROP_POS_FRAMES, position):
+            actual = int(self.cap.get(cv2.CAP_PROP_POS_FRAMES))
+            if actual >= position:
+                # Backends that land past the target return the nearest later frame
+                self.position = actual
+                return True
+            if actual >= 0:
+                self.position = actual
+        # Not seekable (or landed short of the target): advance by grabbing
+        while self.position < position:
+            if not self.cap.grab():
+                return False
+            self.position += 1
+        return self.position == position
+
+    def _next_target(self, sample_number):
+        """0-based index of the next frame to return."""
+        if self.strategy == TIME:
+            return int(round(sample_number * self.fps / self.samples_per_second))
+        return (sample_number + 1) * self.frame_interval - 1
+
+    def _timestamp_ms(self):
+        timestamp_ms = self.cap.get(cv2.CAP_PROP_POS_MSEC)
+        if timestamp_ms <= 0 and self.position > 1 and self.fps > 0:
+            timestamp_ms = (self.position - 1) * 1000.0 / self.fps
+        return float(timestamp_ms)
+
+    def __iter__(self):
+        sample_number = 0
+        # Resume past frames that were already consumed (e.g. start_frame)
+        while self._next_target(sample_number) < self.position:
+            sample_number += 1
+
+        while True:
+            target = self._next_target(sample_number)
+            sample_number += 1
+            if target < self.position:
+                continue  # TIME sampling faster than the frame rate maps several samples to one frame
+
+            if self.strategy == READ:
+                frame = None
+                while self.position <= target:
+                    ret, frame = self.cap.read()
+                    if not ret:
+                        return
+                    self.position += 1
+                    self.decoded += 1
+            else:
+                if self.strategy == SEEK and target - self.position > 1:
+                    if not self._seek(target):
+                        return
+                else:
+                    while self.position < target:
+                        if not self.cap.grab():
+                            return
+                        self.position += 1
+                ret, frame = self.cap.read()
+                if not ret:
+                    return
+                self.position += 1
+                self.decoded += 1
+
+            self.timestamp_ms = self._timestamp_ms()
+            # 1-based index of the frame just read (normally target + 1)
+            yield self.position, frame
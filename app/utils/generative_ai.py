@@ -2,10 +2,17 @@
 # import torch
 # import os
 
-from diffusers import StableDiffusionImg2ImgPipeline
 from PIL import Image
-import torch
 import os
+import threading
+import uuid
+from utils.metrics import timed
+from utils.micro_batching import MicroBatcher
+from utils.model_registry import get_img2img_pipeline
+
+DEFAULT_INFERENCE_STEPS = 50
+DEFAULT_STRENGTH = 0.75
+DEFAULT_GUIDANCE_SCALE = 7.5
 
 def train_generative_model(data_folder):
     """
@@ -19,10 +26,6 @@ def train_generative_model(data_folder):
     # For now, just return the model path
     return model_path
 
-from diffusers import StableDiffusionPipeline
-import torch
-import os
-
 # def generate_synthetic_image(prompt, model_name='stabilityai/stable-diffusion-2'):
 #     """
 #     Generate a synthetic image using a generative AI model.
@@ -49,7 +52,97 @@ import os
     
 
 
-def generate_synthetic_image_with_ip(prompt, input_image_path, model_name='stabilityai/stable-diffusion-2'):
+def output_size(input_size, width=None, height=None):
+    """
+    (width, height) of the generated image. Missing dimensions follow the input image's
+    aspect ratio; both are rounded down to a multiple of 8 as Stable Diffusion requires.
+    """
+    input_width, input_height = input_size
+    if width and not height:
+        height = input_height * width / input_width
+    elif height and not width:
+        width = input_width * height / input_height
+    elif not width and not height:
+        width, height = input_width, input_height
+    width, height = int(width) // 8 * 8, int(height) // 8 * 8
+    if width < 64 or height < 64:
+        raise ValueError("Output width and height must be at least 64 pixels")
+    return width, height
+
+
+class ImageGenerationService:
+    """
+    Img2img generation on resident Stable Diffusion pipelines.
+
+    Concurrent requests with the same model, inference steps, strength, guidance scale and
+    output size are micro-batched into one pipeline call (up to max_batch_size requests,
+    waiting at most max_wait seconds for the batch to fill). Every image is written to its
+    own file in output_folder.
+    """
+
+    def __init__(self, output_folder, max_batch_size=4, max_wait=0.1):
+        self.output_folder = output_folder
+        os.makedirs(output_folder, exist_ok=True)
+        self.batcher = MicroBatcher(self._generate_batch, max_batch_size, max_wait, name='img2img-batcher')
+
+    def submit(self, prompt, input_image_path, model_name, num_inference_steps=DEFAULT_INFERENCE_STEPS,
+               strength=DEFAULT_STRENGTH, guidance_scale=DEFAULT_GUIDANCE_SCALE, width=None, height=None):
+        """Queue one request; returns a Future of the output path. Raises ValueError for bad parameters."""
+        if not prompt:
+            raise ValueError("Prompt is required")
+        if int(num_inference_steps) < 1:
+            raise ValueError("num_inference_steps must be at least 1")
+        if not 0 < float(strength) <= 1:
+            raise ValueError("strength must be in (0, 1]")
+
+        # Decode and resize in the caller's thread so the batch worker only runs the pipeline
+        input_image = Image.open(input_image_path).convert("RGB")
+        size = output_size(input_image.size, width, height)
+        if input_image.size != size:
+            input_image = input_image.resize(size, Image.LANCZOS)
+
+        key = (model_name, int(num_inference_steps), float(strength), float(guidance_scale), size)
+        return self.batcher.submit(key, (prompt, input_image))
+
+    def generate(self, prompt, input_image_path, model_name, timeout=None, **options):
+        """Blocking submit(); returns the path of the generated image."""
+        return self.submit(prompt, input_image_path, model_name, **options).result(timeout)
+
+    def _generate_batch(self, key, requests):
+        model_name, num_inference_steps, strength, guidance_scale, _ = key
+        pipe = get_img2img_pipeline(model_name)
+        prompts = [prompt for prompt, _ in requests]
+        images = [image for _, image in requests]
+        with timed('sd_generation'):
+            result = pipe(prompt=prompts, image=images, strength=strength, guidance_scale=guidance_scale,
+                          num_inference_steps=num_inference_steps)
+
+        output_paths = []
+        for image in result.images:
+            output_path = os.path.join(self.output_folder, f"synthetic_{uuid.uuid4().hex}.png")
+            image.save(output_path)
+            output_paths.append(output_path)
+        return output_paths
+
+    def stats(self):
+        return self.batcher.stats()
+
+
+_default_service = None
+_default_service_lock = threading.Lock()
+
+
+def get_image_generation_service():
+    """Process-wide ImageGenerationService writing to generative_ai_data."""
+    global _default_service
+    with _default_service_lock:
+        if _default_service is None:
+            _default_service = ImageGenerationService('generative_ai_data')
+        return _default_service
+
+
+def generate_synthetic_image_with_ip(prompt, input_image_path, model_name='stabilityai/stable-diffusion-2',
+                                     **options):
     """
     Generate a synthetic image using a generative AI model based on a text prompt and an input image.
 
@@ -57,29 +150,13 @@ def generate_synthetic_image_with_ip(prompt, input_image_path, model_name='stabi
         prompt (str): The text prompt for generating the image.
         input_image_path (str): The path to the input image.
         model_name (str): The name of the generative AI model to use.
+        **options: num_inference_steps, strength, guidance_scale, width and height
+            (see ImageGenerationService.submit).
 
     Returns:
         str: The path to the generated synthetic image.
     """
     try:
-        # Check if a GPU is available
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        torch_dtype = torch.float16 if device == "cuda" else torch.float32
-
-        # Load the Stable Diffusion Image-to-Image pipeline
-        pipe = StableDiffusionImg2ImgPipeline.from_pretrained(model_name, torch_dtype=torch_dtype)
-        pipe = pipe.to(device)
-
-        # Load the input image
-        input_image = Image.open(input_image_path).convert("RGB")
-
-        # Generate the synthetic image
-        image = pipe(prompt=prompt, image=input_image, strength=0.75, guidance_scale=7.5).images[0]
-
-        # Save the generated image
-        output_path = os.path.join('generative_ai_data', 'synthetic_image_ip.png')
-        image.save(output_path)
-
-        return output_path
+        return get_image_generation_service().generate(prompt, input_image_path, model_name, **options)
     except Exception as e:
-        raise ValueError(f"Error generating synthetic image: {str(e)}")
\ No newline at end of file
+        raise ValueError(f"Error generating synthetic image: {str(e)}")
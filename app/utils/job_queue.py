@@ -0,0 +1,255 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue already holds the maximum number of pending jobs."""
+
+
+def job_eta(job):
+    """Estimated seconds until a running job finishes, from its decode rate so far, or None."""
+    progress = job['progress']
+    if job['status'] != RUNNING or not job['started_at'] or not progress.get('total_frames'):
+        return None
+    elapsed = time.time() - job['started_at']
+    decoded = progress.get('frames_decoded') or 0
+    if decoded <= 0 or elapsed <= 0:
+        return None
+    return max(progress['total_frames'] - decoded, 0) / (decoded / elapsed)
+
+
+class JobStore:
+    """
+    Small on-disk job store: one JSON file per job, written atomically so a
+    crash never leaves a half-written record behind.
+
+    Completed and failed jobs are dropped by prune() once they are older than
+    retention_seconds or beyond the newest max_finished (None keeps them).
+    """
+
+    def __init__(self, folder, retention_seconds=None, max_finished=None):
+        self.folder = folder
+        self.retention_seconds = retention_seconds
+        self.max_finished = max_finished
+        os.makedirs(folder, exist_ok=True)
+
+    def _path(self, job_id):
+        return os.path.join(self.folder, f"{job_id}.json")
+
+    def save(self, job):
+        path = self._path(job['job_id'])
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(job, f, indent=4)
+        os.replace(tmp_path, path)
+
+    def load(self, job_id):
+        path = self._path(job_id)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def list(self):
+        jobs = []
+        for name in os.listdir(self.folder):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.folder, name), 'r') as f:
+                    jobs.append(json.load(f))
+            except (OSError, ValueError) as e:
+                logging.warning(f"Skipping unreadable job file {name}: {e}")
+        return sorted(jobs, key=lambda job: job['created_at'])
+
+    def prune(self, keep=()):
+        """Delete finished jobs past the retention limits, except ids in keep. Returns the number removed."""
+        finished = [job for job in self.list()
+                    if job['status'] in (COMPLETED, FAILED) and job['job_id'] not in keep]
+        finished.sort(key=lambda job: job['finished_at'] or job['created_at'], reverse=True)
+        expired = []
+        if self.max_finished is not None:
+            expired.extend(finished[self.max_finished:])
+            finished = finished[:self.max_finished]
+        if self.retention_seconds is not None:
+            cutoff = time.time() - self.retention_seconds
+            expired.extend(job for job in finished if (job['finished_at'] or job['created_at']) < cutoff)
+        for job in expired:
+            try:
+                os.remove(self._path(job['job_id']))
+            except FileNotFoundError:
+                pass
+        return len(expired)
+
+
+class JobQueue:
+    """
+    Bounded local worker pool for long-running video jobs.
+
+    Args:
+        store (JobStore): Where job records are persisted.
+        runner (callable): Called as ``runner(progress_callback=..., **job['params'])``.
+        max_workers (int): Number of jobs processed concurrently.
+        max_pending (int): Maximum number of queued + running jobs accepted.
+        progress_flush_interval (float): Minimum seconds between progress writes to disk.
+    """
+
+    def __init__(self, store, runner, max_workers=2, max_pending=256, progress_flush_interval=1.0):
+        self.store = store
+        self.runner = runner
+        self.max_pending = max_pending
+        self.progress_flush_interval = progress_flush_interval
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='video-job')
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._jobs = {}  # In-memory view of active jobs, authoritative while they run
+        self._last_flush = {}
+        self._versions = {}  # job id -> number of in-memory updates, for wait_for_change
+
+    def _pending_count(self):
+        return sum(1 for job in self._jobs.values() if job['status'] in (QUEUED, RUNNING))
+
+    def submit(self, params):
+        """Persist a new job and schedule it. Returns the job record."""
+        with self._lock:
+            if self._pending_count() >= self.max_pending:
+                raise QueueFullError(f"Job queue is full ({self.max_pending} pending jobs)")
+
+            job = {
+                "job_id": uuid.uuid4().hex,
+                "status": QUEUED,
+                "params": params,
+                "created_at": time.time(),
+                "started_at": None,
+                "finished_at": None,
+                "progress": {"frames_decoded": 0, "frames_analyzed": 0, "total_frames": None},
+                "error": None,
+            }
+            self._jobs[job['job_id']] = job
+            self.store.save(job)
+
+        self._executor.submit(self._run, job['job_id'])
+        return dict(job)
+
+    def get(self, job_id):
+        with self._lock:
+            if job_id in self._jobs:
+                return json.loads(json.dumps(self._jobs[job_id]))
+        return self.store.load(job_id)
+
+    def wait_for_change(self, job_id, version=None, timeout=None):
+        """
+        Block until job_id changes after ``version`` (None returns at once) or timeout
+        seconds pass. Returns (job, version); pass the version back in to wait for the
+        next change. job is None for unknown jobs.
+        """
+        with self._changed:
+            if version is not None:
+                self._changed.wait_for(lambda: self._versions.get(job_id, 0) != version
+                                       or job_id not in self._jobs, timeout)
+            version = self._versions.get(job_id, 0)
+            if job_id in self._jobs:
+                return json.loads(json.dumps(self._jobs[job_id])), version
+        return self.store.load(job_id), version
+
+    def list(self):
+        with self._lock:
+            active = {job_id: json.loads(json.dumps(job)) for job_id, job in self._jobs.items()}
+        jobs = {job['job_id']: job for job in self.store.list()}
+        jobs.update(active)
+        return sorted(jobs.values(), key=lambda job: job['created_at'])
+
+    def recover(self, resume_params=None):
+        """
+        Re-schedule jobs that were queued or running when the process last stopped.
+        resume_params (e.g. {"resume": True}) are merged into their parameters so the
+        runner can continue from its checkpoint.
+        """
+        with self._lock:
+            self.store.prune()
+        recovered = 0
+        for job in self.store.list():
+            if job['status'] not in (QUEUED, RUNNING):
+                continue
+            job['status'] = QUEUED
+            job['started_at'] = None
+            job['params'].update(resume_params or {})
+            with self._lock:
+                self._jobs[job['job_id']] = job
+                self.store.save(job)
+            self._executor.submit(self._run, job['job_id'])
+            recovered += 1
+        if recovered:
+            logging.info(f"Recovered {recovered} unfinished job(s) from {self.store.folder}")
+        return recovered
+
+    def retry(self, job_id, **param_overrides):
+        """Re-schedule a failed job, optionally overriding some of its parameters. Returns the job or None."""
+        with self._lock:
+            if job_id in self._jobs:
+                return None  # Still queued or running
+            job = self.store.load(job_id)
+            if job is None or job['status'] != FAILED:
+                return None
+            job['params'].update(param_overrides)
+            job.update(status=QUEUED, started_at=None, finished_at=None, error=None)
+            self._jobs[job_id] = job
+            self.store.save(job)
+
+        self._executor.submit(self._run, job_id)
+        return dict(job)
+
+    def _update(self, job_id, flush=True, **fields):
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(fields)
+            if flush:
+                self.store.save(job)
+                self._last_flush[job_id] = time.monotonic()
+            self._versions[job_id] = self._versions.get(job_id, 0) + 1
+            self._changed.notify_all()
+
+    def _progress_callback(self, job_id):
+        def report(**progress):
+            now = time.monotonic()
+            flush = now - self._last_flush.get(job_id, 0) >= self.progress_flush_interval
+            with self._lock:
+                merged = dict(self._jobs[job_id]['progress'], **progress)
+            self._update(job_id, flush=flush, progress=merged)
+        return report
+
+    def _run(self, job_id):
+        with self._lock:
+            params = dict(self._jobs[job_id]['params'])
+        self._update(job_id, status=RUNNING, started_at=time.time())
+        try:
+            self.runner(progress_callback=self._progress_callback(job_id), **params)
+            self._update(job_id, status=COMPLETED, finished_at=time.time())
+        except Exception as e:
+            logging.exception(f"Job {job_id} failed")
+            self._update(job_id, status=FAILED, finished_at=time.time(), error=str(e))
+        finally:
+            with self._lock:
+                # Finished jobs are served from the store from now on
+                self._jobs.pop(job_id, None)
+                self._last_flush.pop(job_id, None)
+                self._versions.pop(job_id, None)
+                self._changed.notify_all()
+                # Under the lock so a concurrent retry() cannot be undone by the delete
+                removed = self.store.prune(keep=self._jobs)
+            if removed:
+                logging.info(f"Pruned {removed} finished job(s) from {self.store.folder}")
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,345 @@
+import json
+import queue
+import threading
+import time
+import uuid
+
+import cv2
+import numpy as np
+import torch
+
+from utils.face_detectors import HAAR, FaceDetector
+from utils.metrics import timed
+from utils.model_registry import get_onnx_vit_expression_model, get_vit_expression_model
+from utils.onnx_backend import INFERENCE_BACKENDS, NATIVE, ONNX_INT8, softmax
+from utils.realtime import RealtimeReader
+from utils.stats_aggregator import RingBuffer, RunningStats
+
+def predict_emotions(face_frames, backend=NATIVE):
+    """
+    Run the ViT expression model on a list of BGR face crops in one batch, with PyTorch or
+    (backend ONNX/ONNX_INT8) its ONNX export on ONNX Runtime.
+    Returns one (label, confidence, probabilities) tuple per crop.
+    """
+    if not face_frames:
+        return []
+    images = [cv2.cvtColor(face, cv2.COLOR_BGR2RGB) for face in face_frames]
+    if backend != NATIVE:
+        model, processor, id2label = get_onnx_vit_expression_model(quantized=backend == ONNX_INT8)
+        inputs = processor(images=images, return_tensors="np")
+        with timed('vit_emotion'):
+            probs = softmax(model.predict(inputs["pixel_values"]))
+        return [(id2label[int(p.argmax())], float(p.max()), p) for p in probs]
+
+    model, processor, device = get_vit_expression_model()
+    inputs = processor(images=images, return_tensors="pt").to(device)
+    with torch.no_grad(), timed('vit_emotion'):
+        logits = model(**inputs).logits
+    probs = torch.nn.functional.softmax(logits, dim=1).cpu().numpy()
+    return [(model.config.id2label[int(p.argmax())], float(p.max()), p) for p in probs]
+
+
+def emotion_labels(backend=NATIVE):
+    if backend != NATIVE:
+        _, _, id2label = get_onnx_vit_expression_model(quantized=backend == ONNX_INT8)
+    else:
+        id2label = get_vit_expression_model()[0].config.id2label
+    return [id2label[i] for i in range(len(id2label))]
+
+
+class CaptureSource:
+    """Frames from a camera index or a video file, through cv2.VideoCapture."""
+
+    def __init__(self, source):
+        self.source = source
+        self.cap = cv2.VideoCapture(source)
+        if not self.cap.isOpened():
+            raise ValueError(f"Could not open video source {source}")
+        # Files are replayed at their own frame rate in real-time mode; cameras pace themselves
+        self.realtime_fps = (self.cap.get(cv2.CAP_PROP_FPS) or 25.0) if isinstance(source, str) else None
+        self._lock = threading.Lock()  # release() may come from another thread mid-read
+
+    def read(self):
+        with self._lock:
+            if self.cap is None:
+                return False, None
+            return self.cap.read()
+
+    def grab(self):
+        """Advance one frame without decoding it."""
+        with self._lock:
+            return self.cap is not None and self.cap.grab()
+
+    def release(self):
+        with self._lock:
+            if self.cap is not None:
+                self.cap.release()
+                self.cap = None
+
+
+class PushedFrameSource:
+    """Frames pushed by clients as encoded JPEG/PNG bytes (e.g. from a browser webcam)."""
+
+    def __init__(self, max_pending=4, timeout=5.0):
+        self.frames = queue.Queue(maxsize=max_pending)
+        self.timeout = timeout
+        self.closed = False
+
+    def push(self, image_bytes):
+        """Queue an encoded image; when the queue is full the oldest frame is dropped."""
+        frame = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            raise ValueError("Could not decode pushed frame")
+        self.push_array(frame)
+
+    def push_array(self, frame):
+        while True:
+            try:
+                self.frames.put_nowait(frame)
+                return
+            except queue.Full:
+                try:
+                    self.frames.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def read(self):
+        while not self.closed:
+            try:
+                frame = self.frames.get(timeout=self.timeout)
+            except queue.Empty:
+                continue
+            if frame is not None:
+                return True, frame
+        return False, None
+
+    def release(self):
+        self.closed = True
+        self.push_array(None)  # Wake up a read() waiting for frames
+
+
+def open_source(spec):
+    """
+    Build a frame source from a spec string: "camera:<index>", "file:<path>" or "push".
+    """
+    if spec == 'push':
+        return PushedFrameSource()
+    kind, _, value = spec.partition(':')
+    if kind == 'camera':
+        return CaptureSource(int(value or 0))
+    if kind == 'file':
+        return CaptureSource(value)
+    raise ValueError(f"Unknown live source: {spec}")
+
+
+class LiveEmotionEngine:
+    """
+    Streaming facial expression recognition over a frame source.
+
+    A background thread reads frames, detects faces (Haar cascade by default, any
+    utils.face_detectors backend via ``detector``/``detection_size``) and classifies
+    every face of a frame in one batched ViT forward pass (on PyTorch, or on ONNX Runtime
+    with ``backend`` ONNX/ONNX_INT8). Aggregates (emotion counts,
+    mean confidence, mean embedding and a bounded buffer of recent embeddings) and the
+    latest per-face results are available through ``snapshot`` and as server-sent events
+    from ``events``.
+
+    With ``realtime=True`` frames are read through a RealtimeReader: the newest frame is
+    always analyzed, stale ones are dropped and the frame interval adapts to keep the
+    end-to-end latency within ``target_latency`` seconds.
+    """
+
+    def __init__(self, source, update_interval=0.5, duration=None, embedding_capacity=10000,
+                 realtime=False, target_latency=0.2, detector=HAAR, detection_size=None, backend=NATIVE):
+        self.input = source
+        self.source = source
+        try:
+            if backend not in INFERENCE_BACKENDS:
+                raise ValueError(f"backend must be one of {list(INFERENCE_BACKENDS)}")
+            self.backend = backend
+            self.detector = FaceDetector(detector, detection_size)
+            self.realtime = realtime
+            if realtime:
+                self.source = RealtimeReader(source, target_latency, pace_fps=getattr(source, 'realtime_fps', None))
+            self.labels = emotion_labels(backend)
+        except BaseException:
+            # The source (e.g. a camera) is already open; a detector or model error must not leak it
+            if self.source is not source:
+                self.source.release()
+            source.release()
+            raise
+        self.update_interval = update_interval
+        self.duration = duration
+
+        self._lock = threading.Lock()
+        self._thread = None
+        self._deadline = None
+        self._stop = threading.Event()
+        self.running = False
+        self.error = None
+
+        self.frames_processed = 0
+        self.faces_processed = 0
+        self.emotion_counts = {label: 0 for label in self.labels}
+        self.confidence_stats = RunningStats(1)
+        self.embedding_stats = RunningStats(len(self.labels))
+        self.embeddings = RingBuffer(embedding_capacity, (len(self.labels),))
+        self.latest_faces = []
+        self.started_at = None
+        self.finished_at = None
+        self.last_access = time.time()
+        self.inference_seconds = 0.0
+
+    def process_frame(self, frame):
+        """Detect and classify all faces of one frame; returns the per-face results."""
+        boxes = self.detector.detect(frame)
+        crops = [frame[y1:y2, x1:x2] for (x1, y1, x2, y2) in boxes]
+
+        start = time.perf_counter()
+        predictions = predict_emotions(crops, self.backend)
+        elapsed = time.perf_counter() - start
+
+        faces = []
+        with self._lock:
+            self.inference_seconds += elapsed
+            self.frames_processed += 1
+            for box, (label, confidence, probs) in zip(boxes, predictions):
+                self.faces_processed += 1
+                self.emotion_counts[label] += 1
+                self.confidence_stats.update([confidence])
+                self.embedding_stats.update(probs)
+                self.embeddings.append(probs)
+                faces.append({"box": list(box), "emotion": label, "confidence": confidence})
+            self.latest_faces = faces
+        return faces
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                if self.duration is not None and time.time() - self.started_at > self.duration:
+                    break
+                ret, frame = self.source.read()
+                if not ret:
+                    break
+                self.process_frame(frame)
+                if self.realtime:
+                    self.source.frame_done()
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            if self._deadline is not None:
+                self._deadline.cancel()
+            self.source.release()
+            self.running = False
+            self.finished_at = time.time()
+
+    def start(self):
+        self.started_at = time.time()
+        self.running = True
+        if self.duration is not None:
+            # Also ends sessions whose source blocks waiting for frames (pushed frames)
+            self._deadline = threading.Timer(self.duration, self.stop, kwargs={"wait": False})
+            self._deadline.daemon = True
+            self._deadline.start()
+        self._thread = threading.Thread(target=self._run, name='live-emotion', daemon=True)
+        try:
+            self._thread.start()
+        except BaseException:
+            self.stop(wait=False)
+            self.running = False
+            raise
+        return self
+
+    def stop(self, wait=True):
+        self._stop.set()
+        self.source.release()
+        if wait and self._thread is not None:
+            self._thread.join()
+
+    def join(self):
+        if self._thread is not None:
+            self._thread.join()
+
+    def snapshot(self):
+        """Current aggregates and the latest frame's faces as a JSON-serializable dict."""
+        self.last_access = time.time()
+        with self._lock:
+            elapsed = time.time() - self.started_at if self.started_at else 0.0
+            most_common = max(self.emotion_counts, key=self.emotion_counts.get) if self.faces_processed else None
+            return {
+                "running": self.running,
+                "error": self.error,
+                "frames_processed": self.frames_processed,
+                "faces_processed": self.faces_processed,
+                "frames_per_second": self.frames_processed / elapsed if elapsed > 0 else 0.0,
+                "faces_per_inference_second": (self.faces_processed / self.inference_seconds
+                                               if self.inference_seconds > 0 else 0.0),
+                "emotion_counts": dict(self.emotion_counts),
+                "most_common_emotion": most_common,
+                "average_confidence": float(self.confidence_stats.mean[0]),
+                "mean_embedding": dict(zip(self.labels, self.embedding_stats.mean.tolist())),
+                "latest_faces": list(self.latest_faces),
+                "realtime": self.source.stats() if self.realtime else None,
+            }
+
+    def events(self):
+        """Server-sent events: one snapshot every update_interval seconds until the engine stops."""
+        while True:
+            snapshot = self.snapshot()
+            yield f"data: {json.dumps(snapshot)}\n\n"
+            if not snapshot["running"]:
+                break
+            time.sleep(self.update_interval)
+
+
+class LiveSessionManager:
+    """
+    Live engines started through the Flask app, by session id.
+
+    Engines that finished on their own (end of file, duration, source error) stay available
+    for ``finished_ttl`` seconds so clients can read the final snapshot; running engines
+    nobody has read for ``idle_timeout`` seconds (abandoned push or camera sessions) are
+    stopped. Both are dropped on the next ``start``/``get``.
+    """
+
+    def __init__(self, finished_ttl=300.0, idle_timeout=600.0):
+        self.finished_ttl = finished_ttl
+        self.idle_timeout = idle_timeout
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _expire(self):
+        """Remove expired sessions (caller holds the lock); returns the engines still running."""
+        now = time.time()
+        expired = [session_id for session_id, engine in self._sessions.items()
+                   if (now - engine.finished_at > self.finished_ttl if engine.finished_at is not None
+                       else self.idle_timeout is not None and now - engine.last_access > self.idle_timeout)]
+        return [engine for engine in (self._sessions.pop(session_id) for session_id in expired)
+                if engine.finished_at is None]
+
+    def start(self, source_spec, **options):
+        engine = LiveEmotionEngine(open_source(source_spec), **options).start()
+        session_id = uuid.uuid4().hex
+        with self._lock:
+            idle = self._expire()
+            self._sessions[session_id] = engine
+        for stale in idle:
+            stale.stop(wait=False)
+        return session_id, engine
+
+    def get(self, session_id):
+        with self._lock:
+            idle = self._expire()
+            engine = self._sessions.get(session_id)
+        for stale in idle:
+            stale.stop(wait=False)
+        if engine is not None:
+            engine.last_access = time.time()
+        return engine
+
+    def stop(self, session_id):
+        with self._lock:
+            engine = self._sessions.pop(session_id, None)
+        if engine is not None:
+            engine.stop()
+        return engine
@@ -0,0 +1,95 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """
+    Groups concurrent requests into batched calls.
+
+    ``submit(key, request)`` returns a Future. A single worker thread takes the oldest
+    request, waits up to ``max_wait`` seconds for more requests with the same key (up to
+    ``max_batch_size``) and calls ``process_batch(key, requests)``, which must return one
+    result per request. Requests with other keys wait for a later batch, in arrival order.
+    One worker means batches run one at a time, which is what a single GPU wants anyway.
+    """
+
+    def __init__(self, process_batch, max_batch_size=8, max_wait=0.05, name='micro-batcher'):
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._backlog = deque()  # Requests taken off the queue that did not fit the current batch
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.requests = 0
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, key, request):
+        future = Future()
+        self._queue.put((key, request, future))
+        return future
+
+    def _next(self, timeout=None):
+        if self._backlog:
+            return self._backlog.popleft()
+        return self._queue.get(timeout=timeout)
+
+    def _collect(self, first):
+        key = first[0]
+        batch = [first]
+        # Same-key requests that are already waiting join at once
+        for item in list(self._backlog):
+            if len(batch) >= self.max_batch_size:
+                break
+            if item[0] == key:
+                self._backlog.remove(item)
+                batch.append(item)
+
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item[0] == key:
+                batch.append(item)
+            else:
+                self._backlog.append(item)
+        return key, batch
+
+    def _run(self):
+        while True:
+            key, batch = self._collect(self._next())
+            futures = [future for _, _, future in batch if future.set_running_or_notify_cancel()]
+            requests = [request for _, request, future in batch if future in futures]
+            if not requests:
+                continue
+            try:
+                results = self.process_batch(key, requests)
+            except Exception as e:
+                logging.exception(f"Batch of {len(requests)} request(s) failed")
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            with self._lock:
+                self.batches += 1
+                self.requests += len(requests)
+            for future, result in zip(futures, results):
+                future.set_result(result)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "requests": self.requests,
+                "average_batch_size": self.requests / self.batches if self.batches else 0.0,
+                "queued": self._queue.qsize() + len(self._backlog),
+            }
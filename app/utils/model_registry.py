@@ -0,0 +1,261 @@
+import gc
+import logging
+import os
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+
+import numpy as np
+
+DEEPFACE_MODEL_NAMES = ('Emotion', 'Age', 'Gender', 'Race')
+VIT_EXPRESSION_MODEL = "motheecreator/vit-Facial-Expression-Recognition"
+STORY_MODEL = "gpt2"
+YUNET_MODEL_URL = ("https://github.com/opencv/opencv_zoo/raw/main/models/face_detection_yunet/"
+                   "face_detection_yunet_2023mar.onnx")
+
+
+class ModelRegistry:
+    """
+    Process-wide cache of loaded models.
+
+    Every model is loaded at most once per process, under a per-key lock so concurrent
+    first requests do not load it twice. Models registered as evictable (the memory-heavy
+    diffusion pipelines) are kept in an LRU of at most ``max_evictable`` entries.
+    """
+
+    def __init__(self, max_evictable=1):
+        self.max_evictable = max_evictable
+        self._models = {}
+        self._evictable = OrderedDict()  # key -> None, in least-recently-used order
+        self._info = {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def get(self, key, loader, evictable=False):
+        """Return the model stored under key, calling loader() to build it on first use."""
+        with self._lock:
+            if key in self._models:
+                if key in self._evictable:
+                    self._evictable.move_to_end(key)
+                return self._models[key]
+
+        with self._key_lock(key):
+            with self._lock:
+                if key in self._models:
+                    return self._models[key]
+
+            logging.info(f"Loading model {key}")
+            start = time.perf_counter()
+            model = loader()
+            load_seconds = time.perf_counter() - start
+            logging.info(f"Loaded model {key} in {load_seconds:.2f}s")
+
+            with self._lock:
+                self._models[key] = model
+                self._info[key] = {
+                    "resident": True,
+                    "load_seconds": load_seconds,
+                    "loaded_at": time.time(),
+                    "load_count": self._info.get(key, {}).get("load_count", 0) + 1,
+                    "evictable": evictable,
+                }
+                if evictable:
+                    self._evictable[key] = None
+                    self._evict_locked()
+            return model
+
+    def _evict_locked(self):
+        evicted = False
+        while len(self._evictable) > self.max_evictable:
+            key, _ = self._evictable.popitem(last=False)
+            self._models.pop(key, None)
+            self._info[key]["resident"] = False
+            logging.info(f"Evicted model {key}")
+            evicted = True
+        if evicted:
+            gc.collect()
+            try:
+                import torch
+                if torch.cuda.is_available():
+                    torch.cuda.empty_cache()
+            except ImportError:
+                pass
+
+    def record_warmup(self, key, seconds):
+        with self._lock:
+            if key in self._info:
+                self._info[key]["warmup_seconds"] = seconds
+
+    def status(self):
+        """Per-model residency and load timing, for the /models endpoint."""
+        with self._lock:
+            return {key: dict(info) for key, info in self._info.items()}
+
+
+registry = ModelRegistry()
+
+
+def set_max_diffusion_pipelines(count):
+    registry.max_evictable = max(1, int(count))
+
+
+def get_retinaface():
+    def load():
+        from retinaface import RetinaFace
+        return RetinaFace.build_model()
+    return registry.get('retinaface', load)
+
+
+def get_yunet_model_path():
+    """
+    Path of the YuNet face detector weights: YUNET_MODEL_PATH if set, otherwise the file is
+    downloaded once to ~/.cache/yunet. The small ONNX file is opened by each detector.
+    """
+    def load():
+        path = os.getenv('YUNET_MODEL_PATH') or os.path.join(
+            os.path.expanduser('~'), '.cache', 'yunet', os.path.basename(YUNET_MODEL_URL))
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            logging.info(f"Downloading YuNet face detector to {path}")
+            urllib.request.urlretrieve(YUNET_MODEL_URL, path + '.part')
+            os.replace(path + '.part', path)
+        return path
+    return registry.get('yunet', load)
+
+
+def get_deepface_model(model_name):
+    """DeepFace facial attribute client ('Emotion', 'Age', 'Gender' or 'Race')."""
+    def load():
+        try:
+            from deepface.modules import modeling
+            return modeling.build_model(task="facial_attribute", model_name=model_name)
+        except (ImportError, TypeError):
+            # Older DeepFace releases expose a single-argument builder
+            from deepface import DeepFace
+            return DeepFace.build_model(model_name)
+    return registry.get(f'deepface:{model_name}', load)
+
+
+def get_vit_expression_model():
+    """Returns (model, processor, device) for the ViT facial expression classifier."""
+    def load():
+        import torch
+        from transformers import AutoImageProcessor, AutoModelForImageClassification
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        model = AutoModelForImageClassification.from_pretrained(VIT_EXPRESSION_MODEL).to(device)
+        model.eval()
+        processor = AutoImageProcessor.from_pretrained(VIT_EXPRESSION_MODEL)
+        return model, processor, device
+    return registry.get('vit_expression', load)
+
+
+def get_onnx_deepface_model(model_name, quantized=False):
+    """
+    DeepFace attribute model on ONNX Runtime (an OnnxModel), exported from the Keras model
+    on first use and optionally int8-quantized (see utils.onnx_backend).
+    """
+    def load():
+        from utils.onnx_backend import OnnxModel, ensure_onnx_model, export_keras_model
+        path = ensure_onnx_model(f"deepface_{model_name.lower()}",
+                                 lambda out: export_keras_model(get_deepface_model(model_name).model, out),
+                                 quantized)
+        return OnnxModel(path)
+    return registry.get(f"onnx:deepface:{model_name}{':int8' if quantized else ''}", load)
+
+
+def get_onnx_vit_expression_model(quantized=False):
+    """Returns (model, processor, id2label) for the ViT expression classifier on ONNX Runtime."""
+    def load():
+        from transformers import AutoConfig, AutoImageProcessor
+        from utils.onnx_backend import OnnxModel, ensure_onnx_model, export_vit_model
+        path = ensure_onnx_model('vit_expression',
+                                 lambda out: export_vit_model(get_vit_expression_model()[0], out), quantized)
+        id2label = AutoConfig.from_pretrained(VIT_EXPRESSION_MODEL).id2label
+        return OnnxModel(path), AutoImageProcessor.from_pretrained(VIT_EXPRESSION_MODEL), id2label
+    return registry.get(f"onnx:vit_expression{':int8' if quantized else ''}", load)
+
+
+def get_story_generator():
+    def load():
+        from transformers import pipeline
+        return pipeline("text-generation", model=STORY_MODEL)
+    return registry.get(STORY_MODEL, load)
+
+
+def get_img2img_pipeline(model_name):
+    """Stable Diffusion img2img pipeline for model_name; kept in the diffusion LRU."""
+    def load():
+        import torch
+        from diffusers import StableDiffusionImg2ImgPipeline
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        torch_dtype = torch.float16 if device == "cuda" else torch.float32
+        pipe = StableDiffusionImg2ImgPipeline.from_pretrained(model_name, torch_dtype=torch_dtype)
+        return pipe.to(device)
+    return registry.get(f'sd_img2img:{model_name}', load, evictable=True)
+
+
+def _warm_up_retinaface():
+    from retinaface import RetinaFace
+    RetinaFace.detect_faces(np.zeros((224, 224, 3), dtype=np.uint8), model=get_retinaface())
+
+
+def _warm_up_deepface():
+    for model_name in DEEPFACE_MODEL_NAMES:
+        client = get_deepface_model(model_name)
+        input_shape = client.model.input_shape[1:]
+        client.model.predict(np.zeros((1,) + tuple(input_shape), dtype=np.float32), verbose=0)
+
+
+def _warm_up_vit_expression():
+    import torch
+    model, processor, device = get_vit_expression_model()
+    inputs = processor(images=[np.zeros((224, 224, 3), dtype=np.uint8)], return_tensors="pt").to(device)
+    with torch.no_grad():
+        model(**inputs)
+
+
+def _warm_up_story_generator():
+    get_story_generator()("Warm-up", max_new_tokens=1, num_return_sequences=1)
+
+
+WARMUPS = {
+    'retinaface': ('retinaface', _warm_up_retinaface),
+    'deepface': ('deepface:Emotion', _warm_up_deepface),
+    'vit_expression': ('vit_expression', _warm_up_vit_expression),
+    'gpt2': (STORY_MODEL, _warm_up_story_generator),
+}
+
+
+def warm_up(names):
+    """
+    Eagerly load the named models and run one dummy inference through each, so the
+    first real request does not pay for model loading or graph initialization.
+    Names are keys of WARMUPS or ``sd_img2img:<model_name>``.
+    """
+    for name in names:
+        if name.startswith('sd_img2img:'):
+            # Diffusion pipelines are only loaded; a dummy denoising run costs too much
+            try:
+                get_img2img_pipeline(name.split(':', 1)[1])
+            except Exception as e:
+                logging.error(f"Loading {name} failed: {e}")
+            continue
+        if name not in WARMUPS:
+            logging.warning(f"Unknown model for warm-up: {name}")
+            continue
+        key, warm = WARMUPS[name]
+        try:
+            start = time.perf_counter()
+            warm()
+            registry.record_warmup(key, time.perf_counter() - start)
+        except Exception as e:
+            logging.error(f"Warm-up of {name} failed: {e}")
+
+
+def models_status():
+    return registry.status()
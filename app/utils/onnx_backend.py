@@ -0,0 +1,128 @@
+import logging
+import os
+
+import numpy as np
+
+# Inference backends for BatchedFaceAnalyzer and the live ViT classifier. The ONNX backends
+# run exported copies of the DeepFace Keras models (via tf2onnx) and of the ViT (via
+# torch.onnx) on ONNX Runtime's CPU provider; ONNX_INT8 uses dynamically quantized copies
+# (int8 MatMul/Gemm weights, activations quantized at run time). Face detection is not
+# exported: YuNet already is an ONNX model run by OpenCV, and RetinaFace's anchor decoding
+# and NMS live in Python outside its Keras graph.
+NATIVE = 'native'  # TensorFlow/Keras for DeepFace, PyTorch for the ViT
+ONNX = 'onnx'
+ONNX_INT8 = 'onnx_int8'
+INFERENCE_BACKENDS = (NATIVE, ONNX, ONNX_INT8)
+
+ONNX_OPSET = 13
+# Part of the quantized file names; bumped when quantize_model's settings change so models
+# quantized with the old settings are not reused
+QUANTIZATION_VERSION = 2
+
+
+def onnx_model_dir():
+    return os.getenv('ONNX_MODEL_DIR') or os.path.join(os.path.expanduser('~'), '.cache', 'emotion_onnx')
+
+
+def onnx_model_path(name, quantized=False):
+    file_name = f"{name}_int8_v{QUANTIZATION_VERSION}.onnx" if quantized else f"{name}.onnx"
+    return os.path.join(onnx_model_dir(), file_name)
+
+
+def export_keras_model(keras_model, path):
+    """Export a Keras model with a dynamic batch dimension to path."""
+    import tensorflow as tf
+    import tf2onnx
+
+    input_shape = (None,) + tuple(keras_model.input_shape[1:])
+    signature = (tf.TensorSpec(input_shape, tf.float32, name='input'),)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    tf2onnx.convert.from_keras(keras_model, input_signature=signature, opset=ONNX_OPSET, output_path=tmp_path)
+    os.replace(tmp_path, path)
+
+
+def export_vit_model(model, path, image_size=224):
+    """Export a Hugging Face image classifier (pixel_values -> logits) with a dynamic batch dimension."""
+    import copy
+    import torch
+
+    # Export a CPU copy; the registry's model may live on a GPU
+    model = copy.deepcopy(model).to('cpu').eval()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    dummy = torch.zeros(1, 3, image_size, image_size)
+    with torch.no_grad():
+        torch.onnx.export(model, (dummy,), tmp_path, input_names=['pixel_values'], output_names=['logits'],
+                          dynamic_axes={'pixel_values': {0: 'batch'}, 'logits': {0: 'batch'}},
+                          opset_version=ONNX_OPSET)
+    os.replace(tmp_path, path)
+
+
+# Operators replaced by their integer versions. Convolutions stay fp32: quantizing them
+# yields ConvInteger, which ONNX Runtime's CPU provider only implements for uint8 weights
+QUANTIZED_OP_TYPES = ['MatMul', 'Gemm']
+
+
+def quantize_model(path, quantized_path):
+    """
+    Dynamic int8 quantization of the MatMul/Gemm weights of an fp32 ONNX model. The result
+    is opened in a CPU session before it replaces quantized_path, so a model ONNX Runtime
+    cannot run is never cached.
+    """
+    import onnxruntime as ort
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    tmp_path = f"{quantized_path}.{os.getpid()}.tmp"
+    quantize_dynamic(path, tmp_path, weight_type=QuantType.QInt8, op_types_to_quantize=QUANTIZED_OP_TYPES)
+    try:
+        ort.InferenceSession(tmp_path, providers=['CPUExecutionProvider'])
+    except Exception as e:
+        os.remove(tmp_path)
+        raise RuntimeError(f"Quantized model of {path} does not load on ONNX Runtime: {e}") from e
+    os.replace(tmp_path, quantized_path)
+
+
+def ensure_onnx_model(name, export, quantized=False):
+    """
+    Path of the ONNX model called name, exporting it with export(path) (and quantizing it)
+    first if it is not in ONNX_MODEL_DIR (default ~/.cache/emotion_onnx) yet. Exports are
+    written to a temporary file and renamed, so concurrent worker processes never load a
+    partial model.
+    """
+    path = onnx_model_path(name)
+    if not os.path.exists(path):
+        logging.info(f"Exporting {name} to {path}")
+        export(path)
+    if not quantized:
+        return path
+    quantized_path = onnx_model_path(name, quantized=True)
+    if not os.path.exists(quantized_path):
+        logging.info(f"Quantizing {path} to {quantized_path}")
+        quantize_model(path, quantized_path)
+    return quantized_path
+
+
+class OnnxModel:
+    """
+    An ONNX Runtime CPU session with a single input. predict(batch) returns the first
+    output. ORT_INTRA_OP_THREADS caps the session's thread pool (0 lets ONNX Runtime decide).
+    """
+
+    def __init__(self, path):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = int(os.getenv('ORT_INTRA_OP_THREADS', 0))
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.path = path
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, batch):
+        return self.session.run(None, {self.input_name: np.asarray(batch, dtype=np.float32)})[0]
+
+
+def softmax(logits):
+    exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return exp / exp.sum(axis=1, keepdims=True)
@@ -0,0 +1,117 @@
+import cProfile
+import os
+import sys
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+CPROFILE = 'cprofile'
+STACKS = 'stacks'
+PROFILING_MODES = (CPROFILE, STACKS)
+
+CPROFILE_FILE = 'profile.pstats'
+STACKS_FILE = 'profile_stacks.txt'
+
+# Thread ident -> the StackSampler sampling that thread
+_sampled_threads = {}
+_sampled_lock = threading.Lock()
+
+
+def track_thread(thread):
+    """
+    Sample a just-started thread with the StackSampler of the thread that started it, if
+    that one is being sampled; called by the video pipeline for its stage workers.
+    """
+    with _sampled_lock:
+        sampler = _sampled_threads.get(threading.get_ident())
+        if sampler is not None and thread.ident is not None:
+            _sampled_threads[thread.ident] = sampler
+            sampler._idents.add(thread.ident)
+
+
+class StackSampler:
+    """
+    Samples the Python stacks of the calling thread and of the threads it (transitively)
+    starts and registers with track_thread (e.g. the video pipeline's stage workers) every
+    interval seconds. Threads of other jobs running at the same time are not sampled.
+
+    write() stores the samples as folded stacks ("thread;outer;...;inner count" per line),
+    which flamegraph.pl and speedscope read directly. Unlike cProfile it sees the worker
+    threads, at the cost of statistical rather than exact timings.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._idents = set()
+        self._thread = None
+
+    def start(self):
+        with _sampled_lock:
+            self._idents = {threading.get_ident()}
+            _sampled_threads[threading.get_ident()] = self
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        with _sampled_lock:
+            for ident in self._idents:
+                if _sampled_threads.get(ident) is self:
+                    del _sampled_threads[ident]
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            with _sampled_lock:
+                idents = set(self._idents)
+            for ident, frame in sys._current_frames().items():
+                if ident not in idents:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+@contextmanager
+def profile_to(output_folder, mode):
+    """
+    Profile the with-block and write the result to output_folder: CPROFILE dumps the calling
+    thread's cProfile stats to profile.pstats, STACKS writes sampled stacks of all threads
+    involved to profile_stacks.txt. A falsy mode disables profiling.
+    """
+    if not mode:
+        yield
+        return
+    if mode not in PROFILING_MODES:
+        raise ValueError(f"profiling must be one of {list(PROFILING_MODES)}")
+
+    os.makedirs(output_folder, exist_ok=True)
+    if mode == CPROFILE:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(os.path.join(output_folder, CPROFILE_FILE))
+    else:
+        sampler = StackSampler()
+        sampler.start()
+        try:
+            yield
+        finally:
+            sampler.stop()
+            sampler.write(os.path.join(output_folder, STACKS_FILE))
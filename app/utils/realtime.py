@@ -0,0 +1,189 @@
+import math
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+
+class LatencyTracker:
+    """End-to-end latencies of the most recent ``window`` frames, with percentiles."""
+
+    def __init__(self, window=1000):
+        self.latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self.latencies.append(seconds)
+
+    def percentiles(self):
+        with self._lock:
+            latencies = np.array(self.latencies, dtype=np.float64)
+        if not latencies.size:
+            return {"p50_ms": None, "p90_ms": None, "p99_ms": None, "max_ms": None}
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99]) * 1000
+        return {"p50_ms": float(p50), "p90_ms": float(p90), "p99_ms": float(p99),
+                "max_ms": float(latencies.max() * 1000)}
+
+
+class AdaptiveFrameInterval:
+    """
+    Chooses how many captured frames to skip between analyzed frames.
+
+    The interval never drops below what the smoothed processing time allows
+    (``ceil(processing / frame_period)``); on top of that it is raised by one while the
+    measured latency is over ``target_latency`` and lowered by one once it is back under
+    half the target.
+    """
+
+    def __init__(self, target_latency, min_interval=1, max_interval=120, smoothing=0.2):
+        self.target_latency = target_latency
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.smoothing = smoothing
+        self.processing_seconds = None
+        self.interval = min_interval
+
+    def update(self, processing_seconds, latency_seconds, frame_period):
+        if self.processing_seconds is None:
+            self.processing_seconds = processing_seconds
+        else:
+            self.processing_seconds += self.smoothing * (processing_seconds - self.processing_seconds)
+
+        needed = math.ceil(self.processing_seconds / frame_period) if frame_period else self.min_interval
+        interval = self.interval
+        if latency_seconds > self.target_latency:
+            interval += 1
+        elif latency_seconds < self.target_latency / 2:
+            interval -= 1
+        self.interval = min(max(interval, needed, self.min_interval), self.max_interval)
+        return self.interval
+
+
+class RealtimeReader:
+    """
+    Latest-frame-wins reader for real-time analysis.
+
+    A capture thread keeps reading ``source`` (anything with ``read()``/``release()``, and
+    optionally ``grab()`` to skip frames without decoding) and holds only the newest frame;
+    a frame replaced before the consumer took it is counted as dropped, so a slow consumer
+    never falls behind the capture. Every frame returned by ``read`` must be followed by
+    ``frame_done()`` once its result has been delivered: that measures the end-to-end
+    latency (capture to result) and adapts the capture thread's frame interval to stay
+    within ``target_latency``.
+
+    Args:
+        source: Frame source.
+        target_latency (float): Latency budget in seconds.
+        pace_fps (float): Replay rate for file sources; None reads as fast as the source allows.
+        max_interval (int): Upper bound of the adaptive frame interval.
+        latency_window (int): Number of recent latencies kept for percentiles.
+    """
+
+    def __init__(self, source, target_latency=0.2, pace_fps=None, max_interval=120, latency_window=1000):
+        self.source = source
+        self.pace_fps = pace_fps
+        self.controller = AdaptiveFrameInterval(target_latency, max_interval=max_interval)
+        self.latency = LatencyTracker(latency_window)
+
+        self._cond = threading.Condition()
+        self._frame = None
+        self._captured_at = None
+        self._frame_number = 0
+        self._fresh = False
+        self._ended = False
+        self._closed = False
+        self._frame_period = 1.0 / pace_fps if pace_fps else None
+        self._read_at = None
+        self.last_captured_at = None
+        self.last_frame_number = 0  # 1-based position in the source of the last frame read
+
+        self.captured = 0   # Frames pulled from the source
+        self.skipped = 0    # Skipped by the adaptive frame interval
+        self.dropped = 0    # Replaced by a newer frame before being analyzed
+        self.processed = 0  # Analyzed and delivered
+
+        self._thread = threading.Thread(target=self._capture, name='realtime-capture', daemon=True)
+        self._thread.start()
+
+    def _capture(self):
+        next_frame_at = time.monotonic()
+        last_captured = None
+        try:
+            while not self._closed:
+                if self.pace_fps:
+                    next_frame_at += 1.0 / self.pace_fps
+                    time.sleep(max(0.0, next_frame_at - time.monotonic()))
+
+                skip = self.captured % self.controller.interval != 0
+                self.captured += 1
+                if skip and hasattr(self.source, 'grab'):
+                    if not self.source.grab():
+                        break
+                    self.skipped += 1
+                    continue
+                ret, frame = self.source.read()
+                if not ret:
+                    break
+                now = time.monotonic()
+                if not self.pace_fps and last_captured is not None:
+                    # Cameras and pushed frames: estimate the frame period from arrivals
+                    period = now - last_captured
+                    self._frame_period = period if self._frame_period is None else \
+                        0.8 * self._frame_period + 0.2 * period
+                last_captured = now
+                if skip:
+                    self.skipped += 1
+                    continue
+
+                with self._cond:
+                    if self._fresh:
+                        self.dropped += 1
+                    self._frame = frame
+                    self._captured_at = now
+                    self._frame_number = self.captured
+                    self._fresh = True
+                    self._cond.notify_all()
+        finally:
+            with self._cond:
+                self._ended = True
+                self._cond.notify_all()
+
+    def read(self):
+        """Newest unseen frame as (ok, frame); blocks until one is captured or the source ends."""
+        with self._cond:
+            while not self._fresh and not self._ended:
+                self._cond.wait()
+            if not self._fresh:
+                return False, None
+            self._fresh = False
+            self.last_captured_at = self._captured_at
+            self.last_frame_number = self._frame_number
+            self._read_at = time.monotonic()
+            return True, self._frame
+
+    def frame_done(self):
+        """Record that the last frame returned by read() has been fully processed."""
+        now = time.monotonic()
+        self.processed += 1
+        latency = now - self.last_captured_at
+        self.latency.record(latency)
+        self.controller.update(now - self._read_at, latency, self._frame_period)
+
+    def release(self):
+        self._closed = True
+        self.source.release()
+        with self._cond:
+            self._cond.notify_all()
+
+    def stats(self):
+        return {
+            "target_latency_ms": self.controller.target_latency * 1000,
+            "frame_interval": self.controller.interval,
+            "captured": self.captured,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "skipped": self.skipped,
+            "latency": self.latency.percentiles(),
+        }
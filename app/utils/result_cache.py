@@ -0,0 +1,244 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from importlib import metadata
+
+# Bump when process_video starts producing different statistics for the same input
+ANALYSIS_VERSION = 3
+
+MODEL_PACKAGES = ('deepface', 'retina-face', 'tensorflow')
+
+# Outcomes of ResultCache.reserve
+CACHED = 'cached'
+PENDING = 'pending'
+CLAIMED = 'claimed'
+CHUNK_SIZE = 1024 * 1024
+
+
+def model_versions():
+    """Installed versions of the packages whose models produce the statistics."""
+    versions = {}
+    for package in MODEL_PACKAGES:
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    return versions
+
+
+def folder_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class ResultCache:
+    """
+    Content-addressed cache of processed videos.
+
+    Uploads are stored under their SHA-256 (so identical files are kept once and
+    different files never overwrite each other) and finished stats folders are indexed
+    by a key over (video hash, analysis parameters, model versions). Both kinds of item
+    are evicted least-recently-used once their total size exceeds ``max_bytes``.
+    The index is a JSON file in ``folder``. ``on_evict(stats_folder)`` is called for every
+    evicted stats folder.
+    """
+
+    def __init__(self, folder, upload_folder, max_bytes=10 * 1024 ** 3, on_evict=None):
+        self.folder = folder
+        self.upload_folder = upload_folder
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self.index_path = os.path.join(folder, 'cache_index.json')
+        os.makedirs(folder, exist_ok=True)
+        os.makedirs(upload_folder, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._pending_changed = threading.Condition(self._lock)
+        # cache key -> (job id, video hash) of jobs still processing; job id None while a
+        # reserve() claim has not been turned into a job yet
+        self._pending = {}
+        self.metrics = {"hits": 0, "misses": 0, "pending_hits": 0, "evictions": 0, "evicted_bytes": 0}
+        self._index = {"entries": {}, "uploads": {}}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as f:
+                self._index = json.load(f)
+
+    def _save_index(self):
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self._index, f, indent=4)
+        os.replace(tmp_path, self.index_path)
+
+    @staticmethod
+    def make_key(video_hash, params):
+        """Cache key over the video content, the parameters that affect the output and the model versions."""
+        key_data = {
+            "video_hash": video_hash,
+            "params": params,
+            "models": model_versions(),
+            "analysis_version": ANALYSIS_VERSION,
+        }
+        return hashlib.sha256(json.dumps(key_data, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def store_upload(self, stream, filename):
+        """
+        Stream an uploaded file to disk while hashing it. Returns (video_hash, video_path);
+        the file is stored as ``<upload_folder>/<sha256><ext>``.
+        """
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.upload_folder, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+            video_hash = digest.hexdigest()
+            video_path = os.path.join(self.upload_folder, video_hash + os.path.splitext(filename)[1].lower())
+            if os.path.exists(video_path):
+                os.remove(tmp_path)
+            else:
+                os.replace(tmp_path, video_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self._lock:
+            self._index["uploads"][video_hash] = {"path": video_path, "size_bytes": size, "last_access": time.time()}
+            self._evict_locked()
+            self._save_index()
+        return video_hash, video_path
+
+    def lookup(self, key):
+        """Stats folder of a finished result for key, or None. Counts a hit or a miss."""
+        with self._lock:
+            return self._lookup_locked(key)
+
+    def _lookup_locked(self, key):
+        entry = self._index["entries"].get(key)
+        if entry is not None and not os.path.exists(os.path.join(entry["stats_folder"], 'overall_statistics.json')):
+            # Removed behind our back; forget it
+            del self._index["entries"][key]
+            self._save_index()
+            entry = None
+
+        if entry is None:
+            if key in self._pending:
+                self.metrics["pending_hits"] += 1
+            else:
+                self.metrics["misses"] += 1
+            return None
+
+        self.metrics["hits"] += 1
+        entry["last_access"] = time.time()
+        self._save_index()
+        return entry["stats_folder"]
+
+    def reserve(self, key, video_hash):
+        """
+        Atomically check and claim key. Returns (CACHED, stats folder) for a finished result,
+        (PENDING, job id) when a job is already processing it, or (CLAIMED, None): the caller
+        now owns key and must either submit its job and mark_pending(key, job_id, ...) or
+        give the claim back with clear_pending(key). Callers that find another caller's claim
+        wait until it is resolved.
+        """
+        with self._lock:
+            while key in self._pending and self._pending[key][0] is None:
+                self._pending_changed.wait()
+            stats_folder = self._lookup_locked(key)
+            if stats_folder is not None:
+                return CACHED, stats_folder
+            if key in self._pending:
+                return PENDING, self._pending[key][0]
+            self._pending[key] = (None, video_hash)
+            return CLAIMED, None
+
+    def pending_job(self, key):
+        """Job id already processing this key, if any."""
+        with self._lock:
+            pending = self._pending.get(key)
+            return pending[0] if pending else None
+
+    def mark_pending(self, key, job_id, video_hash):
+        with self._lock:
+            self._pending[key] = (job_id, video_hash)
+            self._pending_changed.notify_all()
+
+    def clear_pending(self, key):
+        with self._lock:
+            self._pending.pop(key, None)
+            self._pending_changed.notify_all()
+
+    def put(self, key, video_hash, stats_folder):
+        """Record a finished stats folder for key."""
+        with self._lock:
+            self._pending.pop(key, None)
+            self._pending_changed.notify_all()
+            self._index["entries"][key] = {
+                "video_hash": video_hash,
+                "stats_folder": stats_folder,
+                "size_bytes": folder_size(stats_folder),
+                "created_at": time.time(),
+                "last_access": time.time(),
+            }
+            self._evict_locked()
+            self._save_index()
+
+    def _evict_locked(self):
+        items = [("entries", key, entry) for key, entry in self._index["entries"].items()]
+        items += [("uploads", video_hash, upload) for video_hash, upload in self._index["uploads"].items()]
+        total = sum(item["size_bytes"] for _, _, item in items)
+        if total <= self.max_bytes:
+            return
+
+        in_use = {video_hash for _, video_hash in self._pending.values()}
+        for kind, key, item in sorted(items, key=lambda i: i[2]["last_access"]):
+            if total <= self.max_bytes:
+                break
+            if kind == "uploads" and key in in_use:
+                continue  # Still needed by a queued or running job
+
+            path = item["stats_folder"] if kind == "entries" else item["path"]
+            try:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                elif os.path.exists(path):
+                    os.remove(path)
+            except OSError as e:
+                logging.warning(f"Could not evict {path}: {e}")
+                continue
+            del self._index[kind][key]
+            if kind == "entries" and self.on_evict is not None:
+                self.on_evict(path)
+            total -= item["size_bytes"]
+            self.metrics["evictions"] += 1
+            self.metrics["evicted_bytes"] += item["size_bytes"]
+            logging.info(f"Evicted cached {kind[:-1]} {path}")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.metrics["hits"] + self.metrics["misses"] + self.metrics["pending_hits"]
+            entries = self._index["entries"].values()
+            uploads = self._index["uploads"].values()
+            return dict(
+                self.metrics,
+                hit_rate=self.metrics["hits"] / lookups if lookups else 0.0,
+                entries=len(self._index["entries"]),
+                uploads=len(self._index["uploads"]),
+                pending=len(self._pending),
+                size_bytes=sum(e["size_bytes"] for e in entries) + sum(u["size_bytes"] for u in uploads),
+                max_bytes=self.max_bytes,
+            )
@@ -0,0 +1,474 @@
+import json
+import logging
+import os
+import shutil
+import threading
+
+import numpy as np
+
+from utils.emotion_timeline import load_timeline
+from utils.stats_storage import data_folder, summary_path
+
+MOMENTS = 'moments'  # Emotion probability vector of every timeline sample
+FACES = 'faces'  # One DeepFace identity embedding per face
+COLLECTIONS = (MOMENTS, FACES)
+
+# Label order of the MOMENTS vectors (DeepFace's); other sources are mapped by label name
+MOMENT_LABELS = ('angry', 'disgust', 'fear', 'happy', 'sad', 'surprise', 'neutral')
+# Label order of probability rows saved by utils.video_emotion_recognition_livefeed without
+# a labels file (the ViT expression model's id2label order)
+LIVE_EMBEDDING_LABELS = ('angry', 'disgust', 'fear', 'happy', 'neutral', 'sad', 'surprise')
+# Face id of the moments of a live-feed embeddings file
+LIVE_FACE_ID = 'live'
+
+# Rows scored per matrix product in brute-force search, bounding the temporary memory
+SEARCH_CHUNK_ROWS = 1 << 16
+# An approximate (IVF) index is built once a collection has this many rows, and rebuilt
+# once the rows added since the last build (scored exhaustively) reach REBUILD_FRACTION
+# of the rows it covers
+APPROXIMATE_MIN_ROWS = 200000
+REBUILD_FRACTION = 0.25
+DEFAULT_NPROBE = 16
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def emotion_probabilities(scores):
+    """Rows of emotion scores (percentages or probabilities) as probability vectors."""
+    scores = np.clip(np.asarray(scores, dtype=np.float32), 0, None)
+    return scores / np.maximum(scores.sum(axis=-1, keepdims=True), 1e-12)
+
+
+def align_emotions(scores, labels):
+    """Rows of emotion scores in labels order as probability vectors in MOMENT_LABELS order."""
+    positions = {label.lower(): i for i, label in enumerate(labels)}
+    missing = [label for label in MOMENT_LABELS if label not in positions]
+    if missing:
+        raise ValueError(f"Emotion labels {list(labels)} lack {missing}")
+    scores = np.asarray(scores, dtype=np.float32)
+    return emotion_probabilities(scores[..., [positions[label] for label in MOMENT_LABELS]])
+
+
+def embedding_labels_path(embeddings_path):
+    """JSON list of the emotion labels of a live-feed embeddings file's columns."""
+    return f"{os.path.splitext(embeddings_path)[0]}_labels.json"
+
+
+def _top_k(scores, ids, k):
+    """The k highest scores (descending) and their ids."""
+    if len(scores) > k:
+        keep = np.argpartition(-scores, k - 1)[:k]
+        scores, ids = scores[keep], ids[keep]
+    order = np.argsort(-scores, kind='stable')
+    return scores[order], ids[order]
+
+
+class VectorIndex:
+    """
+    Append-only collection of L2-normalized float32 vectors with cosine k-NN search.
+
+    Vectors live in vectors.f32 (count x dim), their (folder number, face number,
+    frame_index) in rows.i64 and timestamps in timestamps.f64, all read through np.memmap;
+    index.json holds the row count, the vector space, the stats folders and face ids the
+    rows point to, and the approximate index. Rows are appended to the data files before
+    index.json (replaced atomically) counts them, so a crash never exposes partial rows.
+    Re-adding or removing a stats folder marks its old rows deleted; they are skipped by
+    searches and dropped by compact().
+
+    Search is exact by default: a chunked matrix-vector product over all rows. With
+    approximate=True an inverted file index (k-means centroids, rows grouped by their
+    nearest centroid) restricts the product to the rows of the nprobe closest centroids
+    plus the rows added since the index was built.
+
+    One process writes an index; the threads of that process share it.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self._lock = threading.RLock()
+        os.makedirs(folder, exist_ok=True)
+        meta_path = os.path.join(folder, 'index.json')
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r') as f:
+                self._meta = json.load(f)
+        else:
+            self._meta = {"dim": None, "space": None, "count": 0, "folders": [], "faces": [], "ivf": None}
+
+    def _path(self, name):
+        return os.path.join(self.folder, name)
+
+    def _save_meta(self):
+        path = self._path('index.json')
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self._meta, f)
+        os.replace(tmp_path, path)
+
+    def _arrays(self):
+        """Memory maps of the counted rows: (vectors, rows, timestamps)."""
+        count, dim = self._meta["count"], self._meta["dim"]
+        return (np.memmap(self._path('vectors.f32'), dtype=np.float32, mode='r', shape=(count, dim)),
+                np.memmap(self._path('rows.i64'), dtype=np.int64, mode='r', shape=(count, 3)),
+                np.memmap(self._path('timestamps.f64'), dtype=np.float64, mode='r', shape=(count,)))
+
+    def __len__(self):
+        return self._meta["count"]
+
+    def add(self, stats_folder, vectors, face_ids, frame_index=None, timestamp_ms=None, space=None):
+        """
+        Append the vectors of one stats folder (replacing any it had before). face_ids,
+        frame_index and timestamp_ms are per row; space (e.g. the emotion labels or the
+        embedding model) must match the space of the vectors already in the index.
+        """
+        vectors = normalize(vectors)
+        if vectors.ndim != 2 or len(vectors) != len(face_ids):
+            raise ValueError("vectors must be a 2-D array with one face id per row")
+        n = len(vectors)
+        frame_index = np.full(n, -1, dtype=np.int64) if frame_index is None else np.asarray(frame_index)
+        timestamp_ms = np.full(n, np.nan) if timestamp_ms is None else np.asarray(timestamp_ms)
+        stats_folder = os.path.normpath(stats_folder)
+
+        with self._lock:
+            meta = self._meta
+            if meta["count"] and (meta["dim"] != vectors.shape[1] or meta["space"] != space):
+                raise ValueError(f"Vectors of space {space} (dim {vectors.shape[1]}) do not match the index "
+                                 f"({meta['space']}, dim {meta['dim']})")
+            self._mark_deleted(stats_folder)
+            folder_number = len(meta["folders"])
+            meta["folders"].append({"path": stats_folder, "rows": n, "deleted": False})
+            numbers = {face_id: number for number, face_id in enumerate(meta["faces"])}
+            for face_id in face_ids:
+                if face_id not in numbers:
+                    numbers[face_id] = len(meta["faces"])
+                    meta["faces"].append(face_id)
+            face_numbers = [numbers[face_id] for face_id in face_ids]
+
+            rows = np.stack([np.full(n, folder_number), face_numbers, frame_index], axis=1).astype(np.int64)
+            if meta["count"] == 0:
+                # Drop uncounted rows left by an interrupted write
+                for name in ('vectors.f32', 'rows.i64', 'timestamps.f64'):
+                    open(self._path(name), 'wb').close()
+            else:
+                self._truncate_to_count()
+            with open(self._path('vectors.f32'), 'ab') as f:
+                f.write(vectors.tobytes())
+            with open(self._path('rows.i64'), 'ab') as f:
+                f.write(rows.tobytes())
+            with open(self._path('timestamps.f64'), 'ab') as f:
+                f.write(np.asarray(timestamp_ms, dtype=np.float64).tobytes())
+            meta["dim"], meta["space"] = int(vectors.shape[1]), space
+            meta["count"] += n
+            self._save_meta()
+            self._maintain()
+
+    def _truncate_to_count(self):
+        count, dim = self._meta["count"], self._meta["dim"]
+        for name, row_bytes in (('vectors.f32', 4 * dim), ('rows.i64', 24), ('timestamps.f64', 8)):
+            if os.path.getsize(self._path(name)) != count * row_bytes:
+                os.truncate(self._path(name), count * row_bytes)
+
+    def _mark_deleted(self, stats_folder):
+        changed = False
+        for entry in self._meta["folders"]:
+            if entry["path"] == stats_folder and not entry["deleted"]:
+                entry["deleted"] = True
+                changed = True
+        return changed
+
+    def remove(self, stats_folder):
+        with self._lock:
+            if self._mark_deleted(os.path.normpath(stats_folder)):
+                self._save_meta()
+                self._maintain()
+
+    def folders(self):
+        """The indexed (not deleted) stats folders with their row counts."""
+        with self._lock:
+            return [dict(entry) for entry in self._meta["folders"] if not entry["deleted"]]
+
+    def deleted_rows(self):
+        return sum(entry["rows"] for entry in self._meta["folders"] if entry["deleted"])
+
+    def _maintain(self):
+        """Compact once most rows are deleted; (re)build the approximate index as the index grows."""
+        if self.deleted_rows() > max(len(self) // 2, 1000):
+            self.compact()
+        ivf_rows = self._meta["ivf"]["rows"] if self._meta["ivf"] else 0
+        if len(self) >= APPROXIMATE_MIN_ROWS and len(self) - ivf_rows >= REBUILD_FRACTION * ivf_rows:
+            self.build_approximate()
+
+    def compact(self):
+        """Rewrite the data files without deleted rows (dropping the approximate index)."""
+        with self._lock:
+            meta = self._meta
+            if meta["count"] == 0:
+                return
+            vectors, rows, timestamps = self._arrays()
+            live_folders = [number for number, entry in enumerate(meta["folders"]) if not entry["deleted"]]
+            renumber = np.full(len(meta["folders"]), -1, dtype=np.int64)
+            renumber[live_folders] = np.arange(len(live_folders))
+            keep = np.flatnonzero(renumber[rows[:, 0]] >= 0)
+
+            new_rows = np.array(rows[keep])
+            new_rows[:, 0] = renumber[new_rows[:, 0]]
+            for name, values in (('vectors.f32', vectors[keep]), ('rows.i64', new_rows),
+                                 ('timestamps.f64', timestamps[keep])):
+                tmp_path = self._path(name + '.tmp')
+                with open(tmp_path, 'wb') as f:
+                    f.write(np.ascontiguousarray(values).tobytes())
+                os.replace(tmp_path, self._path(name))
+            del vectors, rows, timestamps
+            self._drop_approximate()
+            meta["folders"] = [meta["folders"][number] for number in live_folders]
+            meta["count"] = len(keep)
+            self._save_meta()
+            logging.info(f"Compacted {self.folder} to {len(keep)} rows")
+
+    def _drop_approximate(self):
+        if self._meta["ivf"]:
+            shutil.rmtree(self._path(self._meta["ivf"]["folder"]), ignore_errors=True)
+            self._meta["ivf"] = None
+
+    def build_approximate(self, nlist=None, iterations=10, sample_size=50000, seed=0):
+        """
+        Build the inverted file index over the current rows: spherical k-means (nlist
+        centroids, default ~sqrt(rows)) on a sample of the vectors, then every row is
+        assigned to its closest centroid and the row numbers are stored grouped by centroid.
+        """
+        with self._lock:
+            count = len(self)
+            if count == 0:
+                return
+            vectors = self._arrays()[0]
+            rng = np.random.default_rng(seed)
+            sample = np.asarray(vectors[np.sort(rng.choice(count, min(sample_size, count), replace=False))])
+            nlist = min(nlist or int(np.clip(np.sqrt(count), 16, 4096)), len(sample))
+            centroids = sample[rng.choice(len(sample), nlist, replace=False)]
+            for _ in range(iterations):
+                assignment = np.argmax(sample @ centroids.T, axis=1)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assignment, sample)
+                filled = np.bincount(assignment, minlength=nlist) > 0
+                centroids[filled] = normalize(sums[filled])
+
+            assignment = np.concatenate([np.argmax(vectors[start:start + SEARCH_CHUNK_ROWS] @ centroids.T, axis=1)
+                                         for start in range(0, count, SEARCH_CHUNK_ROWS)])
+            order = np.argsort(assignment, kind='stable')
+            offsets = np.searchsorted(assignment[order], np.arange(nlist + 1))
+
+            name = f'ivf_{count}'
+            folder = self._path(name)
+            os.makedirs(folder, exist_ok=True)
+            np.save(os.path.join(folder, 'centroids.npy'), centroids)
+            np.save(os.path.join(folder, 'order.npy'), order)
+            np.save(os.path.join(folder, 'offsets.npy'), offsets)
+            previous = self._meta["ivf"]
+            self._meta["ivf"] = {"folder": name, "rows": count, "nlist": int(nlist)}
+            self._save_meta()
+            if previous and previous["folder"] != name:
+                shutil.rmtree(self._path(previous["folder"]), ignore_errors=True)
+            logging.info(f"Built approximate index of {self.folder}: {count} rows, {nlist} lists")
+
+    def _candidates(self, query, nprobe):
+        """Row numbers to score for an approximate search, or None to score every row."""
+        ivf = self._meta["ivf"]
+        if not ivf:
+            return None
+        folder = self._path(ivf["folder"])
+        centroids = np.load(os.path.join(folder, 'centroids.npy'))
+        order = np.load(os.path.join(folder, 'order.npy'), mmap_mode='r')
+        offsets = np.load(os.path.join(folder, 'offsets.npy'))
+        _, probe = _top_k(centroids @ query, np.arange(len(centroids)), min(nprobe, len(centroids)))
+        lists = [order[offsets[i]:offsets[i + 1]] for i in probe]
+        # Rows added after the index was built are always scored
+        return np.sort(np.concatenate(lists + [np.arange(ivf["rows"], len(self))]).astype(np.int64))
+
+    def search(self, query, k=10, exclude_folder=None, exclude_face=None, approximate=False,
+               nprobe=DEFAULT_NPROBE):
+        """
+        The k rows most similar to query (cosine), best first, as dicts with stats_folder,
+        face_id, frame_index, timestamp_ms and score. exclude_folder skips the rows of a
+        stats folder, or only those of its exclude_face when that is given too.
+        """
+        with self._lock:
+            meta = dict(self._meta, folders=[dict(entry) for entry in self._meta["folders"]],
+                        faces=list(self._meta["faces"]))
+            if meta["count"] == 0:
+                return []
+            vectors, rows, timestamps = self._arrays()
+            candidates = self._candidates(normalize(query), nprobe) if approximate else None
+        query = normalize(query)
+        if query.shape != (meta["dim"],):
+            raise ValueError(f"Query must have {meta['dim']} dimensions")
+
+        excluded_folders = np.array([entry["deleted"] for entry in meta["folders"]], dtype=bool)
+        excluded_face = -1
+        same_folder = np.zeros(len(meta["folders"]), dtype=bool)
+        if exclude_folder is not None:
+            exclude_folder = os.path.normpath(exclude_folder)
+            same_folder = np.array([entry["path"] == exclude_folder for entry in meta["folders"]], dtype=bool)
+            if exclude_face is None:
+                excluded_folders |= same_folder
+            elif exclude_face in meta["faces"]:
+                excluded_face = meta["faces"].index(exclude_face)
+
+        def score(ids, block_vectors, block_rows):
+            scores = block_vectors @ query
+            mask = excluded_folders[block_rows[:, 0]]
+            if excluded_face >= 0:
+                mask |= same_folder[block_rows[:, 0]] & (block_rows[:, 1] == excluded_face)
+            scores[mask] = -np.inf
+            return _top_k(scores, ids, k)
+
+        best_scores, best_ids = np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+        if candidates is None:
+            blocks = ((np.arange(start, min(start + SEARCH_CHUNK_ROWS, meta["count"])),
+                       vectors[start:start + SEARCH_CHUNK_ROWS], rows[start:start + SEARCH_CHUNK_ROWS])
+                      for start in range(0, meta["count"], SEARCH_CHUNK_ROWS))
+        else:
+            blocks = ((ids, vectors[ids], rows[ids]) for ids in
+                      (candidates[start:start + SEARCH_CHUNK_ROWS] for start in range(0, len(candidates),
+                                                                                       SEARCH_CHUNK_ROWS)))
+        for ids, block_vectors, block_rows in blocks:
+            scores, ids = score(ids, block_vectors, block_rows)
+            best_scores, best_ids = _top_k(np.concatenate([best_scores, scores]),
+                                           np.concatenate([best_ids, ids]), k)
+
+        results = []
+        for row_score, row in zip(best_scores, best_ids):
+            if not np.isfinite(row_score):
+                break
+            folder_number, face_number, frame_index = (int(v) for v in rows[row])
+            timestamp = float(timestamps[row])
+            results.append({"stats_folder": meta["folders"][folder_number]["path"],
+                            "face_id": meta["faces"][face_number],
+                            "frame_index": frame_index if frame_index >= 0 else None,
+                            "timestamp_ms": timestamp if np.isfinite(timestamp) else None,
+                            "score": float(row_score)})
+        return results
+
+    def stats(self):
+        with self._lock:
+            return {
+                "rows": len(self),
+                "deleted_rows": self.deleted_rows(),
+                "folders": sum(not entry["deleted"] for entry in self._meta["folders"]),
+                "dim": self._meta["dim"],
+                "space": self._meta["space"],
+                "approximate": dict(self._meta["ivf"]) if self._meta["ivf"] else None,
+            }
+
+
+class SimilarityIndex:
+    """
+    k-NN search across processed videos over two VectorIndex collections in folder:
+    MOMENTS holds the emotion probability vector of every timeline sample ("moments whose
+    emotional state resembles this one") and FACES one DeepFace identity embedding per
+    face, when process_video computed them ("the same person in other videos").
+
+    Moments from sources with another label order are mapped by label name to
+    MOMENT_LABELS: stats folders written before timelines existed contribute each face's
+    embedding_example (its first analyzed frame), and add_embeddings_file indexes the
+    probability rows saved by the live feed (utils.video_emotion_recognition_livefeed).
+    Those moments have no frame index or timestamp.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.collections = {name: VectorIndex(os.path.join(folder, name)) for name in COLLECTIONS}
+
+    def add_folder(self, stats_folder):
+        """
+        (Re-)index a stats folder from the timelines and face embeddings it holds; faces
+        without a timeline contribute their embedding_example as a single moment.
+        """
+        with open(os.path.join(stats_folder, 'overall_statistics.json'), 'r') as f:
+            overall_stats = json.load(f)
+
+        moments, faces = [], []
+        for face_id in overall_stats.get('faces', []):
+            with open(summary_path(stats_folder, face_id), 'r') as f:
+                face_statistics = json.load(f)
+            if "timeline" in face_statistics:
+                frame_index, timestamp_ms, emotion, labels = load_timeline(
+                    os.path.join(stats_folder, face_statistics["timeline"]["folder"]))
+                if len(frame_index):
+                    moments.append((face_id, frame_index, timestamp_ms, align_emotions(emotion, labels)))
+            elif face_statistics.get("embedding_example"):
+                example = face_statistics["embedding_example"]
+                moments.append((face_id, np.array([-1]), np.array([np.nan]),
+                                align_emotions([list(example.values())], list(example))))
+            if "face_embedding" in face_statistics:
+                embedding = face_statistics["face_embedding"]
+                faces.append((face_id, np.load(os.path.join(data_folder(stats_folder, face_id), embedding["file"])),
+                              embedding["model"]))
+
+        if moments:
+            self.collections[MOMENTS].add(
+                stats_folder, np.concatenate([m[3] for m in moments]),
+                [m[0] for m in moments for _ in range(len(m[1]))],
+                np.concatenate([m[1] for m in moments]), np.concatenate([m[2] for m in moments]),
+                space={"emotion_labels": list(MOMENT_LABELS)})
+        else:
+            self.collections[MOMENTS].remove(stats_folder)
+        if faces:
+            self.collections[FACES].add(stats_folder, np.stack([embedding for _, embedding, _ in faces]),
+                                        [face_id for face_id, _, _ in faces], space={"model": faces[0][2]})
+        else:
+            self.collections[FACES].remove(stats_folder)
+        return {MOMENTS: sum(len(m[1]) for m in moments), FACES: len(faces)}
+
+    def add_embeddings_file(self, path, labels=None):
+        """
+        (Re-)index the emotion probability rows of a live-feed embeddings file (one row per
+        analyzed face, e.g. emotion_embeddings.npy) as moments of face LIVE_FACE_ID, keyed
+        by the file's path. labels (the column order) defaults to the labels file saved next
+        to it (see embedding_labels_path), else LIVE_EMBEDDING_LABELS.
+        """
+        if labels is None:
+            labels = LIVE_EMBEDDING_LABELS
+            if os.path.exists(embedding_labels_path(path)):
+                with open(embedding_labels_path(path), 'r') as f:
+                    labels = json.load(f)
+        emotion = np.load(path)
+        if emotion.ndim != 2 or len(emotion) == 0:
+            self.collections[MOMENTS].remove(path)
+            return 0
+        self.collections[MOMENTS].add(path, align_emotions(emotion, labels), [LIVE_FACE_ID] * len(emotion),
+                                      space={"emotion_labels": list(MOMENT_LABELS)})
+        return len(emotion)
+
+    def remove(self, stats_folder):
+        for collection in self.collections.values():
+            collection.remove(stats_folder)
+
+    def emotion_vector(self, emotions):
+        """Query vector from {emotion: score}, in the label order of the indexed moments."""
+        space = self.collections[MOMENTS].stats()["space"]
+        if not space:
+            raise ValueError("No moments are indexed yet")
+        unknown = set(emotions) - set(space["emotion_labels"])
+        if unknown:
+            raise ValueError(f"Unknown emotions {sorted(unknown)}; expected {space['emotion_labels']}")
+        return emotion_probabilities([float(emotions.get(label, 0.0)) for label in space["emotion_labels"]])
+
+    def similar_moments(self, emotions, k=10, exclude_folder=None, exclude_face=None, approximate=False):
+        return self.collections[MOMENTS].search(self.emotion_vector(emotions), k, exclude_folder, exclude_face,
+                                                approximate)
+
+    def similar_faces(self, stats_folder, face_id, k=10, include_same_video=False, approximate=False):
+        """Faces of other videos (or of any video) whose identity embedding is closest to face_id's."""
+        with open(summary_path(stats_folder, face_id), 'r') as f:
+            face_statistics = json.load(f)
+        if "face_embedding" not in face_statistics:
+            raise ValueError(f"No face embedding was computed for {face_id}")
+        embedding = np.load(os.path.join(data_folder(stats_folder, face_id), face_statistics["face_embedding"]["file"]))
+        return self.collections[FACES].search(embedding, k, stats_folder, face_id if include_same_video else None,
+                                              approximate)
+
+    def stats(self):
+        return {name: collection.stats() for name, collection in self.collections.items()}
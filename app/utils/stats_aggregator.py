@@ -0,0 +1,251 @@
+import heapq
+import random
+
+import cv2
+import numpy as np
+
+from utils.emotion_timeline import TimelineLog
+from utils.metrics import timed
+
+# Thumbnail retention strategies
+TOP_K = 'top_k'  # Keep the thumbnails with the highest dominant-emotion confidence
+RESERVOIR = 'reservoir'  # Keep a uniform random sample of all analyzed frames
+THUMBNAIL_STRATEGIES = (TOP_K, RESERVOIR)
+
+
+class RunningStats:
+    """Welford's online mean/variance for a vector of values."""
+
+    def __init__(self, size):
+        self.count = 0
+        self.mean = np.zeros(size, dtype=np.float64)
+        self.m2 = np.zeros(size, dtype=np.float64)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        self.count += 1
+        delta = values - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (values - self.mean)
+
+    @property
+    def variance(self):
+        if self.count < 2:
+            return np.zeros_like(self.m2)
+        return self.m2 / (self.count - 1)
+
+
+class RingBuffer:
+    """
+    Buffer keeping the most recent ``capacity`` rows. Storage starts at
+    ``initial_capacity`` rows and doubles until it reaches ``capacity``, so short series
+    (e.g. a face seen in a few frames) stay small; pickling stores only the buffered rows.
+    """
+
+    def __init__(self, capacity, row_shape=(), dtype=np.float32, initial_capacity=64):
+        self.capacity = capacity
+        self.data = np.zeros((min(capacity, initial_capacity),) + tuple(row_shape), dtype=dtype)
+        self.count = 0  # Total rows ever appended
+
+    def append(self, row):
+        if self.count == len(self.data) < self.capacity:
+            size = min(max(2 * len(self.data), 1), self.capacity)
+            grown = np.zeros((size,) + self.data.shape[1:], dtype=self.data.dtype)
+            grown[:self.count] = self.data
+            self.data = grown
+        self.data[self.count % self.capacity] = row
+        self.count += 1
+
+    def values(self):
+        """Buffered rows, oldest first."""
+        if self.count <= self.capacity:
+            return self.data[:self.count].copy()
+        start = self.count % self.capacity
+        return np.concatenate([self.data[start:], self.data[:start]])
+
+    def __getstate__(self):
+        return {"capacity": self.capacity, "count": self.count, "rows": self.values()}
+
+    def __setstate__(self, state):
+        self.capacity = state["capacity"]
+        self.count = state["count"]
+        rows = state["rows"]
+        # Full buffers wrap around: put the oldest row back at count % capacity
+        self.data = np.roll(rows, self.count % self.capacity, axis=0) if self.count > self.capacity else rows
+
+
+class FaceAggregator:
+    """
+    Constant-memory statistics for one face.
+
+    Replaces the per-frame Python lists process_video used to keep: averages are
+    running means, dominant labels are counters, the per-frame series live in ring
+    buffers of ``series_capacity`` rows and only ``thumbnail_capacity`` thumbnails are
+    kept, either the most confident ones (TOP_K) or a reservoir sample (RESERVOIR). With
+    ``timeline_path`` the complete emotion timeline (frame index, timestamp, emotion
+    vector) is streamed to a TimelineLog file there, for the range queries of
+    utils.emotion_timeline; only its write buffer is held in memory.
+    """
+
+    def __init__(self, series_capacity=10000, thumbnail_capacity=20, thumbnail_strategy=TOP_K, seed=0,
+                 timeline_path=None):
+        if thumbnail_strategy not in THUMBNAIL_STRATEGIES:
+            raise ValueError(f"Unknown thumbnail strategy: {thumbnail_strategy}")
+        self.series_capacity = series_capacity
+        self.thumbnail_capacity = thumbnail_capacity
+        self.thumbnail_strategy = thumbnail_strategy
+        self._random = random.Random(seed)
+
+        self.total_frames = 0
+        self.emotion_counts = {}
+        self.gender_counts = {}
+        self.emotion_labels = None
+        self.race_labels = None
+        self.gender_labels = []
+        self.emotion_stats = None
+        self.race_stats = None
+        self.age_stats = RunningStats(1)
+        self.embedding_example = None
+
+        self.emotion_series = None
+        self.race_series = None
+        self.age_series = RingBuffer(series_capacity)
+        self.gender_series = RingBuffer(series_capacity, dtype=np.uint8)
+        self.frame_index_series = RingBuffer(series_capacity, dtype=np.int64)
+        self.box_series = RingBuffer(series_capacity, (4,), dtype=np.int32)  # x1, y1, x2, y2; -1 if unknown
+        self.timeline_path = timeline_path
+        self.timeline_log = None  # Created with the first timestamped frame
+
+        # (priority, sequence, jpeg bytes); a min-heap for TOP_K, a plain list for RESERVOIR
+        self._thumbnails = []
+
+    def update(self, analysis, face_region, frame_index=-1, thumbnail=None, box=None, timestamp_ms=None):
+        """
+        Fold one DeepFace analysis result (and its face crop) into the statistics. Only
+        'emotion' is required; age, gender and race are aggregated when the analysis
+        profile included them.
+        thumbnail is the already JPEG-encoded crop, if the caller has it; otherwise the crop
+        is only encoded when it is going to be kept. box is the crop's (x1, y1, x2, y2) in
+        the frame, kept so results can be drawn back onto the video. Frames are added to the
+        timeline when it has a timeline_path and their timestamp_ms is known.
+        """
+        emotion_scores = analysis['emotion']
+        race = analysis.get('race')
+        gender = analysis.get('gender')
+
+        if self.emotion_labels is None:
+            self.emotion_labels = list(emotion_scores.keys())
+            self.emotion_stats = RunningStats(len(self.emotion_labels))
+            self.emotion_series = RingBuffer(self.series_capacity, (len(self.emotion_labels),))
+            self.embedding_example = dict(emotion_scores)  # Example embedding from the first frame
+        if race is not None and self.race_labels is None:
+            self.race_labels = list(race.keys())
+            self.race_stats = RunningStats(len(self.race_labels))
+            self.race_series = RingBuffer(self.series_capacity, (len(self.race_labels),))
+
+        emotion_vector = [emotion_scores[e] for e in self.emotion_labels]
+        dominant_emotion = analysis['dominant_emotion']
+
+        self.total_frames += 1
+        self.emotion_counts[dominant_emotion] = self.emotion_counts.get(dominant_emotion, 0) + 1
+        self.emotion_stats.update(emotion_vector)
+        self.emotion_series.append(emotion_vector)
+        if timestamp_ms is not None and self.timeline_path is not None:
+            if self.timeline_log is None:
+                self.timeline_log = TimelineLog(self.timeline_path)
+            self.timeline_log.append(frame_index, timestamp_ms, emotion_vector)
+
+        if race is not None:
+            race_vector = [race[r] for r in self.race_labels]
+            self.race_stats.update(race_vector)
+            self.race_series.append(race_vector)
+        if gender is not None:
+            dominant_gender = max(gender, key=gender.get)  # Get the gender with the highest confidence
+            if dominant_gender not in self.gender_labels:
+                self.gender_labels.append(dominant_gender)
+            self.gender_counts[dominant_gender] = self.gender_counts.get(dominant_gender, 0) + 1
+            self.gender_series.append(self.gender_labels.index(dominant_gender))
+        if 'age' in analysis:
+            self.age_stats.update([analysis['age']])
+            self.age_series.append(analysis['age'])
+        self.frame_index_series.append(frame_index)
+        self.box_series.append(box if box is not None else (-1, -1, -1, -1))
+
+        self._offer_thumbnail(emotion_scores.get(dominant_emotion, 0.0), face_region, thumbnail)
+
+    def _offer_thumbnail(self, confidence, face_region, thumbnail=None):
+        if self.thumbnail_capacity <= 0:
+            return
+        sequence = self.total_frames
+
+        if self.thumbnail_strategy == TOP_K:
+            if len(self._thumbnails) >= self.thumbnail_capacity and confidence <= self._thumbnails[0][0]:
+                return  # Not good enough; skip the JPEG encode entirely
+            entry = (float(confidence), sequence, thumbnail or encode_thumbnail(face_region))
+            if len(self._thumbnails) < self.thumbnail_capacity:
+                heapq.heappush(self._thumbnails, entry)
+            else:
+                heapq.heapreplace(self._thumbnails, entry)
+        else:
+            if len(self._thumbnails) < self.thumbnail_capacity:
+                self._thumbnails.append((0.0, sequence, thumbnail or encode_thumbnail(face_region)))
+                return
+            slot = self._random.randrange(sequence)
+            if slot < self.thumbnail_capacity:
+                self._thumbnails[slot] = (0.0, sequence, thumbnail or encode_thumbnail(face_region))
+
+    def thumbnails(self):
+        """Kept thumbnails as JPEG bytes: most confident first for TOP_K, frame order for RESERVOIR."""
+        if self.thumbnail_strategy == TOP_K:
+            ordered = sorted(self._thumbnails, key=lambda t: (-t[0], t[1]))
+        else:
+            ordered = sorted(self._thumbnails, key=lambda t: t[1])
+        return [jpeg for _, _, jpeg in ordered]
+
+    def summary(self, face_id):
+        """The per-face statistics dictionary written by process_video."""
+        return {
+            "face_id": face_id,
+            "total_frames_processed": self.total_frames,
+            "most_common_emotion": max(self.emotion_counts, key=self.emotion_counts.get),
+            "emotion_counts": dict(self.emotion_counts),
+            "average_confidences": dict(zip(self.emotion_labels, self.emotion_stats.mean.tolist())),
+            "average_age": float(self.age_stats.mean[0]) if self.age_stats.count else None,
+            "most_common_gender": max(self.gender_counts, key=self.gender_counts.get) if self.gender_counts else None,
+            "average_race": dict(zip(self.race_labels, self.race_stats.mean.tolist())) if self.race_labels else {},
+            "probabilistic_embeddings_shape": (self.total_frames, len(self.emotion_labels)),
+            "embedding_example": self.embedding_example,
+        }
+
+    def series(self):
+        """
+        Buffered per-frame series in the layout expected by stats_storage.save_face_statistics.
+        race, age and gender are only present when they were analyzed.
+        """
+        series = {
+            "frame_index": (None, self.frame_index_series.values()),
+            "emotion": (self.emotion_labels, self.emotion_series.values()),
+        }
+        if self.race_labels:
+            series["race"] = (self.race_labels, self.race_series.values())
+        if self.age_stats.count:
+            series["age"] = (None, self.age_series.values())
+        if self.gender_counts:
+            series["gender"] = (self.gender_labels, self.gender_series.values())
+        series["box"] = (["x1", "y1", "x2", "y2"], self.box_series.values())
+        return series
+
+    def timeline(self):
+        """
+        (frame_index, timestamp_ms, emotion, emotion labels) of every timestamped frame, or
+        None; the columns are memory-mapped from the timeline log.
+        """
+        if self.timeline_log is None or self.timeline_log.count == 0:
+            return None
+        return self.timeline_log.values() + (self.emotion_labels,)
+
+
+def encode_thumbnail(face_region):
+    with timed('thumbnail_encode'):
+        _, buffer = cv2.imencode('.jpg', face_region)
+    return buffer.tobytes()
@@ -0,0 +1,294 @@
+import json
+import logging
+import os
+import sqlite3
+import time
+from contextlib import closing
+
+from utils.stats_storage import summary_path
+
+INDEX_FILE = 'stats_index.sqlite'
+MAX_PAGE_SIZE = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS videos (
+    stats_folder TEXT PRIMARY KEY,
+    video_path TEXT,
+    processed_at REAL,
+    total_frames_processed INTEGER,
+    total_faces_detected INTEGER,
+    analyzed_frames INTEGER,
+    dominant_emotion TEXT,
+    profile TEXT,
+    stats_format TEXT
+);
+CREATE TABLE IF NOT EXISTS video_emotions (
+    stats_folder TEXT,
+    emotion TEXT,
+    frames INTEGER,
+    average_confidence REAL,
+    PRIMARY KEY (stats_folder, emotion)
+);
+CREATE TABLE IF NOT EXISTS faces (
+    stats_folder TEXT,
+    face_id TEXT,
+    total_frames INTEGER,
+    dominant_emotion TEXT,
+    average_age REAL,
+    gender TEXT,
+    PRIMARY KEY (stats_folder, face_id)
+);
+CREATE TABLE IF NOT EXISTS face_emotions (
+    stats_folder TEXT,
+    face_id TEXT,
+    emotion TEXT,
+    frames INTEGER,
+    average_confidence REAL,
+    PRIMARY KEY (stats_folder, face_id, emotion)
+);
+CREATE INDEX IF NOT EXISTS videos_dominant_emotion ON videos (dominant_emotion);
+CREATE INDEX IF NOT EXISTS videos_processed_at ON videos (processed_at);
+CREATE INDEX IF NOT EXISTS video_emotions_confidence ON video_emotions (emotion, average_confidence);
+CREATE INDEX IF NOT EXISTS faces_total_frames ON faces (total_frames);
+CREATE INDEX IF NOT EXISTS faces_dominant_emotion ON faces (dominant_emotion);
+CREATE INDEX IF NOT EXISTS face_emotions_confidence ON face_emotions (emotion, average_confidence);
+"""
+
+# Sortable columns of each listing; "confidence:<emotion>" and "frames:<emotion>" sort by
+# an emotion's average confidence or frame count as well
+VIDEO_SORT_COLUMNS = ('processed_at', 'stats_folder', 'total_frames_processed', 'total_faces_detected',
+                      'analyzed_frames', 'dominant_emotion')
+FACE_SORT_COLUMNS = ('stats_folder', 'face_id', 'total_frames', 'dominant_emotion', 'average_age')
+
+
+def video_emotions(face_summaries):
+    """
+    Video-level {emotion: (frames, average confidence)} from per-face summaries: frame counts
+    are summed and confidences averaged weighted by each face's analyzed frames.
+    """
+    frames = {}
+    weighted = {}
+    total_frames = 0
+    for summary in face_summaries:
+        face_frames = summary.get('total_frames_processed') or 0
+        total_frames += face_frames
+        for emotion, count in (summary.get('emotion_counts') or {}).items():
+            frames[emotion] = frames.get(emotion, 0) + count
+        for emotion, confidence in (summary.get('average_confidences') or {}).items():
+            weighted[emotion] = weighted.get(emotion, 0.0) + confidence * face_frames
+    return {emotion: (frames.get(emotion, 0), weighted.get(emotion, 0.0) / total_frames if total_frames else None)
+            for emotion in set(frames) | set(weighted)}
+
+
+class StatsIndex:
+    """
+    SQLite index of processed stats folders, for queries across all videos.
+
+    One row per video (totals, dominant emotion, profile), per video emotion (frame count,
+    frame-weighted average confidence), per face and per face emotion. Rows are written
+    from the summaries process_video already holds, so queries never open the per-face
+    JSON files. Every call uses its own connection and the database runs in WAL mode, so
+    job threads and batch worker processes can write while the web app reads.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with closing(self._connect()) as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(_SCHEMA)
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def add(self, stats_folder, overall_stats, face_summaries, video_path=None, processed_at=None):
+        """Index (or re-index) a stats folder from its overall statistics and per-face summaries."""
+        stats_folder = os.path.normpath(stats_folder)
+        emotions = video_emotions(face_summaries)
+        dominant_emotion = max(emotions, key=lambda emotion: emotions[emotion][0]) if emotions else None
+        profile = overall_stats.get('profile')
+        with closing(self._connect()) as connection, connection:
+            self._delete(connection, stats_folder)
+            connection.execute(
+                'INSERT INTO videos VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (stats_folder, video_path or overall_stats.get('video_path'), processed_at or time.time(),
+                 overall_stats.get('total_frames_processed'), overall_stats.get('total_faces_detected'),
+                 sum(summary.get('total_frames_processed') or 0 for summary in face_summaries),
+                 dominant_emotion, profile.get('name') if isinstance(profile, dict) else profile,
+                 overall_stats.get('stats_format')))
+            connection.executemany(
+                'INSERT INTO video_emotions VALUES (?, ?, ?, ?)',
+                [(stats_folder, emotion, frames, confidence) for emotion, (frames, confidence) in emotions.items()])
+            for summary in face_summaries:
+                face_id = summary['face_id']
+                connection.execute(
+                    'INSERT INTO faces VALUES (?, ?, ?, ?, ?, ?)',
+                    (stats_folder, face_id, summary.get('total_frames_processed'),
+                     summary.get('most_common_emotion'), summary.get('average_age'),
+                     summary.get('most_common_gender')))
+                counts = summary.get('emotion_counts') or {}
+                confidences = summary.get('average_confidences') or {}
+                connection.executemany(
+                    'INSERT INTO face_emotions VALUES (?, ?, ?, ?, ?)',
+                    [(stats_folder, face_id, emotion, counts.get(emotion, 0), confidences.get(emotion))
+                     for emotion in set(counts) | set(confidences)])
+
+    @staticmethod
+    def _delete(connection, stats_folder):
+        for table in ('videos', 'video_emotions', 'faces', 'face_emotions'):
+            connection.execute(f'DELETE FROM {table} WHERE stats_folder = ?', (stats_folder,))
+
+    def remove(self, stats_folder):
+        with closing(self._connect()) as connection, connection:
+            self._delete(connection, os.path.normpath(stats_folder))
+
+    def add_folder(self, stats_folder):
+        """Index a stats folder from its JSON files (for folders written before the index existed)."""
+        overall_stats_path = os.path.join(stats_folder, 'overall_statistics.json')
+        with open(overall_stats_path, 'r') as f:
+            overall_stats = json.load(f)
+        face_summaries = []
+        for face_id in overall_stats.get('faces', []):
+            with open(summary_path(stats_folder, face_id), 'r') as f:
+                face_summaries.append(json.load(f))
+        self.add(stats_folder, overall_stats, face_summaries, processed_at=os.path.getmtime(overall_stats_path))
+
+    def backfill(self, root, skip_indexed=True):
+        """Index every stats folder under root; returns (indexed, skipped, failed) counts."""
+        indexed = self.indexed_folders() if skip_indexed else set()
+        counts = [0, 0, 0]
+        for folder, _, files in os.walk(root):
+            if 'overall_statistics.json' not in files:
+                continue
+            if os.path.normpath(folder) in indexed:
+                counts[1] += 1
+                continue
+            try:
+                self.add_folder(folder)
+                counts[0] += 1
+            except (OSError, ValueError, KeyError) as e:
+                logging.warning(f"Could not index {folder}: {e}")
+                counts[2] += 1
+        return tuple(counts)
+
+    def indexed_folders(self):
+        with closing(self._connect()) as connection:
+            return {row[0] for row in connection.execute('SELECT stats_folder FROM videos')}
+
+    @staticmethod
+    def _order_by(sort, columns, emotion_table, key_columns):
+        """ORDER BY clause, join and parameters for a sort spec; ValueError for unknown sorts."""
+        descending = sort.startswith('-')
+        sort = sort.lstrip('-')
+        direction = 'DESC' if descending else 'ASC'
+        if sort in columns:
+            return f'ORDER BY t.{sort} {direction}, t.rowid', '', []
+        kind, _, emotion = sort.partition(':')
+        if kind in ('confidence', 'frames') and emotion:
+            column = 'average_confidence' if kind == 'confidence' else 'frames'
+            condition = ' AND '.join(f's.{key} = t.{key}' for key in key_columns)
+            join = f'LEFT JOIN {emotion_table} s ON {condition} AND s.emotion = ?'
+            return f'ORDER BY s.{column} IS NULL, s.{column} {direction}, t.rowid', join, [emotion]
+        raise ValueError(f"sort must be one of {list(columns)} or confidence:<emotion> / frames:<emotion>, "
+                         f"optionally prefixed with '-' for descending order")
+
+    def _page(self, table, emotion_table, key_columns, filters, sort, columns, limit, offset):
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        offset = max(0, int(offset))
+        order_by, join, join_params = self._order_by(sort, columns, emotion_table, key_columns)
+        where = ' AND '.join(condition for condition, _ in filters) or '1'
+        params = [value for _, values in filters for value in values]
+        with closing(self._connect()) as connection:
+            total = connection.execute(f'SELECT COUNT(*) FROM {table} t WHERE {where}', params).fetchone()[0]
+            rows = connection.execute(
+                f'SELECT t.* FROM {table} t {join} WHERE {where} {order_by} LIMIT ? OFFSET ?',
+                join_params + params + [limit, offset]).fetchall()
+            items = [dict(row) for row in rows]
+            for item in items:
+                condition = ' AND '.join(f'{key} = ?' for key in key_columns)
+                item['emotions'] = {
+                    row['emotion']: {"frames": row['frames'], "average_confidence": row['average_confidence']}
+                    for row in connection.execute(f'SELECT emotion, frames, average_confidence FROM {emotion_table} '
+                                                  f'WHERE {condition}', [item[key] for key in key_columns])}
+        return {"total": total, "limit": limit, "offset": offset, "items": items}
+
+    @staticmethod
+    def _emotion_filter(table, key_columns, emotion, min_confidence):
+        condition = ' AND '.join(f'e.{key} = t.{key}' for key in key_columns)
+        return (f'EXISTS (SELECT 1 FROM {table} e WHERE {condition} AND e.emotion = ? '
+                f'AND e.average_confidence >= ?)', [emotion, min_confidence])
+
+    def videos(self, dominant_emotion=None, profile=None, min_faces=None, max_faces=None, folder_prefix=None,
+               emotion=None, min_confidence=None, sort='-processed_at', limit=50, offset=0):
+        """
+        One page of indexed videos, each with its per-emotion frame counts and average
+        confidences. emotion/min_confidence keep videos whose average confidence for emotion
+        is at least min_confidence.
+        """
+        filters = []
+        if dominant_emotion:
+            filters.append(('t.dominant_emotion = ?', [dominant_emotion]))
+        if profile:
+            filters.append(('t.profile = ?', [profile]))
+        if min_faces is not None:
+            filters.append(('t.total_faces_detected >= ?', [min_faces]))
+        if max_faces is not None:
+            filters.append(('t.total_faces_detected <= ?', [max_faces]))
+        if folder_prefix:
+            filters.append(("t.stats_folder LIKE ? ESCAPE '\\'", [_like_prefix(os.path.normpath(folder_prefix))]))
+        if emotion and min_confidence is not None:
+            filters.append(self._emotion_filter('video_emotions', ('stats_folder',), emotion, min_confidence))
+        return self._page('videos', 'video_emotions', ('stats_folder',), filters, sort, VIDEO_SORT_COLUMNS,
+                          limit, offset)
+
+    def faces(self, stats_folder=None, dominant_emotion=None, min_frames=None, max_frames=None, gender=None,
+              emotion=None, min_confidence=None, sort='-total_frames', limit=50, offset=0):
+        """One page of indexed faces across all videos (or of one stats_folder)."""
+        filters = []
+        if stats_folder:
+            filters.append(('t.stats_folder = ?', [os.path.normpath(stats_folder)]))
+        if dominant_emotion:
+            filters.append(('t.dominant_emotion = ?', [dominant_emotion]))
+        if min_frames is not None:
+            filters.append(('t.total_frames >= ?', [min_frames]))
+        if max_frames is not None:
+            filters.append(('t.total_frames <= ?', [max_frames]))
+        if gender:
+            filters.append(('t.gender = ?', [gender]))
+        if emotion and min_confidence is not None:
+            filters.append(self._emotion_filter('face_emotions', ('stats_folder', 'face_id'), emotion,
+                                                min_confidence))
+        return self._page('faces', 'face_emotions', ('stats_folder', 'face_id'), filters, sort,
+                          FACE_SORT_COLUMNS, limit, offset)
+
+    def video(self, stats_folder):
+        """The indexed video of stats_folder with its emotions, or None if it is not indexed."""
+        with closing(self._connect()) as connection:
+            row = connection.execute('SELECT * FROM videos WHERE stats_folder = ?',
+                                     (os.path.normpath(stats_folder),)).fetchone()
+            if row is None:
+                return None
+            video = dict(row)
+            video['emotions'] = {
+                row['emotion']: {"frames": row['frames'], "average_confidence": row['average_confidence']}
+                for row in connection.execute('SELECT emotion, frames, average_confidence FROM video_emotions '
+                                              'WHERE stats_folder = ?', (video['stats_folder'],))}
+        return video
+
+    def summary(self):
+        """Indexed video and face counts and the number of videos per dominant emotion."""
+        with closing(self._connect()) as connection:
+            return {
+                "videos": connection.execute('SELECT COUNT(*) FROM videos').fetchone()[0],
+                "faces": connection.execute('SELECT COUNT(*) FROM faces').fetchone()[0],
+                "videos_by_dominant_emotion": {
+                    row[0]: row[1] for row in connection.execute(
+                        'SELECT dominant_emotion, COUNT(*) FROM videos GROUP BY dominant_emotion')},
+            }
+
+
+def _like_prefix(prefix):
+    return prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
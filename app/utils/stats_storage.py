@@ -0,0 +1,146 @@
+import base64
+import json
+import os
+
+import numpy as np
+
+from utils.emotion_timeline import save_timeline, timeline_folder
+
+# Storage formats for per-face statistics
+BINARY = 'binary'  # Small JSON summary + NumPy series + packed thumbnail blob
+JSON = 'json'  # Legacy: everything, including base64 thumbnails, inside the JSON file
+STATS_FORMATS = (BINARY, JSON)
+
+THUMBNAILS_BLOB = 'thumbnails.bin'
+THUMBNAILS_INDEX = 'thumbnails_index.npy'
+FACE_EMBEDDING = 'face_embedding.npy'
+
+
+def summary_path(output_folder, face_id):
+    return os.path.join(output_folder, f"face_{face_id}_statistics.json")
+
+
+def data_folder(output_folder, face_id):
+    """Folder holding the binary arrays and thumbnails of one face."""
+    return os.path.join(output_folder, face_id)
+
+
+def save_face_statistics(output_folder, face_id, face_statistics, series, thumbnails, stats_format=BINARY,
+                         timeline=None, face_embedding=None):
+    """
+    Write one face's statistics.
+
+    Args:
+        output_folder (str): Stats folder of the video.
+        face_id (str): Face identifier, e.g. "face_1".
+        face_statistics (dict): JSON-serializable summary (averages, counts, ...).
+        series (dict): name -> (labels or None, np.ndarray) per-frame series, e.g.
+            {"emotion": (["angry", ...], array of shape (frames, 7)), "age": (None, array of shape (frames,))}.
+        thumbnails (list of bytes): JPEG-encoded face thumbnails.
+        stats_format (str): BINARY or JSON.
+        timeline (tuple): (frame_index, timestamp_ms, emotion, labels) of the full emotion
+            timeline; written with its aggregates to <face_id>/timeline/ in either format
+            and described under "timeline" in the summary.
+        face_embedding (tuple): (model name, vector) identity embedding of the face; written
+            to <face_id>/face_embedding.npy in either format.
+    """
+    if timeline is not None:
+        face_statistics = dict(face_statistics)
+        folder = timeline_folder(data_folder(output_folder, face_id))
+        face_statistics["timeline"] = dict(save_timeline(folder, *timeline),
+                                           folder=os.path.relpath(folder, output_folder))
+    if face_embedding is not None:
+        model_name, embedding = face_embedding
+        face_statistics = dict(face_statistics)
+        os.makedirs(data_folder(output_folder, face_id), exist_ok=True)
+        np.save(os.path.join(data_folder(output_folder, face_id), FACE_EMBEDDING), np.asarray(embedding))
+        face_statistics["face_embedding"] = {"model": model_name, "file": FACE_EMBEDDING, "dim": len(embedding)}
+
+    if stats_format == JSON:
+        face_statistics = dict(face_statistics)
+        face_statistics["thumbnails"] = [base64.b64encode(t).decode('utf-8') for t in thumbnails]
+        with open(summary_path(output_folder, face_id), "w") as f:
+            json.dump(face_statistics, f, indent=4)
+        return
+
+    if stats_format != BINARY:
+        raise ValueError(f"Unknown statistics format: {stats_format}")
+
+    folder = data_folder(output_folder, face_id)
+    os.makedirs(folder, exist_ok=True)
+
+    # Per-frame series as plain .npy files so they can be memory-mapped
+    series_index = {}
+    for name, (labels, values) in series.items():
+        file_name = f"{name}.npy"
+        np.save(os.path.join(folder, file_name), np.asarray(values))
+        series_index[name] = {"file": file_name, "labels": labels, "shape": list(np.shape(values))}
+
+    # Thumbnails packed into one blob, with an offset index (N + 1 offsets)
+    offsets = np.zeros(len(thumbnails) + 1, dtype=np.int64)
+    with open(os.path.join(folder, THUMBNAILS_BLOB), "wb") as f:
+        for i, thumbnail in enumerate(thumbnails):
+            f.write(thumbnail)
+            offsets[i + 1] = offsets[i] + len(thumbnail)
+    np.save(os.path.join(folder, THUMBNAILS_INDEX), offsets)
+
+    face_statistics = dict(face_statistics)
+    face_statistics["storage"] = {
+        "format": BINARY,
+        "data_folder": face_id,
+        "series": series_index,
+        "thumbnail_count": len(thumbnails),
+    }
+    with open(summary_path(output_folder, face_id), "w") as f:
+        json.dump(face_statistics, f, indent=4)
+
+
+def load_series(output_folder, face_statistics, name, mmap=True):
+    """Load one per-frame series of a face written in BINARY format (memory-mapped by default)."""
+    storage = face_statistics["storage"]
+    entry = storage["series"][name]
+    path = os.path.join(output_folder, storage["data_folder"], entry["file"])
+    return np.load(path, mmap_mode='r' if mmap else None)
+
+
+def read_thumbnails(output_folder, face_statistics, start=0, count=None):
+    """
+    Return JPEG bytes of thumbnails [start, start + count) of one face, for either format.
+    """
+    storage = face_statistics.get("storage")
+    if storage is None:
+        # Legacy JSON format with inline base64 thumbnails
+        encoded = face_statistics.get("thumbnails", [])
+        stop = len(encoded) if count is None else start + count
+        return [base64.b64decode(t) for t in encoded[start:stop]]
+
+    folder = os.path.join(output_folder, storage["data_folder"])
+    offsets = np.load(os.path.join(folder, THUMBNAILS_INDEX), mmap_mode='r')
+    total = len(offsets) - 1
+    stop = total if count is None else min(total, start + count)
+    if start >= stop:
+        return []
+
+    thumbnails = []
+    with open(os.path.join(folder, THUMBNAILS_BLOB), "rb") as f:
+        f.seek(int(offsets[start]))
+        blob = f.read(int(offsets[stop] - offsets[start]))
+    base = int(offsets[start])
+    for i in range(start, stop):
+        thumbnails.append(blob[int(offsets[i]) - base:int(offsets[i + 1]) - base])
+    return thumbnails
+
+
+def read_face_statistics(output_folder, face_statistics, thumbnails=0, series=False):
+    """
+    Build the /get_stats view of one face: the summary, plus up to ``thumbnails``
+    base64 thumbnails and the raw per-frame series when requested.
+    """
+    view = {k: v for k, v in face_statistics.items() if k != "thumbnails"}
+    if thumbnails:
+        view["thumbnails"] = [base64.b64encode(t).decode('utf-8')
+                              for t in read_thumbnails(output_folder, face_statistics, 0, thumbnails)]
+    if series and "storage" in face_statistics:
+        view["series"] = {name: load_series(output_folder, face_statistics, name, mmap=False).tolist()
+                          for name in face_statistics["storage"]["series"]}
+    return view
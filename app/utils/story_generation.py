@@ -0,0 +1,157 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from utils.metrics import timed
+from utils.micro_batching import MicroBatcher
+from utils.model_registry import get_story_generator
+
+
+def build_story_prompt(overall_stats):
+    """Story prompt for an overall_statistics.json dict (dominant emotion and emotion distribution)."""
+    dominant_emotion = overall_stats.get('dominant_emotion', 'unknown')
+    emotion_stats = overall_stats.get('emotion_stats', {})
+    prompt = f"In a financial domain where the dominant emotion is {dominant_emotion}, "
+    prompt += f"with the following emotion distribution: {emotion_stats}, "
+    prompt += "a story unfolds:"
+    return prompt
+
+
+class TTLCache:
+    """LRU cache of at most max_entries values that also expire ttl seconds after being stored."""
+
+    def __init__(self, max_entries=256, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (stored_at, value), least recently used first
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class StoryGenerator:
+    """
+    GPT-2 story generation with a prompt-keyed cache and request batching.
+
+    generate() answers from the cache when it can (fresh=True always samples a new story),
+    joins an identical prompt that is already being generated, and otherwise queues the
+    prompt on a MicroBatcher so concurrent requests share one padded pipeline call.
+    stream() yields the story text as tokens are decoded; each stream is its own
+    model.generate call (the token streamer handles a single sequence), and at most
+    max_streams of them run at once on the shared pipeline, later ones waiting for a slot.
+    """
+
+    def __init__(self, max_length=200, max_batch_size=8, max_wait=0.05, cache_size=256, cache_ttl=3600,
+                 max_streams=1):
+        self.max_length = max_length
+        self._stream_slots = threading.BoundedSemaphore(max(1, max_streams))
+        self.cache = TTLCache(cache_size, cache_ttl)
+        self.batcher = MicroBatcher(self._generate_batch, max_batch_size, max_wait, name='story-batcher')
+        self._in_flight = {}  # prompt -> Future of a non-fresh generation
+        self._lock = threading.Lock()
+
+    def generate(self, prompt, fresh=False, timeout=None):
+        """(story, cached) for prompt."""
+        if not fresh:
+            story = self.cache.get(prompt)
+            if story is not None:
+                return story, True
+            with self._lock:
+                future = self._in_flight.get(prompt)
+                if future is None:
+                    future = self._in_flight[prompt] = self.batcher.submit(self.max_length, prompt)
+                    future.add_done_callback(lambda _: self._forget(prompt))
+        else:
+            future = self.batcher.submit(self.max_length, prompt)
+        return future.result(timeout), False
+
+    def _forget(self, prompt):
+        with self._lock:
+            self._in_flight.pop(prompt, None)
+
+    def _generate_batch(self, max_length, prompts):
+        pipe = get_story_generator()
+        if pipe.tokenizer.pad_token_id is None:
+            # GPT-2 has no padding token; pad on the left so every prompt ends where generation starts
+            pipe.tokenizer.pad_token_id = pipe.model.config.eos_token_id
+            pipe.tokenizer.padding_side = 'left'
+        with timed('gpt2_generation'):
+            outputs = pipe(prompts, max_length=max_length, num_return_sequences=1, batch_size=len(prompts))
+        stories = [output[0]['generated_text'] for output in outputs]
+        for prompt, story in zip(prompts, stories):
+            self.cache.put(prompt, story)
+        return stories
+
+    def stream(self, prompt, fresh=False):
+        """Generator of story text chunks: the prompt, then the text of each decoded token."""
+        if not fresh:
+            story = self.cache.get(prompt)
+            if story is not None:
+                yield story
+                return
+
+        from transformers import TextIteratorStreamer
+        pipe = get_story_generator()
+        streamer = TextIteratorStreamer(pipe.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        inputs = pipe.tokenizer(prompt, return_tensors='pt').to(pipe.model.device)
+
+        errors = []
+
+        def run():
+            try:
+                with timed('gpt2_generation'):
+                    pipe.model.generate(**inputs, streamer=streamer, max_length=self.max_length, do_sample=True,
+                                        pad_token_id=pipe.tokenizer.eos_token_id)
+            except Exception:
+                logging.exception("Story streaming failed")
+                errors.append(True)
+                streamer.end()
+            finally:
+                # Held until generation ends, even if the client stopped reading
+                self._stream_slots.release()
+
+        self._stream_slots.acquire()
+        thread = threading.Thread(target=run, name='story-stream', daemon=True)
+        try:
+            thread.start()
+        except Exception:
+            self._stream_slots.release()
+            raise
+        chunks = [prompt]
+        yield prompt
+        for text in streamer:
+            chunks.append(text)
+            yield text
+        thread.join()
+        if not errors:
+            self.cache.put(prompt, ''.join(chunks))
+
+    def stats(self):
+        return {"cache": self.cache.stats(), "batching": self.batcher.stats()}
@@ -1,133 +1,73 @@
-import cv2
-from PIL import Image
-import torch
-from transformers import AutoImageProcessor, AutoModelForImageClassification
-import numpy as np
-import time
-from collections import Counter
-import matplotlib.pyplot as plt
-from matplotlib.animation import FuncAnimation
-
-# Load the model and processor
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-model_name = "motheecreator/vit-Facial-Expression-Recognition"
-model = AutoModelForImageClassification.from_pretrained(model_name).to(device)
-processor = AutoImageProcessor.from_pretrained(model_name)
+"""
+Live facial emotion recognition from a camera or a video file.
 
-# Initialize face detector
-face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+Runs utils.live_emotion.LiveEmotionEngine on the source, prints a status line at a
+fixed rate and saves the embeddings and statistics when done.
 
-# Function to preprocess frames and predict emotions
-def predict_emotion_from_frame(frame):
-    try:
-        # Convert OpenCV frame (BGR) to PIL image (RGB)
-        pil_image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-        # Preprocess the image
-        inputs = processor(images=pil_image, return_tensors="pt").to(device)
-        # Predict
-        with torch.no_grad():
-            outputs = model(**inputs)
-        # Softmax probabilities
-        probs = torch.nn.functional.softmax(outputs.logits, dim=1)[0]
-        predicted_class = probs.argmax().item()
-        confidence = probs[predicted_class].item()
-        label = model.config.id2label[predicted_class]
-        return label, confidence, probs.cpu().numpy()  # Return probabilities
-    except Exception as e:
-        return f"Error: {e}", 0, np.zeros(len(model.config.id2label))
+Usage (from the app folder):
+    python -m utils.video_emotion_recognition_livefeed --source 0 --duration 60
+    python -m utils.video_emotion_recognition_livefeed --source uploads/webcam_video.mp4
+"""
+import argparse
+import json
+import time
 
-# OpenCV video capture
-cap = cv2.VideoCapture(0)  # 0 is the default camera. Change for external cameras.
+import numpy as np
 
-# Parameters
-duration = 60  # in seconds
-start_time = time.time()
+from utils.live_emotion import CaptureSource, LiveEmotionEngine
+from utils.similarity_index import embedding_labels_path
 
-# Data collection
-emotion_data = []
-embedding_data = []
 
-# Set up matplotlib real-time chart
-plt.ion()
-fig, ax = plt.subplots()
-labels = list(model.config.id2label.values())
-emotion_counts = {label: 0 for label in labels}
-bars = ax.bar(emotion_counts.keys(), emotion_counts.values())
-ax.set_title("Real-Time Emotion Distribution")
-ax.set_ylabel("Count")
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', default='0', help="Camera index or video file path")
+    parser.add_argument('--duration', type=float, default=60, help="Seconds to run (0 = until the source ends)")
+    parser.add_argument('--update-interval', type=float, default=1.0)
+    parser.add_argument('--embeddings', default='emotion_embeddings.npy')
+    parser.add_argument('--statistics', default='emotion_statistics.txt')
+    args = parser.parse_args()
 
-def update_chart():
-    for bar, label in zip(bars, labels):
-        bar.set_height(emotion_counts[label])
-    plt.pause(0.01)
+    source = CaptureSource(int(args.source) if args.source.isdigit() else args.source)
+    engine = LiveEmotionEngine(source, update_interval=args.update_interval,
+                               duration=args.duration or None).start()
 
-print("Running video feed for 1 minute. Press 'q' to quit early.")
-while cap.isOpened():
-    ret, frame = cap.read()
-    if not ret:
-        break
-    
-    # Detect faces
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(50, 50))
-    
-    for (x, y, w, h) in faces:
-        # Crop the face
-        face_frame = frame[y:y+h, x:x+w]
-        emotion, confidence, probabilities = predict_emotion_from_frame(face_frame)
-        
-        # Record data
-        emotion_data.append((emotion, confidence))
-        embedding_data.append(probabilities)  # Probabilistic facial embeddings
-        emotion_counts[emotion] += 1
-        
-        # Display emotion on video
-        cv2.putText(frame, f"{emotion} ({confidence * 100:.1f}%)", (x, y - 10),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 0, 0), 2)
-        cv2.rectangle(frame, (x, y), (x + w, y + h), (255, 0, 0), 2)
-    
-    # Show the video frame
-    cv2.imshow("Facial Emotion Recognition", frame)
-    
-    # Update real-time chart
-    update_chart()
-    
-    # Break if 'q' is pressed or time exceeds 1 minute
-    if cv2.waitKey(1) & 0xFF == ord('q') or time.time() - start_time > duration:
-        break
+    print(f"Running live emotion recognition on {args.source}. Press Ctrl+C to stop early.")
+    try:
+        while engine.running:
+            snapshot = engine.snapshot()
+            print(f"frames={snapshot['frames_processed']} faces={snapshot['faces_processed']} "
+                  f"fps={snapshot['frames_per_second']:.1f} emotion={snapshot['most_common_emotion']}")
+            time.sleep(args.update_interval)
+    except KeyboardInterrupt:
+        engine.stop()
+    engine.join()
 
-# Release resources
-cap.release()
-cv2.destroyAllWindows()
+    snapshot = engine.snapshot()
+    if snapshot['error']:
+        print(f"Stopped with error: {snapshot['error']}")
+    if not snapshot['faces_processed']:
+        print("No data collected. Check the video feed or camera settings.")
+        return
 
-# Generate statistics
-if emotion_data:
-    # Extract emotions and confidences
-    emotions = [e[0] for e in emotion_data]
-    confidences = [e[1] for e in emotion_data]
-    
-    # Most common emotion
-    most_common_emotion = Counter(emotions).most_common(1)[0]
-    
-    # Average confidence
-    avg_confidence = np.mean(confidences)
-    
-    # Probabilistic embedding as a numpy array
-    embedding_data = np.array(embedding_data)
-    
+    most_common = snapshot['most_common_emotion']
+    embeddings = engine.embeddings.values()
     print("\nStatistics:")
-    print(f"Most Common Emotion: {most_common_emotion[0]} ({most_common_emotion[1]} times)")
-    print(f"Average Confidence: {avg_confidence * 100:.2f}%")
-    print(f"Total Frames Processed: {len(emotion_data)}")
-    
-    print("\nProbabilistic Embeddings Shape:", embedding_data.shape)
-    print("Embedding Example (First Frame):", embedding_data[0])
-else:
-    print("No data collected. Check the video feed or camera settings.")
+    print(f"Most Common Emotion: {most_common} ({snapshot['emotion_counts'][most_common]} times)")
+    print(f"Average Confidence: {snapshot['average_confidence'] * 100:.2f}%")
+    print(f"Total Faces Processed: {snapshot['faces_processed']}")
+    print(f"Frames per second: {snapshot['frames_per_second']:.2f}")
+    print("\nProbabilistic Embeddings Shape:", embeddings.shape)
+
+    # Save embeddings and statistics for further analysis
+    np.save(args.embeddings, embeddings)
+    # The column order, so the rows can be added to a similarity index (backfill_stats_index.py)
+    with open(embedding_labels_path(args.embeddings), 'w') as f:
+        json.dump(engine.labels, f)
+    with open(args.statistics, 'w') as f:
+        f.write(f"Most Common Emotion: {most_common} ({snapshot['emotion_counts'][most_common]} times)\n")
+        f.write(f"Average Confidence: {snapshot['average_confidence'] * 100:.2f}%\n")
+        f.write(f"Total Faces Processed: {snapshot['faces_processed']}\n")
+
 
-# Save embeddings and statistics for further analysis
-np.save("emotion_embeddings.npy", embedding_data)
-with open("emotion_statistics.txt", "w") as f:
-    f.write(f"Most Common Emotion: {most_common_emotion[0]} ({most_common_emotion[1]} times)\n")
-    f.write(f"Average Confidence: {avg_confidence * 100:.2f}%\n")
-    f.write(f"Total Frames Processed: {len(emotion_data)}\n")
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+import queue
+import threading
+import time
+
+from utils.profiling import track_thread
+
+_SENTINEL = object()
+_POLL_SECONDS = 0.1
+
+
+class PipelineStage:
+    """
+    One stage of a Pipeline: ``workers`` threads applying ``fn`` to items from a bounded
+    input queue.
+
+    Ordered stages run on a single worker and see items in source order, which is what
+    stateful steps (e.g. face tracking) need. Batched stages hand ``fn`` a list of payloads
+    whose total ``batch_weight`` reaches ``batch_size`` (or whatever was queued within
+    ``batch_timeout`` seconds) and expect a list of results back.
+    """
+
+    def __init__(self, name, fn, workers=1, ordered=False, batch_size=1, batch_weight=None,
+                 batch_timeout=0.05, queue_size=8):
+        self.name = name
+        self.fn = fn
+        self.workers = 1 if ordered else max(1, int(workers))
+        self.ordered = ordered
+        self.batch_size = max(1, int(batch_size))
+        self.batch_weight = batch_weight or (lambda payload: 1)
+        self.batch_timeout = batch_timeout
+        self.input = queue.Queue(maxsize=queue_size)
+
+        self._lock = threading.Lock()
+        self._active_workers = self.workers
+        self.processed = 0
+        self.busy_seconds = 0.0
+        self.started_at = None
+        self.finished_at = None
+
+    def record(self, count, seconds):
+        with self._lock:
+            self.processed += count
+            self.busy_seconds += seconds
+
+    def stats(self):
+        """Throughput and queue depth counters for progress reporting."""
+        with self._lock:
+            if self.started_at is None:
+                elapsed = 0.0
+            else:
+                elapsed = (self.finished_at or time.perf_counter()) - self.started_at
+            return {
+                "workers": self.workers,
+                "processed": self.processed,
+                "busy_seconds": round(self.busy_seconds, 3),
+                "throughput_per_sec": round(self.processed / elapsed, 3) if elapsed > 0 else 0.0,
+                "queue_depth": self.input.qsize(),
+                "queue_capacity": self.input.maxsize,
+            }
+
+
+class Pipeline:
+    """
+    Producer-consumer pipeline: a source iterator (run on its own thread as the "decode"
+    stage) feeds a chain of PipelineStages connected by bounded queues.
+
+    Items are tagged with their source sequence number and ``run`` yields the final
+    payloads in source order, so the output is the same whatever the worker counts.
+    The first exception raised by any stage stops the pipeline and is re-raised by ``run``.
+    """
+
+    def __init__(self, queue_size=8):
+        self.queue_size = queue_size
+        self.stages = []
+        self.source_stage = PipelineStage('decode', None, queue_size=1)
+        self._stop = threading.Event()
+        self._error = None
+        self._threads = []
+
+    def add_stage(self, name, fn, **options):
+        options.setdefault('queue_size', self.queue_size)
+        self.stages.append(PipelineStage(name, fn, **options))
+        return self
+
+    def stats(self):
+        stats = {self.source_stage.name: self.source_stage.stats()}
+        stats[self.source_stage.name]["queue_depth"] = None
+        for stage in self.stages:
+            stats[stage.name] = stage.stats()
+        return stats
+
+    def _fail(self, error):
+        if self._error is None:
+            self._error = error
+        self._stop.set()
+
+    def _put(self, q, item):
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                continue
+        return _SENTINEL
+
+    def _run_source(self, source, out_queue):
+        stage = self.source_stage
+        stage.started_at = time.perf_counter()
+        try:
+            iterator = iter(source)
+            seq = 0
+            while not self._stop.is_set():
+                start = time.perf_counter()
+                try:
+                    payload = next(iterator)
+                except StopIteration:
+                    break
+                stage.record(1, time.perf_counter() - start)
+                if not self._put(out_queue, (seq, payload)):
+                    break
+                seq += 1
+        except Exception as e:
+            self._fail(e)
+        finally:
+            stage.finished_at = time.perf_counter()
+            self._put(out_queue, _SENTINEL)
+
+    def _collect_batch(self, stage, first):
+        """Gather more items after ``first`` until the batch is full. Returns (items, saw_sentinel)."""
+        items = [first]
+        weight = stage.batch_weight(first[1])
+        while weight < stage.batch_size:
+            try:
+                item = stage.input.get(timeout=stage.batch_timeout)
+            except queue.Empty:
+                break
+            if item is _SENTINEL:
+                return items, True
+            items.append(item)
+            weight += stage.batch_weight(item[1])
+        return items, False
+
+    def _apply(self, stage, items):
+        start = time.perf_counter()
+        if stage.batch_size > 1:
+            results = stage.fn([payload for _, payload in items])
+        else:
+            results = [stage.fn(payload) for _, payload in items]
+        stage.record(len(items), time.perf_counter() - start)
+        return [(seq, result) for (seq, _), result in zip(items, results)]
+
+    def _run_worker(self, stage, out_queue):
+        pending = {}  # Ordered stages: items waiting for their predecessors
+        next_seq = 0
+        try:
+            while not self._stop.is_set():
+                item = self._get(stage.input)
+                if item is _SENTINEL:
+                    # Let sibling workers see the end of the stream too
+                    stage.input.put(_SENTINEL)
+                    break
+
+                saw_sentinel = False
+                if stage.batch_size > 1:
+                    items, saw_sentinel = self._collect_batch(stage, item)
+                else:
+                    items = [item]
+
+                if stage.ordered:
+                    for seq, payload in items:
+                        pending[seq] = payload
+                    items = []
+                    while next_seq in pending:
+                        items.append((next_seq, pending.pop(next_seq)))
+                        next_seq += 1
+
+                for result in self._apply(stage, items):
+                    if not self._put(out_queue, result):
+                        return
+
+                if saw_sentinel:
+                    stage.input.put(_SENTINEL)
+                    break
+        except Exception as e:
+            self._fail(e)
+        finally:
+            with stage._lock:
+                stage._active_workers -= 1
+                last = stage._active_workers == 0
+            if last:
+                stage.finished_at = time.perf_counter()
+                self._put(out_queue, _SENTINEL)
+
+    def run(self, source):
+        """Run the pipeline over ``source`` and yield the final payloads in source order."""
+        output = queue.Queue(maxsize=self.queue_size)
+        queues = [stage.input for stage in self.stages] + [output]
+
+        self._threads = [threading.Thread(target=self._run_source, args=(source, queues[0]),
+                                          name='pipeline-decode', daemon=True)]
+        for i, stage in enumerate(self.stages):
+            stage.started_at = time.perf_counter()
+            for w in range(stage.workers):
+                self._threads.append(threading.Thread(target=self._run_worker, args=(stage, queues[i + 1]),
+                                                      name=f'pipeline-{stage.name}-{w}', daemon=True))
+        for thread in self._threads:
+            thread.start()
+            track_thread(thread)  # Profiled with the job that runs this pipeline, if it is profiled
+
+        pending = {}
+        next_seq = 0
+        try:
+            while True:
+                item = self._get(output)
+                if item is _SENTINEL:
+                    break
+                seq, payload = item
+                pending[seq] = payload
+                while next_seq in pending:
+                    yield pending.pop(next_seq)
+                    next_seq += 1
+        finally:
+            self._stop.set()
+            for thread in self._threads:
+                thread.join()
+
+        if self._error is not None:
+            raise self._error
+        # Anything left means a stage dropped an item; flush in order rather than lose it
+        for seq in sorted(pending):
+            yield pending[seq]
@@ -0,0 +1,291 @@
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+from utils.batched_analysis import BatchedFaceAnalyzer
+from utils.face_detectors import RETINAFACE, FaceDetector
+from utils.frame_sampling import AUTO, FrameSampler
+from utils.live_emotion import CaptureSource
+from utils.realtime import RealtimeReader
+from utils.stats_storage import load_series
+
+# Overlay sources
+NONE = 'none'      # Plain frames
+LIVE = 'live'      # Run RetinaFace + the emotion model on the streamed frames
+CACHED = 'cached'  # Draw the per-frame results of an already processed video
+ANNOTATION_MODES = (NONE, LIVE, CACHED)
+
+BOUNDARY = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
+
+
+class CachedAnnotations:
+    """
+    Per-frame boxes and dominant emotions of a processed stats folder (BINARY format).
+    Frames between two analyzed frames show the results of the previous analyzed frame.
+    """
+
+    def __init__(self, stats_folder):
+        with open(os.path.join(stats_folder, 'overall_statistics.json'), 'r') as f:
+            overall_stats = json.load(f)
+
+        by_frame = {}
+        for face_id in overall_stats.get('faces', []):
+            with open(os.path.join(stats_folder, f"face_{face_id}_statistics.json"), 'r') as f:
+                face_statistics = json.load(f)
+            series = face_statistics.get('storage', {}).get('series', {})
+            if 'box' not in series:
+                continue  # JSON format or written before boxes were stored
+            frame_indices = load_series(stats_folder, face_statistics, 'frame_index')
+            boxes = load_series(stats_folder, face_statistics, 'box')
+            emotions = load_series(stats_folder, face_statistics, 'emotion')
+            labels = series['emotion']['labels']
+            for frame_index, box, scores in zip(frame_indices, boxes, emotions):
+                if box[0] < 0:
+                    continue
+                best = int(np.argmax(scores))
+                by_frame.setdefault(int(frame_index), []).append(
+                    (tuple(int(v) for v in box), labels[best], float(scores[best]) / 100))
+
+        self.frames = sorted(by_frame)
+        self.by_frame = by_frame
+        gaps = np.diff(self.frames) if len(self.frames) > 1 else [1]
+        self.max_gap = int(np.max(gaps))
+
+    def __call__(self, frame, frame_index):
+        position = bisect.bisect_right(self.frames, frame_index) - 1
+        if position < 0 or frame_index - self.frames[position] > self.max_gap:
+            return []
+        return self.by_frame[self.frames[position]]
+
+
+class LiveAnnotations:
+    """Detect faces (RetinaFace by default) and classify their emotion on each streamed frame."""
+
+    def __init__(self, detector=RETINAFACE, detection_size=None):
+        self.detector = FaceDetector(detector, detection_size)
+        self.analyzer = BatchedFaceAnalyzer(actions=('emotion',))
+
+    def __call__(self, frame, frame_index):
+        boxes = self.detector.detect(frame)
+        crops = [frame[y1:y2, x1:x2] for x1, y1, x2, y2 in boxes]
+        annotations = []
+        for box, analysis in zip(boxes, self.analyzer.analyze(crops)):
+            if analysis is None:
+                continue
+            label = analysis['dominant_emotion']
+            annotations.append((box, label, analysis['emotion'][label] / 100))
+        return annotations
+
+
+def draw_annotations(frame, annotations, scale=1.0):
+    for (x1, y1, x2, y2), label, confidence in annotations:
+        x1, y1, x2, y2 = (int(v * scale) for v in (x1, y1, x2, y2))
+        cv2.rectangle(frame, (x1, y1), (x2, y2), (255, 0, 0), 2)
+        cv2.putText(frame, f"{label} ({confidence * 100:.1f}%)", (x1, max(y1 - 10, 10)),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 0, 0), 2)
+
+
+class SharedVideoStream:
+    """
+    One decode/annotate/encode producer for a video, shared by every client watching it
+    with the same options.
+
+    The producer thread replays the video at its own frame rate (every frame_interval-th
+    frame, or through a RealtimeReader when ``realtime``), draws the annotations, resizes
+    to ``width`` and JPEG-encodes each frame once; clients always get the latest encoded
+    frame, so a slow client skips frames instead of slowing the others down. The resize
+    buffer is allocated once and reused for every frame. The producer stops
+    when the video ends or its last client disconnects.
+    """
+
+    def __init__(self, video_path, annotator=None, width=None, quality=80, frame_interval=1,
+                 sampling=AUTO, realtime=False, target_latency=0.2, on_close=None):
+        self.video_path = video_path
+        self.annotator = annotator
+        self.width = width
+        self.encode_params = [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)]
+        self.frame_interval = max(int(frame_interval), 1)
+        self.sampling = sampling
+        self.realtime = realtime
+        self.target_latency = target_latency
+        self.on_close = on_close
+
+        self._cond = threading.Condition()
+        self._part = None
+        self._sequence = 0
+        self._finished = False
+        self._clients = 0
+        self._resized = None
+        self.reader = None
+        self.error = None
+        self.frames_encoded = 0
+        self.client_drops = 0
+        self.started_at = time.time()
+
+        source = CaptureSource(video_path)  # Raises ValueError for unreadable videos
+        self._thread = threading.Thread(target=self._produce, args=(source,), name='video-stream', daemon=True)
+        self._thread.start()
+
+    def _frames(self, source):
+        if self.realtime:
+            self.reader = RealtimeReader(source, self.target_latency, pace_fps=source.realtime_fps)
+            while True:
+                ret, frame = self.reader.read()
+                if not ret:
+                    return
+                yield self.reader.last_frame_number, frame
+                self.reader.frame_done()
+        else:
+            period = self.frame_interval / (source.realtime_fps or 25.0)
+            next_frame_at = time.monotonic()
+            for frame_index, frame in FrameSampler(source.cap, self.sampling, self.frame_interval):
+                yield frame_index, frame
+                next_frame_at += period
+                time.sleep(max(0.0, next_frame_at - time.monotonic()))
+
+    def _resize(self, frame):
+        """Downscale to the output width into a reused buffer; returns (frame, scale)."""
+        height, width = frame.shape[:2]
+        if not self.width or self.width >= width:
+            return frame, 1.0
+        scale = self.width / width
+        size = (self.width, int(round(height * scale)))
+        if self._resized is None or self._resized.shape[:2] != (size[1], size[0]):
+            self._resized = np.empty((size[1], size[0], 3), dtype=frame.dtype)
+        return cv2.resize(frame, size, dst=self._resized, interpolation=cv2.INTER_AREA), scale
+
+    def _produce(self, source):
+        try:
+            for frame_index, frame in self._frames(source):
+                if self._finished:
+                    break
+                # Annotations are computed on (and in coordinates of) the full-resolution frame
+                annotations = self.annotator(frame, frame_index) if self.annotator is not None else []
+                frame, scale = self._resize(frame)
+                draw_annotations(frame, annotations, scale)
+                ret, buffer = cv2.imencode('.jpg', frame, self.encode_params)
+                if not ret:
+                    continue
+                part = b''.join((BOUNDARY, buffer.tobytes(), b'\r\n'))
+                with self._cond:
+                    self._part = part
+                    self._sequence += 1
+                    self.frames_encoded += 1
+                    self._cond.notify_all()
+        except Exception as e:
+            logging.exception(f"Video stream for {self.video_path} failed")
+            self.error = str(e)
+        finally:
+            if self.reader is not None:
+                self.reader.release()
+            source.release()
+            with self._cond:
+                self._finished = True
+                self._cond.notify_all()
+            if self.on_close is not None:
+                self.on_close(self)
+
+    def subscribe(self):
+        """Generator of multipart MJPEG parts for one client."""
+        with self._cond:
+            self._clients += 1
+        last_sequence = 0
+        try:
+            while True:
+                with self._cond:
+                    while self._sequence == last_sequence and not self._finished:
+                        self._cond.wait()
+                    if self._sequence == last_sequence:
+                        return
+                    if last_sequence:
+                        self.client_drops += self._sequence - last_sequence - 1
+                    last_sequence = self._sequence
+                    part = self._part
+                yield part
+        finally:
+            with self._cond:
+                self._clients -= 1
+                if self._clients == 0:
+                    # Nobody is watching any more; let the producer stop
+                    self._finished = True
+                    self._cond.notify_all()
+
+    @property
+    def finished(self):
+        return self._finished
+
+    def stats(self):
+        with self._cond:
+            stats = {
+                "video_path": self.video_path,
+                "clients": self._clients,
+                "frames_encoded": self.frames_encoded,
+                "client_dropped_frames": self.client_drops,
+                "finished": self._finished,
+                "error": self.error,
+            }
+        if self.reader is not None:
+            stats["realtime"] = self.reader.stats()
+        return stats
+
+
+class StreamHub:
+    """
+    SharedVideoStreams by (video, options), so identical requests share one producer.
+    Producers are created outside the hub's lock (opening a video or loading models can be
+    slow): while one is starting its key holds a threading.Event that identical requests
+    wait on, and requests for other keys are not blocked.
+    """
+
+    def __init__(self, history=20):
+        self._streams = {}  # key -> SharedVideoStream, or an Event while it is being created
+        self._lock = threading.Lock()
+        self.recent = deque(maxlen=history)
+
+    def subscribe(self, key, factory):
+        """Client generator for the stream under key, starting it with factory(on_close) if needed."""
+        while True:
+            with self._lock:
+                stream = self._streams.get(key)
+                if isinstance(stream, threading.Event):
+                    starting = stream
+                elif stream is not None and not stream.finished:
+                    return stream.subscribe()
+                else:
+                    starting = None
+                    placeholder = self._streams[key] = threading.Event()
+            if starting is None:
+                break
+            # Another request is creating this stream; use it once it exists
+            starting.wait()
+
+        try:
+            stream = factory(lambda closed: self._closed(key, closed))
+        except BaseException:
+            with self._lock:
+                if self._streams.get(key) is placeholder:
+                    del self._streams[key]
+            placeholder.set()
+            raise
+        with self._lock:
+            self._streams[key] = stream
+        placeholder.set()
+        return stream.subscribe()
+
+    def _closed(self, key, stream):
+        with self._lock:
+            if self._streams.get(key) is stream:
+                del self._streams[key]
+        self.recent.append(stream.stats())
+
+    def stats(self):
+        with self._lock:
+            streams = [stream for stream in self._streams.values() if not isinstance(stream, threading.Event)]
+        return {"active": [stream.stats() for stream in streams], "recent": list(self.recent)}